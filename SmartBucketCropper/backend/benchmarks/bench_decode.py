@@ -0,0 +1,99 @@
+"""
+缩减解码基准测试
+对比缩略图 / 裁剪预览在完整解码与缩减解码下的延迟 (按格式)
+
+用法:
+    cd SmartBucketCropper/backend
+    python benchmarks/bench_decode.py --width 6000 --height 4000 --repeat 5
+"""
+import os
+import io
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from services.image_processor import get_image_thumbnail, render_crop_preview
+
+FORMATS = [('JPEG', '.jpg'), ('PNG', '.png'), ('WEBP', '.webp')]
+
+
+def make_image(path: str, fmt: str, width: int, height: int):
+    """生成带细节的合成图片 (纯色图片的解码开销不具代表性)"""
+    base = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 1.0, 1.2), 64)
+    noise = Image.effect_noise((width, height), 48)
+    img = Image.merge('RGB', (base, noise, Image.linear_gradient('L').resize((width, height))))
+    img.save(path, fmt, quality=90)
+
+
+def legacy_thumbnail(image_path: str, max_size: int = 200) -> bytes:
+    """完整解码后缩放 (关闭 reducing_gap，即不使用缩减解码)"""
+    with Image.open(image_path) as img:
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS, reducing_gap=None)
+        img = img.convert('RGB')
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=85)
+        return buffer.getvalue()
+
+
+def legacy_preview(image_path: str, crop: dict, bucket_width: int, bucket_height: int) -> bytes:
+    """完整解码 + 裁剪 + 缩放"""
+    with Image.open(image_path) as img:
+        cropped = img.crop((crop['x'], crop['y'], crop['x'] + crop['width'], crop['y'] + crop['height']))
+        cropped.thumbnail((min(bucket_width, 400), min(bucket_height, 400)), Image.Resampling.LANCZOS)
+        cropped = cropped.convert('RGB')
+        buffer = io.BytesIO()
+        cropped.save(buffer, format='JPEG', quality=85)
+        return buffer.getvalue()
+
+
+def measure(fn, repeat: int) -> float:
+    """返回中位数延迟 (毫秒)"""
+    fn()  # 预热
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="缩减解码基准测试")
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    crop = {
+        'x': args.width // 8,
+        'y': args.height // 8,
+        'width': args.width * 3 // 4,
+        'height': args.height * 3 // 4
+    }
+
+    print(f"源图 {args.width}x{args.height}，每项取 {args.repeat} 次中位数 (毫秒)")
+    print(f"{'格式':<6}{'缩略图(完整)':>14}{'缩略图(缩减)':>14}{'预览(完整)':>12}{'预览(缩减)':>12}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt, ext in FORMATS:
+            path = os.path.join(tmp, 'bench' + ext)
+            make_image(path, fmt, args.width, args.height)
+
+            row = [
+                measure(lambda: legacy_thumbnail(path), args.repeat),
+                measure(lambda: get_image_thumbnail(path), args.repeat),
+                measure(lambda: legacy_preview(path, crop, 1024, 1024), args.repeat),
+                measure(lambda: render_crop_preview(path, crop, 1024, 1024), args.repeat),
+            ]
+            print(f"{fmt:<6}" + ''.join(f"{value:>14.1f}" for value in row[:2])
+                  + ''.join(f"{value:>12.1f}" for value in row[2:]))
+
+
+if __name__ == '__main__':
+    main()
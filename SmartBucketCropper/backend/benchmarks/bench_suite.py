@@ -0,0 +1,392 @@
+"""
+端到端基准测试
+在合成数据集上测量各阶段 (扫描、分桶、缩略图、导出) 与 HTTP 接口 (进程内客户端) 的
+吞吐量 (张/秒)、p50 / p99 延迟和峰值内存 (RSS)，结果写入 JSON 文件以便对比多次运行
+
+每个阶段在独立的子进程中运行，峰值内存只反映该阶段 (包括其工作进程)
+
+用法:
+    cd SmartBucketCropper/backend
+    python benchmarks/bench_suite.py --count 500 --resolution 512-3000 -o results.json
+    python benchmarks/bench_suite.py --count 500 -o new.json --compare results.json
+    python benchmarks/bench_suite.py --stages scan,export --dataset /tmp/sbc-bench
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from benchmarks.synthetic import generate_dataset, parse_formats, parse_resolution
+
+RESULTS_VERSION = 1
+
+STAGES = (
+    'scan', 'scan_indexed', 'analyze', 'thumbnail', 'export',
+    'http_scan', 'http_thumbnail', 'http_export',
+)
+
+# 导出阶段使用的桶数
+N_BUCKETS = 3
+
+
+def peak_rss_mb() -> Optional[float]:
+    """当前进程及已结束的子进程的峰值 RSS (MB)，不支持的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    # Linux 为 KB，macOS 为字节
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(usage / scale, 1)
+
+
+def summarize(count: int, seconds: float, latencies: List[float]) -> Dict[str, Any]:
+    """吞吐量与延迟分位数 (latencies 单位为秒)"""
+    result = {
+        'count': count,
+        'seconds': round(seconds, 4),
+        'images_per_second': round(count / seconds, 2) if seconds > 0 else None,
+        'p50_ms': None,
+        'p99_ms': None,
+        'samples': len(latencies),
+    }
+    if latencies:
+        values = np.array(latencies) * 1000
+        result['p50_ms'] = round(float(np.percentile(values, 50)), 3)
+        result['p99_ms'] = round(float(np.percentile(values, 99)), 3)
+    return result
+
+
+def timed(fn: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    value = fn(*args, **kwargs)
+    return value, time.perf_counter() - start
+
+
+def _sample(items: List, size: int) -> List:
+    """均匀抽样 (可复现)"""
+    if len(items) <= size:
+        return list(items)
+    step = len(items) / size
+    return [items[int(i * step)] for i in range(size)]
+
+
+def _export_plan(images: List[Dict[str, Any]], n_buckets: int):
+    """分桶并为每张图片生成默认裁剪区域，返回 (导出图片列表, 桶配置)"""
+    from services.bucket_analyzer import analyze_buckets, assign_images_to_buckets
+    from services.image_processor import calculate_default_crop
+
+    buckets = analyze_buckets(images, n_buckets=n_buckets)
+    assign_images_to_buckets(images, buckets)
+    bucket_map = {bucket['id']: bucket for bucket in buckets}
+    export_images = []
+    for img in images:
+        bucket = bucket_map[img['assigned_bucket']]
+        crop = calculate_default_crop(img['width'], img['height'], bucket['width'] / bucket['height'])
+        export_images.append({
+            'path': img['path'],
+            'filename': img['filename'],
+            'assigned_bucket': img['assigned_bucket'],
+            'cropped': True,
+            'crop_params': crop
+        })
+    sizes = {bucket['id']: {'width': bucket['width'], 'height': bucket['height']} for bucket in buckets}
+    return export_images, sizes
+
+
+def _scan(dataset: str, workers: Optional[int], use_index: bool = False):
+    from services.bucket_analyzer import scan_folder_with_report
+    images, _ = scan_folder_with_report(dataset, workers=workers, use_index=use_index)
+    return images
+
+
+def stage_scan(dataset: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """不使用扫描索引的完整扫描，延迟为单张图片的尺寸探测"""
+    from services.image_probe import probe_image_size
+
+    images, seconds = timed(_scan, dataset, options['workers'])
+    latencies = []
+    for img in _sample(images, options['sample']):
+        _, elapsed = timed(probe_image_size, img['path'])
+        latencies.append(elapsed)
+    return summarize(len(images), seconds, latencies)
+
+
+def stage_scan_indexed(dataset: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """扫描索引已建立时的重复扫描，延迟为每次完整扫描"""
+    from services.scan_index import INDEX_FILENAME
+
+    index_path = os.path.join(dataset, INDEX_FILENAME)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(index_path + suffix):
+            os.remove(index_path + suffix)
+    _scan(dataset, options['workers'], use_index=True)
+
+    latencies = []
+    count = 0
+    for _ in range(options['repeat']):
+        images, elapsed = timed(_scan, dataset, options['workers'], True)
+        latencies.append(elapsed)
+        count += len(images)
+    return summarize(count, sum(latencies), latencies)
+
+
+def stage_analyze(dataset: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """分桶优化 + 分配，延迟为每次对整个数据集的分析"""
+    from services.image_table import ImageTable
+    from services.bucket_analyzer import analyze_buckets, assign_table_to_buckets
+
+    table = ImageTable.from_records(_scan(dataset, options['workers'], use_index=True))
+
+    def analyze():
+        buckets = analyze_buckets(table, n_buckets=N_BUCKETS)
+        assign_table_to_buckets(table, buckets)
+
+    latencies = [timed(analyze)[1] for _ in range(options['repeat'])]
+    return summarize(len(table) * len(latencies), sum(latencies), latencies)
+
+
+def stage_thumbnail(dataset: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """未缓存的缩略图生成 (抽样)"""
+    from services.image_processor import get_image_thumbnail
+
+    images = _sample(_scan(dataset, options['workers'], use_index=True), options['sample'])
+    latencies = [timed(get_image_thumbnail, img['path'])[1] for img in images]
+    return summarize(len(latencies), sum(latencies), latencies)
+
+
+def stage_export(dataset: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    完整导出的吞吐量 (并行，包括复制伴随文件)，
+    延迟为抽样图片的单张裁剪缩放编码
+    """
+    from services.image_processor import process_batch_export, crop_and_resize_image
+
+    images, buckets = _export_plan(_scan(dataset, options['workers'], use_index=True), N_BUCKETS)
+    output_dir = tempfile.mkdtemp(prefix='sbc-bench-export-')
+    try:
+        result, seconds = timed(
+            process_batch_export, images, buckets, output_dir, workers=options['workers']
+        )
+        latencies = []
+        sample_dir = os.path.join(output_dir, 'sample')
+        os.makedirs(sample_dir)
+        for img in _sample(images, options['sample']):
+            bucket = buckets[img['assigned_bucket']]
+            _, elapsed = timed(
+                crop_and_resize_image, img['path'], img['crop_params'], bucket['width'], bucket['height'],
+                os.path.join(sample_dir, img['filename'])
+            )
+            latencies.append(elapsed)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    summary = summarize(result['success'], seconds, latencies)
+    summary['failed'] = result['failed']
+    summary['encode_seconds'] = result.get('encode_seconds')
+    summary['bytes_written'] = result.get('bytes_written')
+    return summary
+
+
+def _client():
+    from fastapi.testclient import TestClient
+    from main import app
+    return TestClient(app)
+
+
+def _check(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+    return response
+
+
+def stage_http_scan(dataset: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """POST /api/scan/folder (扫描索引已建立)，延迟为每次请求"""
+    client = _client()
+    body = {'folder_path': dataset, 'probe_workers': options['workers'], 'n_buckets': N_BUCKETS}
+    _check(client.post('/api/scan/folder', json=body))
+
+    latencies = []
+    count = 0
+    for _ in range(options['repeat']):
+        response, elapsed = timed(client.post, '/api/scan/folder', json=body)
+        count += _check(response).json()['total_count']
+        latencies.append(elapsed)
+    return summarize(count, sum(latencies), latencies)
+
+
+def stage_http_thumbnail(dataset: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """GET /api/scan/thumbnail (缓存为空)，之后再测一遍命中缓存的延迟"""
+    client = _client()
+    images = _sample(_scan(dataset, options['workers'], use_index=True), options['sample'])
+
+    def fetch(img):
+        return _check(client.get(f"/api/scan/thumbnail/{img['path']}", params={'size': 200}))
+
+    latencies = [timed(fetch, img)[1] for img in images]
+    summary = summarize(len(latencies), sum(latencies), latencies)
+    cached = [timed(fetch, img)[1] for img in images]
+    summary['cached'] = summarize(len(cached), sum(cached), cached)
+    return summary
+
+
+def stage_http_export(dataset: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """POST /api/export/batch 导出整个数据集 (单次请求)"""
+    client = _client()
+    images, buckets = _export_plan(_scan(dataset, options['workers'], use_index=True), N_BUCKETS)
+    output_dir = tempfile.mkdtemp(prefix='sbc-bench-http-export-')
+    body = {'images': images, 'buckets': buckets, 'output_dir': output_dir, 'workers': options['workers']}
+    try:
+        response, seconds = timed(client.post, '/api/export/batch', json=body)
+        result = _check(response).json()
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    summary = summarize(result['success'], seconds, [seconds])
+    summary['failed'] = result['failed']
+    return summary
+
+
+STAGE_FUNCTIONS = {name: globals()[f"stage_{name}"] for name in STAGES}
+
+
+def _run_stage(name: str, dataset: str, options: Dict[str, Any], state_dir: str) -> Dict[str, Any]:
+    """子进程入口: 隔离服务端状态 (缩略图缓存、会话数据库、计划目录) 后运行阶段"""
+    for env, subdir in (
+        ('SBC_THUMBNAIL_CACHE_DIR', 'thumbnails'),
+        ('SBC_SESSION_DB', 'sessions.db'),
+        ('SBC_PLAN_DIR', 'plans'),
+    ):
+        os.environ[env] = os.path.join(state_dir, name, subdir)
+    result = STAGE_FUNCTIONS[name](dataset, options)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_stage(name: str, dataset: str, options: Dict[str, Any], state_dir: str) -> Dict[str, Any]:
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(_run_stage, name, dataset, options, state_dir).result()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]):
+    """打印与基准结果的对比 (吞吐量比值 > 1 表示更快，延迟比值 < 1 表示更快)"""
+    print(f"\n对比 {baseline['meta'].get('git_commit') or '?'} -> {results['meta'].get('git_commit') or '?'}")
+    print(f"{'阶段':<16}{'吞吐量':>12}{'p50':>10}{'p99':>10}{'峰值内存':>12}")
+    for name, stage in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            continue
+        ratios = []
+        for key in ('images_per_second', 'p50_ms', 'p99_ms', 'peak_rss_mb'):
+            if stage.get(key) and base.get(key):
+                ratios.append(f"x{stage[key] / base[key]:.2f}")
+            else:
+                ratios.append('-')
+        print(f"{name:<16}{ratios[0]:>12}{ratios[1]:>10}{ratios[2]:>10}{ratios[3]:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端基准测试")
+    parser.add_argument('--dataset', help="合成数据集目录 (默认在临时目录中按参数生成并复用)")
+    parser.add_argument('--count', type=int, default=200, help="图片数量")
+    parser.add_argument('--formats', default='jpeg=0.6,png=0.2,webp=0.2', help="格式比例")
+    parser.add_argument('--resolution', default='512-2048', help="长边像素，固定值或范围 (对数均匀分布)")
+    parser.add_argument('--companions', type=float, default=0.5, help="带 .txt 伴随文件的图片比例")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', default=','.join(STAGES), help="要运行的阶段 (逗号分隔)")
+    parser.add_argument('--workers', type=int, default=None, help="扫描 / 导出并发数")
+    parser.add_argument('--repeat', type=int, default=5, help="整体阶段 (重复扫描、分桶、HTTP 扫描) 的重复次数")
+    parser.add_argument('--sample', type=int, default=100, help="测量单张延迟的抽样图片数")
+    parser.add_argument('-o', '--output', default='bench_results.json', help="结果 JSON 文件")
+    parser.add_argument('--compare', help="与之前的结果文件对比")
+    args = parser.parse_args()
+
+    stages = [name.strip() for name in args.stages.split(',') if name.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        print(f"错误: 未知的阶段 {', '.join(sorted(unknown))}，可选 {', '.join(STAGES)}", file=sys.stderr)
+        return 2
+    try:
+        formats = parse_formats(args.formats)
+        long_side = parse_resolution(args.resolution)
+    except ValueError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+
+    dataset = args.dataset or os.path.join(
+        tempfile.gettempdir(),
+        f"sbc-bench-{args.count}-{args.resolution}-{args.seed}"
+    )
+    dataset = os.path.abspath(dataset)
+    print(f"数据集: {dataset}")
+    dataset_info, seconds = timed(
+        generate_dataset, dataset, args.count, formats, long_side, args.companions, args.seed
+    )
+    print(f"数据集就绪 ({seconds:.1f}s): {dataset_info['format_counts']}")
+
+    options = {'workers': args.workers, 'repeat': args.repeat, 'sample': args.sample}
+    results = {
+        'version': RESULTS_VERSION,
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'dataset': dataset_info,
+            'options': options,
+        },
+        'stages': {}
+    }
+
+    state_dir = tempfile.mkdtemp(prefix='sbc-bench-state-')
+    try:
+        for name in stages:
+            stage = run_stage(name, dataset, options, state_dir)
+            results['stages'][name] = stage
+            print(
+                f"{name:<16}{stage['images_per_second'] or 0:>10.1f} 张/秒  "
+                f"p50 {stage['p50_ms'] or 0:>9.2f}ms  p99 {stage['p99_ms'] or 0:>9.2f}ms  "
+                f"峰值内存 {stage['peak_rss_mb'] or 0:.0f}MB"
+            )
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
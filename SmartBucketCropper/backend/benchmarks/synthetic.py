@@ -0,0 +1,164 @@
+"""
+合成数据集
+按给定的数量、格式比例和分辨率分布生成可复现的测试图片 (同一参数和随机种子生成相同的数据集)
+
+用法:
+    cd SmartBucketCropper/backend
+    python benchmarks/synthetic.py /tmp/sbc-dataset --count 1000 --formats jpeg=0.6,png=0.2,webp=0.2 --resolution 512-4096
+"""
+import os
+import sys
+import json
+import argparse
+from typing import Dict, Any, Tuple
+
+import numpy as np
+from PIL import Image
+
+# 格式 -> (Pillow 格式名, 扩展名)
+SYNTHETIC_FORMATS = {
+    'jpeg': ('JPEG', '.jpg'),
+    'png': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp'),
+    'bmp': ('BMP', '.bmp'),
+    'tiff': ('TIFF', '.tiff'),
+}
+
+# 常见的长宽比 (横向和纵向各占一半)
+ASPECT_RATIOS = (1.0, 4 / 3, 3 / 2, 16 / 9, 2.0, 3.0)
+
+# 每个子目录的图片数 (模拟按目录分片的数据集)
+IMAGES_PER_DIR = 500
+
+# 记录生成参数的文件 (参数相同时复用已生成的数据集)
+DATASET_META = '.synthetic.json'
+
+
+def parse_formats(value: str) -> Dict[str, float]:
+    """解析 jpeg=0.6,png=0.4 形式的格式比例"""
+    weights = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip().lower()
+        if name not in SYNTHETIC_FORMATS:
+            raise ValueError(f"不支持的格式: {name}，可选 {', '.join(SYNTHETIC_FORMATS)}")
+        weights[name] = float(weight) if weight else 1.0
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("格式比例之和必须大于 0")
+    return {name: weight / total for name, weight in weights.items()}
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    """长边范围: 2048 (固定) 或 512-4096 (对数均匀分布)"""
+    low, _, high = value.partition('-')
+    low = int(low)
+    high = int(high) if high else low
+    if low < 16 or high < low:
+        raise ValueError(f"无效的分辨率范围: {value}")
+    return low, high
+
+
+def _image_sizes(rng: np.random.Generator, count: int, long_side: Tuple[int, int]) -> np.ndarray:
+    low, high = long_side
+    sides = np.exp(rng.uniform(np.log(low), np.log(high) + 1e-9, count)).astype(np.int64)
+    ratios = rng.choice(ASPECT_RATIOS, count)
+    short = np.maximum(16, (sides / ratios).astype(np.int64))
+    portrait = rng.random(count) < 0.5
+    widths = np.where(portrait, short, sides)
+    heights = np.where(portrait, sides, short)
+    return np.stack([widths, heights], axis=1)
+
+
+def _render(width: int, height: int, seed: int) -> Image.Image:
+    """带噪声和渐变的图片 (纯色图片的编解码开销不具代表性)"""
+    noise = Image.effect_noise((width, height), 32 + seed % 32)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    radial = Image.radial_gradient('L').resize((width, height))
+    return Image.merge('RGB', (noise, gradient, radial))
+
+
+def generate_dataset(
+    root: str,
+    count: int,
+    formats: Dict[str, float],
+    long_side: Tuple[int, int],
+    companion_ratio: float = 0.5,
+    seed: int = 0
+) -> Dict[str, Any]:
+    """
+    生成合成数据集，参数相同的数据集已存在时直接复用
+
+    Returns:
+        数据集信息 (参数、各格式数量、像素总数)
+    """
+    meta = {
+        'count': count,
+        'formats': formats,
+        'long_side': list(long_side),
+        'companion_ratio': companion_ratio,
+        'seed': seed
+    }
+    meta_path = os.path.join(root, DATASET_META)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            existing = json.load(f)
+        if existing.get('params') == meta:
+            return existing
+    except (OSError, ValueError):
+        pass
+
+    rng = np.random.default_rng(seed)
+    sizes = _image_sizes(rng, count, long_side)
+    names = list(formats)
+    kinds = rng.choice(len(names), count, p=[formats[name] for name in names])
+    companions = rng.random(count) < companion_ratio
+
+    format_counts = {name: 0 for name in names}
+    for i in range(count):
+        directory = os.path.join(root, f"part{i // IMAGES_PER_DIR:04d}")
+        os.makedirs(directory, exist_ok=True)
+        name = names[kinds[i]]
+        pil_format, ext = SYNTHETIC_FORMATS[name]
+        width, height = (int(v) for v in sizes[i])
+        stem = os.path.join(directory, f"img{i:06d}")
+        _render(width, height, seed + i).save(stem + ext, pil_format, quality=90)
+        if companions[i]:
+            with open(stem + '.txt', 'w', encoding='utf-8') as f:
+                f.write(f"synthetic image {i}, {width}x{height}\n")
+        format_counts[name] += 1
+
+    info = {
+        'params': meta,
+        'format_counts': format_counts,
+        'total_pixels': int((sizes[:, 0] * sizes[:, 1]).sum())
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成数据集")
+    parser.add_argument('root', help="输出目录")
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--formats', default='jpeg=0.6,png=0.2,webp=0.2', help="格式比例")
+    parser.add_argument('--resolution', default='512-2048', help="长边像素，固定值或范围 (对数均匀分布)")
+    parser.add_argument('--companions', type=float, default=0.5, help="带 .txt 伴随文件的图片比例")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        info = generate_dataset(
+            args.root, args.count, parse_formats(args.formats), parse_resolution(args.resolution),
+            args.companions, args.seed
+        )
+    except ValueError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+    print(json.dumps(info, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,363 @@
+"""
+SmartBucketCropper 命令行
+无需浏览器即可完成 扫描 → 分桶 → 导出，供批量训练流水线使用
+
+用法:
+    cd SmartBucketCropper/backend
+    python cli.py scan /data/raw --buckets 5
+    python cli.py plan /data/raw -o plan.npz --buckets 5 --max-pixels 1048576
+    python cli.py export plan.npz /data/bucketed --workers 16
+
+退出码: 0 成功，1 有图片处理失败，2 参数或输入错误，130 被中断
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.bucket_analyzer import (
+    iter_scan_batches,
+    analyze_buckets,
+    assign_table_to_buckets,
+    DEFAULT_SCAN_BATCH_SIZE,
+    DEFAULT_UPSCALE_PENALTY
+)
+from services.image_probe import PROBE_EXECUTORS
+from services.image_table import ImageTable
+from services.duplicates import find_duplicate_groups, unique_indices, describe_groups, DEFAULT_DUPLICATE_DISTANCE
+from services.crop_plan import CropPlan
+from services.export_manifest import ExportManifest
+from services.image_processor import process_plan_export, normalize_scales
+from services.shard_export import process_shard_export, shard_settings, SHARD_INDEX_FILENAME
+from services.companions import COMPANION_LINK_MODES
+from services.encoders import resolve_encoder, ENCODER_PROFILES, OUTPUT_FORMATS, SUBSAMPLING_MODES
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+# 进度输出间隔 (秒): 终端中原地刷新，重定向到日志时按行输出
+PROGRESS_INTERVAL = 1.0
+PROGRESS_LOG_INTERVAL = 10.0
+
+
+class Progress:
+    """在标准错误输出上按间隔输出进度"""
+
+    def __init__(self, label: str, enabled: bool = True):
+        self.label = label
+        self.enabled = enabled
+        self.interactive = sys.stderr.isatty()
+        self.interval = PROGRESS_INTERVAL if self.interactive else PROGRESS_LOG_INTERVAL
+        self.start = time.perf_counter()
+        self._last = self.start
+
+    def update(self, done: int, total: int, force: bool = False):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        elapsed = now - self.start
+        rate = done / elapsed if elapsed > 0 else 0.0
+        percent = done * 100 / total if total else 100.0
+        line = f"{self.label} {done}/{total} ({percent:.1f}%, {rate:.1f} 张/秒)"
+        sys.stderr.write(f"\r{line}" if self.interactive else f"{line}\n")
+        sys.stderr.flush()
+
+    def finish(self, done: int, total: int):
+        self.update(done, total, force=True)
+        if self.enabled and self.interactive:
+            sys.stderr.write('\n')
+
+
+def _parse_capacities(values: Optional[List[str]]) -> Optional[Dict[str, int]]:
+    """解析 --capacity A=5000 形式的容量参数"""
+    if not values:
+        return None
+    capacities = {}
+    for value in values:
+        bucket_id, sep, limit = value.partition('=')
+        if not sep or not limit.isdigit():
+            raise ValueError(f"容量格式应为 桶ID=数量: {value}")
+        capacities[bucket_id.strip()] = int(limit)
+    return capacities
+
+
+def scan_table(args) -> Tuple[ImageTable, Dict[str, Any]]:
+    """
+    扫描文件夹，只保留分桶所需的列
+    指定 --dedupe 时排除近重复的图片 (每组只保留像素数最大的一张)，重复组写入报告的 duplicate_groups
+    """
+    if not os.path.isdir(args.folder):
+        raise ValueError(f"文件夹不存在: {args.folder}")
+
+    report = {}
+    paths, widths, heights, hashes = [], [], [], []
+    progress = Progress("扫描", enabled=not args.quiet)
+    for batch in iter_scan_batches(
+        args.folder,
+        workers=args.workers,
+        executor=args.executor,
+        use_index=not args.no_index,
+        batch_size=DEFAULT_SCAN_BATCH_SIZE,
+        report=report,
+        compute_hashes=args.dedupe
+    ):
+        for img in batch:
+            paths.append(img['path'])
+            widths.append(img['width'])
+            heights.append(img['height'])
+            if args.dedupe:
+                hashes.append(img.get('dhash'))
+        progress.update(report.get('scanned', 0), report.get('files', 0))
+    progress.finish(report.get('files', 0), report.get('files', 0))
+
+    if not paths:
+        raise ValueError("文件夹中没有找到支持的图片格式")
+    table = ImageTable(paths=paths, widths=widths, heights=heights)
+
+    if args.dedupe:
+        groups = find_duplicate_groups(hashes, (table.widths * table.heights).tolist(), args.dedupe_distance)
+        report['duplicate_groups'] = describe_groups(groups, table.paths)
+        report['duplicates'] = sum(len(group['duplicates']) for group in groups)
+        table = table.take(unique_indices(len(table), groups))
+    return table, report
+
+
+def build_buckets(table: ImageTable, args) -> List[Dict[str, Any]]:
+    buckets = analyze_buckets(table, n_buckets=args.buckets, max_pixels=args.max_pixels)
+    assign_table_to_buckets(table, buckets, _parse_capacities(args.capacity), args.upscale_penalty)
+    return buckets
+
+
+def print_summary(report: Dict[str, Any], buckets: List[Dict[str, Any]]):
+    print(f"文件 {report['files']} 个，失败 {report['failed']} 个，"
+          f"耗时 {report['elapsed_seconds']}s ({report['images_per_second']} 张/秒，索引命中 {report['index_hits']})")
+    print(f"{'桶':<4}{'尺寸':>12}{'图片数':>10}{'保留像素':>10}{'需放大':>8}")
+    for bucket in buckets:
+        stats = bucket.get('stats', {})
+        size = f"{bucket['width']}x{bucket['height']}"
+        print(f"{bucket['id']:<4}{size:>12}{bucket['image_count']:>10}"
+              f"{stats.get('retained_ratio', 0) * 100:>9.1f}%{stats.get('upscaled_count', 0):>8}")
+    if 'duplicates' in report:
+        print(f"近重复 {len(report['duplicate_groups'])} 组，排除 {report['duplicates']} 张")
+
+
+def cmd_scan(args) -> int:
+    """扫描并输出推荐的桶配置"""
+    table, report = scan_table(args)
+    buckets = build_buckets(table, args)
+
+    if args.json:
+        report = dict(report, errors=report['errors'][:100])
+        if 'duplicate_groups' in report:
+            report['duplicate_groups'] = report['duplicate_groups'][:100]
+        print(json.dumps({'scan_stats': report, 'buckets': buckets}, ensure_ascii=False, indent=2))
+    else:
+        print_summary(report, buckets)
+    return EXIT_OK
+
+
+def cmd_plan(args) -> int:
+    """扫描、分桶并写入裁剪计划"""
+    table, report = scan_table(args)
+    buckets = build_buckets(table, args)
+
+    plan = CropPlan.from_table(table, buckets, meta={
+        'source_folder': os.path.abspath(args.folder),
+        'created_at': time.time(),
+        'n_buckets': args.buckets,
+        'max_pixels': args.max_pixels
+    })
+    plan.save(args.output)
+
+    if not args.quiet:
+        print_summary(report, buckets)
+    print(f"已写入裁剪计划 {args.output} ({len(plan)} 张图片)")
+    return EXIT_OK
+
+
+def cmd_export(args) -> int:
+    """按裁剪计划批量导出"""
+    plan = CropPlan.load(args.plan)
+    total = len(plan)
+    encoder = resolve_encoder(
+        args.encoder,
+        format=args.format,
+        quality=args.quality,
+        compress_level=args.png_compress_level,
+        subsampling=args.subsampling
+    )
+    scales = normalize_scales(args.scale)
+    shards = None
+    if args.shards:
+        if scales is not None:
+            raise ValueError("分片输出不支持多分辨率导出 (--scale)")
+        shards = shard_settings(args.shard_max_samples, args.shard_max_mb)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    # 分片输出使用自己的续传状态，不使用导出清单
+    manifest = ExportManifest(args.output_dir) if shards is None else None
+    if manifest is not None and args.no_resume:
+        manifest.invalidate()
+
+    progress = Progress("导出", enabled=not args.quiet)
+    cancel_event = threading.Event()
+    outcome: Dict[str, Any] = {}
+
+    def processed(results: Dict[str, Any]) -> int:
+        return results['success'] + results['failed'] + results['skipped'] + results['up_to_date']
+
+    def on_progress(results: Dict[str, Any]):
+        progress.update(processed(results), total)
+
+    def run():
+        try:
+            if shards is not None:
+                outcome['results'] = process_shard_export(
+                    args.output_dir,
+                    plan=plan,
+                    copy_companions=not args.no_companions,
+                    workers=args.workers,
+                    resume=not args.no_resume,
+                    prune=not args.no_prune,
+                    progress_callback=on_progress,
+                    cancel_event=cancel_event,
+                    companion_extensions=args.companion_ext,
+                    encoder=encoder,
+                    **shards
+                )
+            else:
+                outcome['results'] = process_plan_export(
+                    plan,
+                    output_dir=args.output_dir,
+                    copy_companions=not args.no_companions,
+                    workers=args.workers,
+                    manifest=manifest,
+                    progress_callback=on_progress,
+                    cancel_event=cancel_event,
+                    prune=not args.no_prune,
+                    companion_extensions=args.companion_ext,
+                    companion_link=args.companion_link,
+                    encoder=encoder,
+                    scales=scales
+                )
+        except Exception as e:
+            outcome['error'] = e
+
+    # 导出在后台线程执行，主线程等待并响应 Ctrl+C
+    worker = threading.Thread(target=run, name="export", daemon=True)
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(0.2)
+    except KeyboardInterrupt:
+        print("\n正在取消，等待进行中的图片完成...", file=sys.stderr)
+        cancel_event.set()
+        worker.join()
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+    if 'error' in outcome:
+        raise outcome['error']
+
+    results = outcome['results']
+    progress.finish(processed(results), total)
+    print(f"成功 {results['success']}，失败 {results['failed']}，已是最新 {results['up_to_date']}，"
+          f"跳过 {results['skipped']}，删除旧输出 {results['removed']} → {args.output_dir}")
+    if shards is not None:
+        print(f"分片 {results['shards']} 个，分片列表: {os.path.join(args.output_dir, SHARD_INDEX_FILENAME)}")
+    if results['success']:
+        print(f"编码耗时 {results['encode_seconds']:.1f}s，写入 {results['bytes_written'] / 1024 / 1024:.1f} MB "
+              f"(平均 {results['bytes_written'] / results['success'] / 1024:.1f} KB/张)")
+    for error in results['errors'][:20]:
+        print(f"  {error}", file=sys.stderr)
+
+    if results['cancelled']:
+        return EXIT_INTERRUPTED
+    return EXIT_FAILED if results['failed'] else EXIT_OK
+
+
+def _add_scan_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('folder', help="数据集根目录")
+    parser.add_argument('--workers', type=int, default=None, help="探测并发数")
+    parser.add_argument('--executor', choices=PROBE_EXECUTORS, default='thread', help="探测执行器")
+    parser.add_argument('--no-index', action='store_true', help="不使用扫描索引，全量扫描")
+    parser.add_argument('--buckets', type=int, default=3, help="桶数量 (默认 3)")
+    parser.add_argument('--max-pixels', type=int, default=None, help="每个桶的像素预算 (宽 x 高 的上限)")
+    parser.add_argument('--capacity', action='append', metavar='ID=N', help="桶的图片数上限，可重复指定")
+    parser.add_argument('--upscale-penalty', type=float, default=DEFAULT_UPSCALE_PENALTY, help="放大惩罚系数")
+    parser.add_argument('--dedupe', action='store_true',
+                        help="检测近重复图片 (感知哈希)，每组只保留像素数最大的一张参与分桶和导出")
+    parser.add_argument('--dedupe-distance', type=int, default=DEFAULT_DUPLICATE_DISTANCE,
+                        help=f"近重复的汉明距离阈值 (0-16，默认 {DEFAULT_DUPLICATE_DISTANCE})")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='cli.py', description="SmartBucketCropper 命令行")
+    parser.add_argument('-q', '--quiet', action='store_true', help="不输出进度")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    scan = commands.add_parser('scan', help="扫描并输出推荐的桶配置")
+    _add_scan_arguments(scan)
+    scan.add_argument('--json', action='store_true', help="以 JSON 输出扫描报告和桶配置")
+    scan.set_defaults(handler=cmd_scan)
+
+    plan = commands.add_parser('plan', help="扫描、分桶并写入裁剪计划")
+    _add_scan_arguments(plan)
+    plan.add_argument('-o', '--output', required=True, help="裁剪计划文件 (.npz)")
+    plan.set_defaults(handler=cmd_plan)
+
+    export = commands.add_parser('export', help="按裁剪计划批量导出")
+    export.add_argument('plan', help="裁剪计划文件")
+    export.add_argument('output_dir', help="输出目录")
+    export.add_argument('--workers', type=int, default=None, help="导出进程数 (默认 CPU 核数)")
+    export.add_argument('--no-companions', action='store_true', help="不复制标签等伴随文件")
+    export.add_argument('--no-resume', action='store_true', help="忽略导出清单，全部重新导出")
+    export.add_argument('--no-prune', action='store_true', help="不删除不再属于计划的旧输出")
+    export.add_argument('--companion-ext', action='append', metavar='EXT',
+                        help="伴随文件扩展名，可重复指定 (默认 .txt .json .caption .tags)")
+    export.add_argument('--companion-link', choices=COMPANION_LINK_MODES, default='auto',
+                        help="伴随文件写入方式: auto (优先 reflink) / copy / hardlink / reflink")
+    export.add_argument('--encoder', choices=ENCODER_PROFILES, default='default',
+                        help="编码预设: default / fast (优先速度) / small (优先体积) / lossless (无损 WebP)")
+    export.add_argument('--format', choices=OUTPUT_FORMATS, default=None, help="输出格式 (默认沿用源文件格式)")
+    export.add_argument('--quality', type=int, default=None, help="JPEG / WebP 质量 (1-100)")
+    export.add_argument('--png-compress-level', type=int, default=None, help="PNG 压缩级别 (0-9，越低越快)")
+    export.add_argument('--subsampling', choices=SUBSAMPLING_MODES, default=None, help="JPEG 色度抽样")
+    export.add_argument('--scale', type=float, action='append', metavar='S',
+                        help="多分辨率导出的缩放比例，可重复指定 (如 --scale 0.5 --scale 0.75 --scale 1)，"
+                             "每个比例输出到 output_dir/x<比例>/，每张图片只解码一次")
+    export.add_argument('--shards', action='store_true',
+                        help="按桶导出为 WebDataset tar 分片 (每个分片附带索引，输出目录中的 shards.json 为分片列表)")
+    export.add_argument('--shard-max-samples', type=int, default=None, help="每个分片的样本数上限 (默认 1000)")
+    export.add_argument('--shard-max-mb', type=float, default=None, help="每个分片的大小上限 (MB，默认 512)")
+    export.set_defaults(handler=cmd_export)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except ValueError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    except KeyboardInterrupt:
+        print("\n已中断", file=sys.stderr)
+        return EXIT_INTERRUPTED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
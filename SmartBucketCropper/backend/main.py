@@ -4,17 +4,34 @@ FastAPI 主入口
 """
 import os
 import sys
+import time
+import logging
+from typing import Optional
 
 # 添加当前目录到路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 
-from routes.scan import router as scan_router
+from routes.scan import router as scan_router, cached_image_response
 from routes.export import router as export_router
+from routes.session import router as session_router
+from services.executors import PoolSaturatedError, pool_stats, shutdown_pools
+from services.logging_config import configure_logging
+from services.metrics import http_seconds, render_metrics
+from services.profiling import profiler_from_env
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# 慢请求采样 (设置 SBC_PROFILE_SLOW_MS 时启用)
+profiler = profiler_from_env()
+
+# /api/image 支持的缩放尺寸 (长边像素)，full 为原图
+IMAGE_SIZES = (256, 512, 1024, 2048)
 
 # 创建 FastAPI 应用
 app = FastAPI(
@@ -35,29 +52,99 @@ app.add_middleware(
 # 注册路由
 app.include_router(scan_router)
 app.include_router(export_router)
+app.include_router(session_router)
+
+
+def _record_request(request: Request, status: int, start: float, token: Optional[int]):
+    elapsed = time.perf_counter() - start
+    route = request.scope.get('route')
+    http_seconds.observe(
+        elapsed,
+        method=request.method,
+        route=getattr(route, 'path', 'unmatched'),
+        status=status
+    )
+    if token is not None:
+        profiler.finish(token, request.method, request.url.path, elapsed * 1000)
+
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """
+    记录请求耗时 (按路由模板统计)，启用采样时写出慢请求的调用栈
+    耗时在响应体发送完毕时记录，流式响应 (流式扫描、导出进度) 统计的是整个响应的时长
+    """
+    token = profiler.begin() if profiler is not None else None
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        _record_request(request, 500, start, token)
+        raise
+
+    body = response.body_iterator
+
+    async def timed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            _record_request(request, response.status_code, start, token)
+
+    response.body_iterator = timed_body()
+    return response
+
+
+@app.exception_handler(PoolSaturatedError)
+async def pool_saturated_handler(request: Request, exc: PoolSaturatedError):
+    """执行器已满时返回 503，客户端稍后重试"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "pool": exc.pool_name},
+        headers={"Retry-After": "1"}
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown_executors():
+    shutdown_pools()
 
 
 @app.get("/api/health")
 async def health_check():
-    """健康检查"""
-    return {"status": "healthy", "message": "SmartBucketCropper API is running"}
+    """健康检查 (附带各执行器的运行 / 排队任务数)"""
+    return {"status": "healthy", "message": "SmartBucketCropper API is running", "pools": pool_stats()}
+
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 文本格式的指标: 各阶段耗时与处理数、读写字节数、缓存命中率、执行器队列"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.get("/api/image/{image_path:path}")
-async def serve_image(image_path: str):
+async def serve_image(request: Request, image_path: str, max: str = "full", format: str = "jpeg"):
     """
     提供图片文件访问 (用于前端显示)
+    max: 缩放图长边 (256 / 512 / 1024 / 2048)，full 返回原图
+    缩放图只用于显示，裁剪坐标始终基于原图尺寸
     """
     # 安全检查：确保路径存在
-    if os.path.exists(image_path) and os.path.isfile(image_path):
+    if not (os.path.exists(image_path) and os.path.isfile(image_path)):
+        return {"error": "Image not found"}
+
+    if max == "full":
         return FileResponse(image_path)
-    return {"error": "Image not found"}
+
+    if not max.isdigit() or int(max) not in IMAGE_SIZES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"max 只能是 full 或 {', '.join(str(s) for s in IMAGE_SIZES)}"
+        )
+    return await cached_image_response(request, image_path, int(max), format)
 
 
 if __name__ == "__main__":
     import uvicorn
-    print("=" * 50)
-    print("  SmartBucketCropper Backend Starting...")
-    print("  API Docs: http://localhost:8000/docs")
-    print("=" * 50)
+    logger.info("SmartBucketCropper Backend Starting... API Docs: http://localhost:8000/docs")
     uvicorn.run(app, host="0.0.0.0", port=8000)
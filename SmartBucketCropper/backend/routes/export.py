@@ -1,15 +1,45 @@
 """
 导出处理 API
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Literal
+import os
+import json
+import base64
+import asyncio
 
-from services.image_processor import process_batch_export
+from services.image_processor import process_batch_export, render_crop_preview, normalize_scales
+from services.export_jobs import submit_export_job, get_export_job, list_export_jobs, is_output_dir_busy
+from services.executors import run_in_pool, PoolSaturatedError
+from services.export_manifest import ExportManifest
+from services.shard_export import process_shard_export, shard_settings
+from services.encoders import resolve_encoder
+from services.crop_plan import (
+    new_plan_upload, commit_plan_upload, load_stored_plan, delete_stored_plan, PLAN_UPLOAD_MAX_MB
+)
 
 router = APIRouter(prefix="/api/export", tags=["Export"])
 
 
+# 伴随文件的写入方式 (见 services.companions.COMPANION_LINK_MODES)
+CompanionLink = Literal['auto', 'copy', 'hardlink', 'reflink']
+
+
+class EncoderConfig(BaseModel):
+    """编码预设与单项覆盖 (见 services.encoders)，未提供的参数使用预设的值"""
+    profile: str = 'default'
+    format: Optional[str] = None
+    quality: Optional[int] = None
+    compress_level: Optional[int] = None
+    subsampling: Optional[str] = None
+    optimize: Optional[bool] = None
+    progressive: Optional[bool] = None
+    lossless: Optional[bool] = None
+    method: Optional[int] = None
+
+
 class CropParams(BaseModel):
     x: int
     y: int
@@ -17,12 +47,20 @@ class CropParams(BaseModel):
     height: int
 
 
+class ShardConfig(BaseModel):
+    """WebDataset 分片输出 (为空时使用默认值)"""
+    max_samples: Optional[int] = None
+    max_mb: Optional[float] = None
+
+
 class ImageExportData(BaseModel):
     path: str
     filename: str
     assigned_bucket: str
     cropped: bool
     crop_params: Optional[CropParams] = None
+    # 扫描时近重复检测的结果 (重复时为保留图片的路径)
+    duplicate_of: Optional[str] = None
 
 
 class BucketConfig(BaseModel):
@@ -35,6 +73,47 @@ class ExportRequest(BaseModel):
     buckets: Dict[str, BucketConfig]
     output_dir: str
     copy_companions: bool = True
+    workers: Optional[int] = None
+    # 导出完成后删除输出目录中不再属于本次导出的旧输出 (只删除导出清单记录过的文件)
+    prune: bool = True
+    # 伴随文件扩展名 (为空时使用默认值) 与写入方式
+    companion_extensions: Optional[List[str]] = None
+    companion_link: CompanionLink = 'auto'
+    encoder: Optional[EncoderConfig] = None
+    # 多分辨率导出的缩放比例 (如 [0.5, 0.75, 1.0])，每个比例输出到 output_dir/x<比例>/
+    scales: Optional[List[float]] = None
+    # 提供时按桶导出为 WebDataset tar 分片，代替逐张图片的文件
+    shards: Optional[ShardConfig] = None
+    # 跳过近重复的图片 (duplicate_of 不为空，计入 skipped)
+    skip_duplicates: bool = False
+
+
+class ExportJobRequest(ExportRequest):
+    resume: bool = True
+
+
+class PlanExportJobRequest(BaseModel):
+    output_dir: str
+    copy_companions: bool = True
+    workers: Optional[int] = None
+    resume: bool = True
+    prune: bool = True
+    companion_extensions: Optional[List[str]] = None
+    companion_link: CompanionLink = 'auto'
+    encoder: Optional[EncoderConfig] = None
+    scales: Optional[List[float]] = None
+    shards: Optional[ShardConfig] = None
+    # 跳过计划中标记为近重复的图片 (计入 skipped)
+    skip_duplicates: bool = False
+
+
+class PlanSummary(BaseModel):
+    plan_id: str
+    total: int
+    buckets: List[Dict[str, Any]]
+    bucket_counts: Dict[str, int]
+    duplicates: int = 0
+    meta: Dict[str, Any] = {}
 
 
 class ExportResponse(BaseModel):
@@ -42,91 +121,368 @@ class ExportResponse(BaseModel):
     success: int
     failed: int
     skipped: int
+    up_to_date: int = 0
+    removed: int = 0
+    encode_seconds: float = 0.0
+    bytes_written: int = 0
+    shards: int = 0
     errors: List[str]
     output_dir: str
 
 
+class ExportJobStatus(BaseModel):
+    job_id: str
+    state: str
+    output_dir: str
+    total: int
+    processed: int
+    success: int
+    failed: int
+    skipped: int
+    up_to_date: int
+    removed: int = 0
+    encode_seconds: float = 0.0
+    bytes_written: int = 0
+    shards: int = 0
+    rate: float
+    eta_seconds: Optional[float] = None
+    elapsed_seconds: float
+    errors: List[str]
+    error: Optional[str] = None
+
+
+# 进度流的推送间隔 (秒)
+JOB_STREAM_INTERVAL = 0.5
+
+
+def _request_images(request: ExportRequest) -> List[Dict[str, Any]]:
+    """转换数据格式 (跳过近重复图片时将其视为未裁剪)"""
+    images = []
+    for img in request.images:
+        img_dict = {
+            'path': img.path,
+            'filename': img.filename,
+            'assigned_bucket': img.assigned_bucket,
+            'cropped': img.cropped and not (request.skip_duplicates and img.duplicate_of),
+            'crop_params': img.crop_params.model_dump() if img.crop_params else None
+        }
+        images.append(img_dict)
+    return images
+
+
+def _request_buckets(request: ExportRequest) -> Dict[str, Dict[str, int]]:
+    return {
+        bucket_id: {'width': config.width, 'height': config.height}
+        for bucket_id, config in request.buckets.items()
+    }
+
+
+def resolve_request_encoder(config: Optional[EncoderConfig]) -> Dict[str, Any]:
+    """请求中的编码参数转换为编码字典，参数无效时返回 400"""
+    config = config or EncoderConfig()
+    try:
+        return resolve_encoder(config.profile, **config.model_dump(exclude={'profile'}))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def resolve_request_scales(scales: Optional[List[float]]) -> Optional[List[float]]:
+    """校验多分辨率导出的缩放比例，无效时返回 400"""
+    try:
+        return normalize_scales(scales)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def resolve_request_shards(config: Optional[ShardConfig], scales: Optional[List[float]]) -> Optional[Dict[str, int]]:
+    """请求中的分片参数转换为 {'max_samples', 'max_bytes'}，参数无效时返回 400"""
+    if config is None:
+        return None
+    if scales is not None:
+        raise HTTPException(status_code=400, detail="分片输出不支持多分辨率导出 (scales)")
+    try:
+        return shard_settings(config.max_samples, config.max_mb)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _batch_export_with_manifest(
+    request: ExportRequest,
+    encoder: Dict[str, Any],
+    scales: Optional[List[float]],
+    shards: Optional[Dict[str, int]] = None
+) -> Dict[str, Any]:
+    """按输出目录的导出清单增量导出 (只重新写入输入有变化的图片)，分片输出时按分片续传状态增量导出"""
+    if shards is not None:
+        return process_shard_export(
+            request.output_dir,
+            images=_request_images(request),
+            buckets=_request_buckets(request),
+            copy_companions=request.copy_companions,
+            workers=request.workers,
+            prune=request.prune,
+            companion_extensions=request.companion_extensions,
+            encoder=encoder,
+            **shards
+        )
+    os.makedirs(request.output_dir, exist_ok=True)
+    manifest = ExportManifest(request.output_dir)
+    return process_batch_export(
+        images=_request_images(request),
+        buckets=_request_buckets(request),
+        output_dir=request.output_dir,
+        copy_companions=request.copy_companions,
+        workers=request.workers,
+        manifest=manifest,
+        prune=request.prune,
+        companion_extensions=request.companion_extensions,
+        companion_link=request.companion_link,
+        encoder=encoder,
+        scales=scales
+    )
+
+
 @router.post("/batch", response_model=ExportResponse)
 async def batch_export(request: ExportRequest):
     """
     批量导出裁剪后的图片
+    输入 (源文件、裁剪区域、桶尺寸、编码参数) 没有变化的图片计入 up_to_date，不重新写入
+    输出目录有进行中的后台导出任务时返回 409
     """
+    encoder = resolve_request_encoder(request.encoder)
+    scales = resolve_request_scales(request.scales)
+    shards = resolve_request_shards(request.shards, scales)
+    if is_output_dir_busy(request.output_dir):
+        raise HTTPException(status_code=409, detail=f"输出目录已有进行中的导出任务: {request.output_dir}")
     try:
-        # 转换数据格式
-        images = []
-        for img in request.images:
-            img_dict = {
-                'path': img.path,
-                'filename': img.filename,
-                'assigned_bucket': img.assigned_bucket,
-                'cropped': img.cropped,
-                'crop_params': img.crop_params.model_dump() if img.crop_params else None
-            }
-            images.append(img_dict)
-        
-        buckets = {
-            bucket_id: {'width': config.width, 'height': config.height}
-            for bucket_id, config in request.buckets.items()
-        }
-        
         # 执行批量导出
-        results = process_batch_export(
-            images=images,
-            buckets=buckets,
-            output_dir=request.output_dir,
-            copy_companions=request.copy_companions
-        )
+        results = await run_in_pool('export', _batch_export_with_manifest, request, encoder, scales, shards)
         
         return ExportResponse(
             total=results['total'],
             success=results['success'],
             failed=results['failed'],
             skipped=results['skipped'],
+            up_to_date=results['up_to_date'],
+            removed=results['removed'],
+            encode_seconds=results['encode_seconds'],
+            bytes_written=results['bytes_written'],
+            shards=results.get('shards', 0),
             errors=results['errors'],
             output_dir=request.output_dir
         )
         
+    except PoolSaturatedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"导出失败: {str(e)}")
 
 
+@router.post("/jobs", response_model=ExportJobStatus)
+async def create_export_job(request: ExportJobRequest):
+    """
+    提交后台导出任务，立即返回任务 ID
+    resume 为 True 时跳过输出目录中已经写入且仍然有效的图片
+    """
+    scales = resolve_request_scales(request.scales)
+    try:
+        job = submit_export_job(
+            images=_request_images(request),
+            buckets=_request_buckets(request),
+            output_dir=request.output_dir,
+            copy_companions=request.copy_companions,
+            workers=request.workers,
+            resume=request.resume,
+            prune=request.prune,
+            companion_extensions=request.companion_extensions,
+            companion_link=request.companion_link,
+            encoder=resolve_request_encoder(request.encoder),
+            scales=scales,
+            shards=resolve_request_shards(request.shards, scales)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return ExportJobStatus(**job.status())
+
+
+@router.get("/jobs", response_model=List[ExportJobStatus])
+async def get_export_jobs():
+    """列出所有导出任务"""
+    return [ExportJobStatus(**job.status()) for job in list_export_jobs()]
+
+
+def _get_job_or_404(job_id: str):
+    job = get_export_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"导出任务不存在: {job_id}")
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=ExportJobStatus)
+async def get_export_job_status(job_id: str):
+    """查询导出任务进度"""
+    return ExportJobStatus(**_get_job_or_404(job_id).status())
+
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_export_job(job_id: str):
+    """
+    以 NDJSON 推送导出任务进度，任务结束后关闭
+    """
+    job = _get_job_or_404(job_id)
+
+    async def events():
+        while True:
+            status = job.status()
+            yield json.dumps(status, ensure_ascii=False) + '\n'
+            if job.finished:
+                break
+            await asyncio.sleep(JOB_STREAM_INTERVAL)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=ExportJobStatus)
+async def cancel_export_job(job_id: str):
+    """取消导出任务 (在途图片处理完后停止)"""
+    job = _get_job_or_404(job_id)
+    job.cancel()
+    return ExportJobStatus(**job.status())
+
+
+# 上传计划时每累计这么多字节写一次文件
+UPLOAD_WRITE_SIZE = 4 * 1024 * 1024
+
+
+def _upload_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"裁剪计划超过 {PLAN_UPLOAD_MAX_MB:g} MB")
+
+
+async def _receive_upload(request: Request, upload_path: str, max_bytes: int):
+    """
+    将请求体写入文件，文件读写在线程中执行，不占用事件循环
+    超过 max_bytes 时停止接收并返回 413
+    """
+    f = await asyncio.to_thread(open, upload_path, 'wb')
+    try:
+        received = 0
+        buffer = bytearray()
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_bytes:
+                raise _upload_too_large()
+            buffer += chunk
+            if len(buffer) >= UPLOAD_WRITE_SIZE:
+                data, buffer = buffer, bytearray()
+                await asyncio.to_thread(f.write, data)
+        if buffer:
+            await asyncio.to_thread(f.write, buffer)
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+def _remove_upload(upload_path: str):
+    if os.path.exists(upload_path):
+        os.remove(upload_path)
+
+
+@router.post("/plans", response_model=PlanSummary)
+async def upload_plan(request: Request):
+    """
+    上传裁剪计划 (请求体为 cli.py plan 生成的 .npz 文件)，返回计划 ID
+    大批量导出时代替逐张图片的 JSON 列表；超过 SBC_PLAN_MAX_MB 时返回 413
+    """
+    max_bytes = int(PLAN_UPLOAD_MAX_MB * 1024 * 1024)
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise _upload_too_large()
+
+    plan_id, upload_path = await asyncio.to_thread(new_plan_upload)
+    try:
+        await _receive_upload(request, upload_path, max_bytes)
+        plan = await run_in_pool('probe', commit_plan_upload, plan_id, upload_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await asyncio.to_thread(_remove_upload, upload_path)
+    return PlanSummary(plan_id=plan_id, **plan.summary())
+
+
+def _get_plan_or_404(plan_id: str):
+    try:
+        plan = load_stored_plan(plan_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if plan is None:
+        raise HTTPException(status_code=404, detail=f"裁剪计划不存在: {plan_id}")
+    return plan
+
+
+@router.get("/plans/{plan_id}", response_model=PlanSummary)
+async def get_plan(plan_id: str):
+    """查询裁剪计划概要"""
+    plan = await run_in_pool('probe', _get_plan_or_404, plan_id)
+    return PlanSummary(plan_id=plan_id, **plan.summary())
+
+
+@router.delete("/plans/{plan_id}")
+async def delete_plan(plan_id: str):
+    """删除裁剪计划"""
+    if not delete_stored_plan(plan_id):
+        raise HTTPException(status_code=404, detail=f"裁剪计划不存在: {plan_id}")
+    return {"deleted": plan_id}
+
+
+@router.post("/plans/{plan_id}/jobs", response_model=ExportJobStatus)
+async def create_plan_export_job(plan_id: str, request: PlanExportJobRequest):
+    """
+    按已上传的裁剪计划提交后台导出任务
+    """
+    plan = await run_in_pool('probe', _get_plan_or_404, plan_id)
+    scales = resolve_request_scales(request.scales)
+    try:
+        job = submit_export_job(
+            images=None,
+            buckets=None,
+            output_dir=request.output_dir,
+            copy_companions=request.copy_companions,
+            workers=request.workers,
+            resume=request.resume,
+            plan=plan,
+            prune=request.prune,
+            companion_extensions=request.companion_extensions,
+            companion_link=request.companion_link,
+            encoder=resolve_request_encoder(request.encoder),
+            scales=scales,
+            shards=resolve_request_shards(request.shards, scales),
+            skip_duplicates=request.skip_duplicates
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return ExportJobStatus(**job.status())
+
+
 @router.post("/preview")
 async def preview_crop(image_path: str, crop_params: CropParams, bucket_width: int, bucket_height: int):
     """
     预览裁剪效果 (返回 base64 预览图)
     """
     try:
-        from PIL import Image
-        import io
-        import base64
-        
-        with Image.open(image_path) as img:
-            # 裁剪
-            cropped = img.crop((
-                crop_params.x,
-                crop_params.y,
-                crop_params.x + crop_params.width,
-                crop_params.y + crop_params.height
-            ))
-            
-            # 缩放到目标尺寸的缩略图 (用于预览)
-            preview_size = (min(bucket_width, 400), min(bucket_height, 400))
-            cropped.thumbnail(preview_size, Image.Resampling.LANCZOS)
-            
-            # 转换为 RGB
-            if cropped.mode in ('RGBA', 'P'):
-                cropped = cropped.convert('RGB')
-            
-            # 转为 base64
-            buffer = io.BytesIO()
-            cropped.save(buffer, format='JPEG', quality=85)
-            preview_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-            return {
-                "preview": preview_base64,
-                "target_width": bucket_width,
-                "target_height": bucket_height
-            }
+        preview_bytes = await run_in_pool(
+            'preview',
+            render_crop_preview,
+            image_path,
+            crop_params.model_dump(),
+            bucket_width,
+            bucket_height
+        )
+        return {
+            "preview": base64.b64encode(preview_bytes).decode('utf-8'),
+            "target_width": bucket_width,
+            "target_height": bucket_height
+        }
             
+    except PoolSaturatedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"预览失败: {str(e)}")
@@ -1,25 +1,67 @@
 """
 扫描文件夹 API
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import base64
-import traceback
+from typing import List, Dict, Any, Optional, Iterator
+import os
+import json
+import time
+import logging
 
 from services.bucket_analyzer import (
-    scan_folder_for_images,
+    scan_folder_with_report,
+    iter_scan_batches,
     analyze_buckets,
-    assign_images_to_buckets,
-    validate_bucket_size
+    assign_table_to_buckets,
+    validate_bucket_size,
+    DEFAULT_SCAN_BATCH_SIZE,
+    MAX_BUCKETS,
+    DEFAULT_UPSCALE_PENALTY
+)
+from services.image_table import ImageTable
+from services.duplicates import (
+    find_duplicate_groups, unique_indices, describe_groups, duplicate_targets,
+    DEFAULT_DUPLICATE_DISTANCE, MAX_DUPLICATE_DISTANCE
+)
+from services.executors import run_in_pool, get_pool, PoolSaturatedError
+from services.session_store import session_store
+from services.thumbnail_cache import (
+    thumbnail_cache, pregenerate_thumbnails, start_pregeneration, THUMBNAIL_FORMATS
 )
-from services.image_processor import get_image_thumbnail, calculate_default_crop
 
 router = APIRouter(prefix="/api/scan", tags=["Scan"])
 
+logger = logging.getLogger(__name__)
+
+# 缩略图的浏览器缓存策略 (ETag 随源文件变化，可以长期缓存)
+THUMBNAIL_CACHE_CONTROL = "public, max-age=86400"
+
 
 class ScanRequest(BaseModel):
     folder_path: str
+    probe_workers: Optional[int] = None
+    probe_executor: str = 'thread'
+    use_index: bool = True
+    pregenerate_thumbnails: bool = False
+    # 桶数量与每个桶的像素预算 (宽 x 高 的上限)
+    n_buckets: int = 3
+    max_pixels: Optional[int] = None
+    # 分配: 每个桶的图片数上限 {桶 ID: 上限} 与放大惩罚系数
+    bucket_capacities: Optional[Dict[str, int]] = None
+    upscale_penalty: float = DEFAULT_UPSCALE_PENALTY
+    # 在服务端创建会话保存扫描结果和裁剪状态
+    create_session: bool = False
+    # 创建会话时可以不返回图片列表，之后通过 /api/sessions/{id}/images 分页读取
+    include_images: bool = True
+    # 近重复检测: 计算每张图片的感知哈希，汉明距离不超过阈值的图片归为一组，分桶时只统计每组保留的图片
+    detect_duplicates: bool = False
+    duplicate_distance: int = DEFAULT_DUPLICATE_DISTANCE
+
+
+class ScanStreamRequest(ScanRequest):
+    batch_size: int = DEFAULT_SCAN_BATCH_SIZE
 
 
 class ValidateBucketRequest(BaseModel):
@@ -31,6 +73,22 @@ class ScanResponse(BaseModel):
     images: List[Dict[str, Any]]
     buckets: List[Dict[str, Any]]
     total_count: int
+    scan_stats: Optional[Dict[str, Any]] = None
+    session_id: Optional[str] = None
+    # 开启近重复检测时: [{'keep': 保留的图片路径, 'duplicates': [重复的图片路径], 'max_distance': 组内最大距离}]
+    duplicate_groups: Optional[List[Dict[str, Any]]] = None
+
+
+class AssignRequest(BaseModel):
+    images: List[Dict[str, Any]]
+    buckets: List[Dict[str, Any]]
+    bucket_capacities: Optional[Dict[str, int]] = None
+    upscale_penalty: float = DEFAULT_UPSCALE_PENALTY
+
+
+class AssignResponse(BaseModel):
+    assigned_bucket: List[str]
+    buckets: List[Dict[str, Any]]
 
 
 class ValidateBucketResponse(BaseModel):
@@ -40,67 +98,332 @@ class ValidateBucketResponse(BaseModel):
     message: Optional[str] = None
 
 
+def _check_duplicate_distance(request: ScanRequest):
+    if request.detect_duplicates and not 0 <= request.duplicate_distance <= MAX_DUPLICATE_DISTANCE:
+        raise HTTPException(
+            status_code=400, detail=f"近重复距离阈值必须在 0 到 {MAX_DUPLICATE_DISTANCE} 之间"
+        )
+
+
+def _analysis_table(table: ImageTable, groups: Optional[List[Dict[str, Any]]]) -> ImageTable:
+    """计算桶配置使用的图片 (近重复的图片只统计每组保留的一张)"""
+    if not groups:
+        return table
+    return table.take(unique_indices(len(table), groups))
+
+
+def _build_scan_result(
+    request: ScanRequest,
+    images: List[Dict[str, Any]],
+    scan_stats: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    探测完成后的处理 (在执行器中执行): 近重复检测、分桶、分配、构造返回的图片信息
+    近重复检测的统计写入 scan_stats
+    """
+    # 转换为列式表，分桶、分配和默认裁剪都在数组上批量计算
+    table = ImageTable.from_records(images)
+
+    groups = None
+    if request.detect_duplicates:
+        groups = find_duplicate_groups(
+            [img.get('dhash') for img in images],
+            (table.widths * table.heights).tolist(),
+            request.duplicate_distance
+        )
+        scan_stats['duplicate_groups'] = len(groups)
+        scan_stats['duplicates'] = sum(len(group['duplicates']) for group in groups)
+
+    # 分析并生成桶配置
+    buckets = analyze_buckets(
+        _analysis_table(table, groups), n_buckets=request.n_buckets, max_pixels=request.max_pixels
+    )
+
+    if not buckets:
+        buckets = _default_buckets()
+        logger.info("使用默认桶配置")
+
+    # 将图片分配到桶，并计算默认裁剪区域
+    assign_table_to_buckets(table, buckets, request.bucket_capacities, request.upscale_penalty)
+
+    if request.pregenerate_thumbnails:
+        pregenerate_thumbnails(list(table.paths))
+
+    # 有会话时可以只返回桶配置，图片列表按需分页读取
+    records = table.to_records(buckets) if request.include_images or not request.create_session else []
+    duplicate_groups = None
+    duplicate_of = None
+    if groups is not None:
+        duplicate_groups = describe_groups(groups, table.paths)
+        duplicate_of = duplicate_targets(groups, table.paths)
+        for record, img, original in zip(records, images, duplicate_of):
+            record['dhash'] = img.get('dhash')
+            record['duplicate_of'] = original
+
+    return {
+        'table': table,
+        'buckets': buckets,
+        'records': records,
+        'duplicate_groups': duplicate_groups,
+        'duplicate_of': duplicate_of
+    }
+
+
 @router.post("/folder", response_model=ScanResponse)
 async def scan_folder(request: ScanRequest):
     """
     扫描文件夹，分析图片并生成推荐桶配置
+    开启近重复检测时返回重复组，图片信息附带 dhash 与 duplicate_of (重复时为保留图片的路径)
     """
+    _check_duplicate_distance(request)
     try:
-        print(f"[扫描] 开始扫描文件夹: {request.folder_path}")
+        logger.info("开始扫描文件夹: %s", request.folder_path, extra={'folder': request.folder_path})
         
         # 扫描文件夹中的图片
-        images = scan_folder_for_images(request.folder_path)
-        print(f"[扫描] 找到 {len(images)} 张图片")
+        images, scan_stats = await run_in_pool(
+            'probe',
+            scan_folder_with_report,
+            request.folder_path,
+            workers=request.probe_workers,
+            executor=request.probe_executor,
+            use_index=request.use_index,
+            compute_hashes=request.detect_duplicates
+        )
         
         if not images:
             raise HTTPException(status_code=404, detail="文件夹中没有找到支持的图片格式")
         
-        # 分析并生成桶配置
-        print(f"[分析] 开始 K-Means 分桶分析...")
-        buckets = analyze_buckets(images, n_buckets=3)
-        print(f"[分析] 生成了 {len(buckets)} 个桶: {buckets}")
-        
-        if not buckets:
-            # 创建默认桶
-            buckets = [
-                {'id': 'A', 'width': 1024, 'height': 1024, 'aspect_ratio': 1.0, 'image_count': 0}
-            ]
-            print(f"[分析] 使用默认桶配置")
-        
-        # 将图片分配到桶
-        print(f"[分配] 开始分配图片到桶...")
-        images = assign_images_to_buckets(images, buckets)
-        
-        # 为每张图片计算默认裁剪区域
-        print(f"[裁剪] 计算默认裁剪区域...")
-        for img in images:
-            bucket = next((b for b in buckets if b['id'] == img['assigned_bucket']), buckets[0])
-            target_ratio = bucket['width'] / bucket['height']
-            img['default_crop'] = calculate_default_crop(
-                img['width'],
-                img['height'],
-                target_ratio
+        # 分桶、分配和构造图片信息都是 CPU 密集的计算，整体在执行器中完成，不占用事件循环
+        result = await run_in_pool('probe', _build_scan_result, request, images, scan_stats)
+        table = result['table']
+        buckets = result['buckets']
+        records = result['records']
+        duplicate_groups = result['duplicate_groups']
+
+        session_id = None
+        if request.create_session:
+            session_id = await run_in_pool(
+                'session', session_store.create, request.folder_path, table, buckets, result['duplicate_of']
             )
-        
-        print(f"[完成] 扫描完成，返回 {len(images)} 张图片，{len(buckets)} 个桶")
+            logger.info("已创建会话 %s", session_id, extra={'session_id': session_id})
+        images = records
+        logger.info(
+            "扫描完成，共 %d 张图片，返回 %d 张，%d 个桶", len(table), len(images), len(buckets),
+            extra={
+                'folder': request.folder_path,
+                'images': len(table),
+                'buckets': [f"{b['id']}:{b['width']}x{b['height']}" for b in buckets],
+                'images_per_second': scan_stats['images_per_second'],
+                'failed': scan_stats['failed']
+            }
+        )
         
         return ScanResponse(
             images=images,
             buckets=buckets,
-            total_count=len(images)
+            total_count=len(table),
+            scan_stats=scan_stats,
+            session_id=session_id,
+            duplicate_groups=duplicate_groups
         )
         
     except ValueError as e:
-        print(f"[错误] ValueError: {str(e)}")
+        logger.warning("扫描参数无效: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
-    except HTTPException:
+    except (HTTPException, PoolSaturatedError):
         raise
     except Exception as e:
-        print(f"[错误] Exception: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("扫描失败: %s", request.folder_path)
         raise HTTPException(status_code=500, detail=f"扫描失败: {str(e)}")
 
 
+def _default_buckets() -> List[Dict[str, Any]]:
+    """创建默认桶"""
+    return [
+        {'id': 'A', 'width': 1024, 'height': 1024, 'aspect_ratio': 1.0, 'image_count': 0}
+    ]
+
+
+def _ndjson(event: Dict[str, Any]) -> str:
+    return json.dumps(event, ensure_ascii=False) + '\n'
+
+
+def _scan_stream_events(request: ScanStreamRequest) -> Iterator[str]:
+    """
+    流式扫描事件 (每行一个 JSON):
+    - images: 一批探测完成的图片，offset 为该批第一张图片的序号
+    - stats: 当前进度与各方向的累计统计
+    - buckets: 全部扫描完成后的桶配置
+    - duplicates: 开启近重复检测时的重复组 (在 buckets 之前，桶配置只统计每组保留的图片)
+    - assign: 一批图片的桶分配与默认裁剪区域，按 offset 对应 images 中的序号
+    - done: 扫描报告
+    - error: 出错信息
+    """
+    start = time.perf_counter()
+    report = {}
+    # 只保留计算桶配置所需的列，不保留完整的图片信息
+    paths = []
+    widths = []
+    heights = []
+    hashes = []
+    counts = {'landscape': 0, 'square': 0, 'portrait': 0}
+    # 预生成缩略图随扫描分批追加，新的扫描开始时取消
+    pregeneration = start_pregeneration() if request.pregenerate_thumbnails else None
+
+    try:
+        for batch in iter_scan_batches(
+            request.folder_path,
+            workers=request.probe_workers,
+            executor=request.probe_executor,
+            use_index=request.use_index,
+            batch_size=max(1, request.batch_size),
+            report=report,
+            compute_hashes=request.detect_duplicates
+        ):
+            offset = len(widths)
+            for img in batch:
+                paths.append(img['path'])
+                widths.append(img['width'])
+                heights.append(img['height'])
+                counts[img['orientation']] += 1
+                if request.detect_duplicates:
+                    hashes.append(img.get('dhash'))
+
+            if pregeneration is not None:
+                pregeneration.add([img['path'] for img in batch])
+
+            yield _ndjson({'type': 'images', 'offset': offset, 'images': batch})
+            yield _ndjson({
+                'type': 'stats',
+                'files': report.get('files', 0),
+                'scanned': report.get('scanned', 0),
+                'images': len(widths),
+                'failed': report.get('failed', 0),
+                'orientation_counts': counts,
+                'elapsed_seconds': round(time.perf_counter() - start, 3)
+            })
+
+        if not widths:
+            yield _ndjson({'type': 'error', 'detail': "文件夹中没有找到支持的图片格式"})
+            return
+
+        table = ImageTable(paths=paths, widths=widths, heights=heights)
+        del widths, heights
+
+        groups = None
+        if request.detect_duplicates:
+            groups = find_duplicate_groups(
+                hashes, (table.widths * table.heights).tolist(), request.duplicate_distance
+            )
+            del hashes
+            report['duplicate_groups'] = len(groups)
+            report['duplicates'] = sum(len(group['duplicates']) for group in groups)
+            yield _ndjson({'type': 'duplicates', 'groups': describe_groups(groups, table.paths)})
+
+        buckets = analyze_buckets(
+            _analysis_table(table, groups), n_buckets=request.n_buckets, max_pixels=request.max_pixels
+        )
+        if not buckets:
+            buckets = _default_buckets()
+        assign_table_to_buckets(table, buckets, request.bucket_capacities, request.upscale_penalty)
+        yield _ndjson({'type': 'buckets', 'buckets': buckets})
+
+        bucket_ids = [bucket['id'] for bucket in buckets]
+        crops = table.default_crops(buckets)
+        batch_size = max(1, request.batch_size)
+        for offset in range(0, len(table), batch_size):
+            index = table.bucket_index[offset:offset + batch_size].tolist()
+            yield _ndjson({
+                'type': 'assign',
+                'offset': offset,
+                'assigned_bucket': [bucket_ids[i] for i in index],
+                'default_crop': [
+                    {'x': x, 'y': y, 'width': w, 'height': h}
+                    for x, y, w, h in crops[offset:offset + batch_size].tolist()
+                ]
+            })
+
+        session_id = None
+        if request.create_session:
+            session_id = session_store.create(
+                request.folder_path, table, buckets,
+                duplicate_targets(groups, table.paths) if groups is not None else None
+            )
+
+        yield _ndjson({'type': 'done', 'total_count': len(table), 'scan_stats': report, 'session_id': session_id})
+
+    except Exception as e:
+        logger.exception("流式扫描失败: %s", request.folder_path)
+        yield _ndjson({'type': 'error', 'detail': f"扫描失败: {str(e)}"})
+
+
+class _ReleasingStreamingResponse(StreamingResponse):
+    """
+    响应结束后调用 release
+    在 __call__ 中释放而不是在响应体生成器的 finally 中: 客户端在响应体开始迭代前断开时，
+    生成器从未启动，关闭它不会执行 finally；后台任务 (background) 在断开时同样不会执行
+    """
+
+    def __init__(self, content: Iterator[str], release, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
+@router.post("/folder/stream")
+async def scan_folder_stream(request: ScanStreamRequest):
+    """
+    流式扫描文件夹 (NDJSON)
+    边探测边返回图片，最后返回桶配置和每张图片的分配结果
+    """
+    if not os.path.exists(request.folder_path):
+        raise HTTPException(status_code=400, detail=f"文件夹不存在: {request.folder_path}")
+    if not 1 <= request.n_buckets <= MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"桶数量必须在 1 到 {MAX_BUCKETS} 之间")
+    _check_duplicate_distance(request)
+
+    # 流式扫描在响应期间占用一个 probe 名额 (已满时在开始响应前返回 503)，响应结束或客户端断开后释放
+    pool = get_pool('probe')
+    pool.acquire()
+    try:
+        return _ReleasingStreamingResponse(
+            _scan_stream_events(request), pool.release, media_type="application/x-ndjson"
+        )
+    except Exception:
+        pool.release()
+        raise
+
+
+@router.post("/assign", response_model=AssignResponse)
+async def assign_buckets(request: AssignRequest):
+    """
+    按给定的桶配置重新分配图片 (例如修改桶尺寸或设置容量后)，并返回每个桶的保留像素统计
+    """
+    if not request.buckets:
+        raise HTTPException(status_code=400, detail="桶配置不能为空")
+
+    try:
+        table = ImageTable.from_records(request.images)
+        buckets = [dict(bucket) for bucket in request.buckets]
+        await run_in_pool(
+            'probe',
+            assign_table_to_buckets, table, buckets, request.bucket_capacities, request.upscale_penalty
+        )
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"分配失败: {str(e)}")
+
+    bucket_ids = [bucket['id'] for bucket in buckets]
+    return AssignResponse(
+        assigned_bucket=[bucket_ids[i] for i in table.bucket_index.tolist()],
+        buckets=buckets
+    )
+
+
 @router.post("/validate-bucket", response_model=ValidateBucketResponse)
 async def validate_bucket(request: ValidateBucketRequest):
     """
@@ -123,18 +446,34 @@ async def validate_bucket(request: ValidateBucketRequest):
     )
 
 
+async def cached_image_response(request: Request, image_path: str, size: int, format: str) -> Response:
+    """
+    返回缓存的缩放图 (缩略图 / 网格小图 / 裁剪代理图)，支持 ETag 协商缓存
+    """
+    if format not in THUMBNAIL_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的缩略图格式: {format}")
+
+    key = thumbnail_cache.cache_key(image_path, size, format)
+    if key is None:
+        raise HTTPException(status_code=404, detail="图片不存在")
+
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": THUMBNAIL_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    result = await run_in_pool('thumbnail', thumbnail_cache.get, image_path, size, format)
+    if result is None:
+        raise HTTPException(status_code=404, detail="无法生成缩略图")
+
+    data, _ = result
+    return Response(content=data, media_type=THUMBNAIL_FORMATS[format][2], headers=headers)
+
+
 @router.get("/thumbnail/{image_path:path}")
-async def get_thumbnail(image_path: str):
+async def get_thumbnail(request: Request, image_path: str, size: int = 200, format: str = 'jpeg'):
     """
-    获取图片缩略图
+    获取图片缩略图 (直接返回图片数据，支持 ETag 协商缓存)
     """
-    try:
-        thumbnail_bytes = get_image_thumbnail(image_path)
-        if thumbnail_bytes:
-            return {
-                "thumbnail": base64.b64encode(thumbnail_bytes).decode('utf-8')
-            }
-        else:
-            raise HTTPException(status_code=404, detail="无法生成缩略图")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    size = max(16, min(size, 1024))
+    return await cached_image_response(request, image_path, size, format)
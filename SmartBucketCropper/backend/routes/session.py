@@ -0,0 +1,172 @@
+"""
+数据集会话 API
+扫描时创建会话 (create_session)，之后前端只提交改动的图片，刷新页面后按会话 ID 恢复
+"""
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel
+from typing import List, Dict, Any, Optional, Literal
+
+from services.session_store import session_store, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from services.bucket_analyzer import validate_bucket_size
+from services.export_jobs import submit_export_job
+from services.executors import run_in_pool
+from routes.export import (
+    CropParams, PlanExportJobRequest, ExportJobStatus, resolve_request_encoder, resolve_request_scales,
+    resolve_request_shards
+)
+
+router = APIRouter(prefix="/api/sessions", tags=["Session"])
+
+
+class ImageEdit(BaseModel):
+    assigned_bucket: Optional[str] = None
+    cropped: Optional[bool] = None
+    crop_params: Optional[CropParams] = None
+
+
+class BatchImageEdit(ImageEdit):
+    id: int
+
+
+class BatchEditRequest(BaseModel):
+    edits: List[BatchImageEdit]
+
+
+class BucketSizeRequest(BaseModel):
+    width: int
+    height: int
+
+
+class SessionSummary(BaseModel):
+    session_id: str
+    folder_path: str
+    buckets: List[Dict[str, Any]]
+    total_count: int
+    cropped_count: int
+    created_at: float
+    updated_at: float
+
+
+class SessionImagesResponse(BaseModel):
+    images: List[Dict[str, Any]]
+    total: int
+    next_cursor: Optional[str] = None
+
+
+class SessionEditResponse(BaseModel):
+    images: List[Dict[str, Any]]
+
+
+def _edit_dict(edit: ImageEdit) -> Dict[str, Any]:
+    """只保留请求中提供的字段 (未提供的字段保持不变)"""
+    return edit.model_dump(exclude_unset=True)
+
+
+async def _run(fn, *args):
+    """在会话执行器中访问会话数据库，会话不存在返回 404，改动无效返回 400"""
+    try:
+        return await run_in_pool('session', fn, *args)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"会话不存在: {e.args[0]}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _get_session_or_404(session_id: str) -> Dict[str, Any]:
+    session = await run_in_pool('session', session_store.get, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
+    return session
+
+
+@router.get("/{session_id}", response_model=SessionSummary)
+async def get_session(session_id: str):
+    """会话概要: 桶配置和每个桶的图片数 / 已裁剪数"""
+    return SessionSummary(**await _get_session_or_404(session_id))
+
+
+@router.get("/{session_id}/images", response_model=SessionImagesResponse)
+async def get_session_images(
+    session_id: str,
+    bucket: Optional[str] = None,
+    cropped: Optional[bool] = None,
+    sort: str = 'index',
+    order: Literal['asc', 'desc'] = 'asc',
+    cursor: Optional[str] = None,
+    offset: int = 0,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    """
+    分页读取图片 (包括桶分配和裁剪状态)
+    - bucket / cropped: 只返回指定桶 / 裁剪状态的图片
+    - sort: index (扫描顺序) / aspect_deviation (与桶的长宽比偏差) / crop_status (未裁剪在前)
+    - cursor: 上一页返回的 next_cursor；没有游标时从第 offset 张开始
+    total 为符合过滤条件的图片总数，用于虚拟滚动计算列表高度
+    """
+    images, next_cursor, total = await _run(
+        session_store.list_images, session_id, bucket, cropped, sort, order == 'desc', cursor, offset, limit
+    )
+    return SessionImagesResponse(images=images, total=total, next_cursor=next_cursor)
+
+
+@router.patch("/{session_id}/images/{image_id}", response_model=SessionEditResponse)
+async def patch_session_image(session_id: str, image_id: int, edit: ImageEdit):
+    """修改单张图片的桶分配或裁剪区域"""
+    changes = dict(_edit_dict(edit), id=image_id)
+    images = await _run(session_store.update_images, session_id, [changes])
+    return SessionEditResponse(images=images)
+
+
+@router.patch("/{session_id}/images", response_model=SessionEditResponse)
+async def patch_session_images(session_id: str, request: BatchEditRequest):
+    """在一个事务中批量修改图片 (如 全部保存)"""
+    edits = [_edit_dict(edit) for edit in request.edits]
+    images = await _run(session_store.update_images, session_id, edits)
+    return SessionEditResponse(images=images)
+
+
+@router.patch("/{session_id}/buckets/{bucket_id}", response_model=SessionSummary)
+async def patch_session_bucket(session_id: str, bucket_id: str, request: BucketSizeRequest):
+    """修改桶尺寸 (对齐到 64 倍数)，重新计算该桶中图片的默认裁剪区域"""
+    width, height, _ = validate_bucket_size(request.width, request.height)
+    await _run(session_store.update_bucket, session_id, bucket_id, width, height)
+    return SessionSummary(**await _get_session_or_404(session_id))
+
+
+@router.delete("/{session_id}")
+async def delete_session(session_id: str):
+    """删除会话"""
+    if not await run_in_pool('session', session_store.delete, session_id):
+        raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
+    return {"deleted": session_id}
+
+
+@router.post("/{session_id}/export", response_model=ExportJobStatus)
+async def create_session_export_job(session_id: str, request: PlanExportJobRequest):
+    """
+    按会话中已裁剪的图片提交后台导出任务 (无需上传图片列表)
+    """
+    plan = await _run(session_store.to_plan, session_id)
+    if not len(plan):
+        raise HTTPException(status_code=400, detail="会话中没有已裁剪的图片")
+    scales = resolve_request_scales(request.scales)
+    try:
+        job = submit_export_job(
+            images=None,
+            buckets=None,
+            output_dir=request.output_dir,
+            copy_companions=request.copy_companions,
+            workers=request.workers,
+            resume=request.resume,
+            plan=plan,
+            prune=request.prune,
+            companion_extensions=request.companion_extensions,
+            companion_link=request.companion_link,
+            encoder=resolve_request_encoder(request.encoder),
+            scales=scales,
+            shards=resolve_request_shards(request.shards, scales),
+            skip_duplicates=request.skip_duplicates
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return ExportJobStatus(**job.status())
@@ -1,179 +1,434 @@
 """
 智能分桶分析服务
-按长宽比分类：横向(宽>高)、正方形(宽≈高)、纵向(高>宽)
+扫描图片尺寸，按长宽比求最优的 N 个桶并分配图片
+方向分类：横向(宽>高)、正方形(宽≈高)、纵向(高>宽)
 """
 import os
-from typing import List, Tuple, Dict, Any
-from PIL import Image
+import time
+import logging
+from typing import List, Tuple, Dict, Any, Optional, Iterator, Union
 import numpy as np
 
+from services.image_probe import probe_image_size, probe_images, create_probe_pool
+from services.scan_index import open_scan_index, diff_against_index
+from services.duplicates import hash_images
+from services.image_table import ImageTable, LANDSCAPE_THRESHOLD, PORTRAIT_THRESHOLD
+from services.bucket_optimizer import optimize_buckets, snap_to_64, MAX_BUCKETS
+from services.bucket_assignment import assign_by_cost, bucket_statistics, DEFAULT_UPSCALE_PENALTY
+from services.metrics import observe_stage, track_stage, record_error, record_cache
+
+logger = logging.getLogger(__name__)
+
 # 支持的图片格式
 SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tiff', '.gif'}
 
-# 长宽比阈值
-LANDSCAPE_THRESHOLD = 1.1   # 宽/高 > 1.1 为横向
-PORTRAIT_THRESHOLD = 0.9    # 宽/高 < 0.9 为纵向
-# 0.9 <= 宽/高 <= 1.1 为正方形
+# 长宽比阈值 (定义见 image_table)
+# 宽/高 > 1.1 为横向，宽/高 < 0.9 为纵向，0.9 <= 宽/高 <= 1.1 为正方形
 
+# 流式扫描每批的文件数
+DEFAULT_SCAN_BATCH_SIZE = 500
 
-def snap_to_64(value: float) -> int:
-    """
-    四舍五入到最近的 64 倍数
-    例如: 1000 -> 1024, 500 -> 512, 750 -> 768
-    """
-    return int(round(value / 64) * 64)
+# 一次性扫描时每批的文件数 (批次越大，池在批次边界的空闲越少)
+FULL_SCAN_BATCH_SIZE = 20000
+
+# 桶 ID
+BUCKET_IDS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# 桶名称 (按桶的方向)
+BUCKET_NAMES = {
+    'landscape': '横向 (Landscape)',
+    'square': '正方形 (Square)',
+    'portrait': '纵向 (Portrait)'
+}
 
 
 def get_image_dimensions(image_path: str) -> Tuple[int, int]:
-    """获取图片的宽高"""
-    with Image.open(image_path) as img:
-        return img.size  # (width, height)
+    """获取图片的宽高 (只读取文件头)"""
+    return probe_image_size(image_path)
 
 
-def scan_folder_for_images(folder_path: str) -> List[Dict[str, Any]]:
+def classify_orientation(aspect_ratio: float) -> str:
+    """按长宽比分类：横向/正方形/纵向"""
+    if aspect_ratio > LANDSCAPE_THRESHOLD:
+        return 'landscape'  # 横向
+    if aspect_ratio < PORTRAIT_THRESHOLD:
+        return 'portrait'   # 纵向
+    return 'square'         # 正方形
+
+
+def build_image_record(image_path: str, width: int, height: int) -> Dict[str, Any]:
+    """根据路径和尺寸构造图片信息"""
+    aspect_ratio = width / height if height > 0 else 1.0
+    return {
+        'path': image_path,
+        'filename': os.path.basename(image_path),
+        'width': width,
+        'height': height,
+        'aspect_ratio': aspect_ratio,
+        'orientation': classify_orientation(aspect_ratio)
+    }
+
+
+def list_image_files(folder_path: str) -> List[str]:
     """
-    扫描文件夹中的所有图片
-    返回每张图片的路径和尺寸信息
+    递归列出文件夹中所有支持格式的图片
+    目录和文件名均排序，保证多次扫描的顺序稳定
     """
-    images = []
-    
     if not os.path.exists(folder_path):
         raise ValueError(f"文件夹不存在: {folder_path}")
-    
+
+    paths = []
     for root, dirs, files in os.walk(folder_path):
-        for filename in files:
+        dirs.sort()
+        for filename in sorted(files):
             ext = os.path.splitext(filename)[1].lower()
             if ext in SUPPORTED_FORMATS:
-                filepath = os.path.join(root, filename)
-                try:
-                    width, height = get_image_dimensions(filepath)
-                    aspect_ratio = width / height if height > 0 else 1.0
-                    
-                    # 分类：横向/正方形/纵向
-                    if aspect_ratio > LANDSCAPE_THRESHOLD:
-                        orientation = 'landscape'  # 横向
-                    elif aspect_ratio < PORTRAIT_THRESHOLD:
-                        orientation = 'portrait'   # 纵向
+                paths.append(os.path.join(root, filename))
+    return paths
+
+
+def list_image_entries(folder_path: str) -> List[Tuple[str, int, int]]:
+    """
+    递归列出图片及其文件大小和修改时间 (基于 os.scandir)
+    返回 [(路径, size, mtime_ns), ...]，顺序与 list_image_files 一致
+    """
+    if not os.path.exists(folder_path):
+        raise ValueError(f"文件夹不存在: {folder_path}")
+
+    entries = []
+    stack = [folder_path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                dir_entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            logger.warning("无法读取目录 %s: %s", current, e)
+            continue
+
+        files = []
+        subdirs = []
+        for entry in dir_entries:
+            if entry.is_dir(follow_symlinks=True):
+                # 与 os.walk 一致: 不进入指向目录的符号链接 (避免链接成环时无限递归)
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in SUPPORTED_FORMATS:
+                files.append(entry)
+
+        for entry in files:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((entry.path, st.st_size, st.st_mtime_ns))
+
+        # 逆序压栈，保证子目录按名称顺序出栈
+        stack.extend(reversed(subdirs))
+
+    return entries
+
+
+def iter_scan_batches(
+    folder_path: str,
+    workers: Optional[int] = None,
+    executor: str = 'thread',
+    use_index: bool = True,
+    batch_size: int = DEFAULT_SCAN_BATCH_SIZE,
+    report: Optional[Dict[str, Any]] = None,
+    compute_hashes: bool = False
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    分批扫描文件夹中的图片，每批探测完成后立即返回
+
+    Args:
+        folder_path: 数据集根目录
+        workers: 探测并发数
+        executor: 'thread' 或 'process'
+        use_index: 是否使用数据集根目录下的持久化索引，只探测新增或修改的文件
+        batch_size: 每批的文件数
+        report: 可选的字典，开始时写入 'files'，每批更新 'scanned' / 'failed'，结束后写入完整扫描报告
+                (文件数、成功数、耗时、吞吐量、索引命中情况以及逐文件的错误信息)
+        compute_hashes: 同时计算每张图片的感知哈希 (services.duplicates)，写入图片信息的 'dhash'
+                        (十六进制，无法计算时为 None)；哈希保存在索引中，未变化的图片不重新计算
+
+    Yields:
+        按稳定顺序排列的图片信息列表
+    """
+    if report is None:
+        report = {}
+    start = time.perf_counter()
+    index = open_scan_index(folder_path) if use_index else None
+    pool = None
+
+    try:
+        if index is not None:
+            entries = list_image_entries(folder_path)
+            unchanged, changed, removed = diff_against_index(entries, index)
+            cached = dict(unchanged)
+            changed_stats = {path: (size, mtime_ns) for path, size, mtime_ns in changed}
+            ordered_paths = [entry[0] for entry in entries]
+            del entries, unchanged, changed
+        else:
+            ordered_paths = list_image_files(folder_path)
+            cached, changed_stats, removed = {}, {}, []
+        listed = time.perf_counter()
+        report['files'] = len(ordered_paths)
+
+        hits = len(cached)
+        errors = []
+        updated = []
+        probe_seconds = 0.0
+        hash_seconds = 0.0
+        hashed = 0
+        hash_failed = 0
+        # 需要计算哈希的图片 (索引中没有哈希的都要计算)
+        to_hash = 0
+        if compute_hashes:
+            to_hash = len(ordered_paths) - sum(1 for hit in cached.values() if hit[6] is not None)
+        if len(ordered_paths) - hits > batch_size or to_hash > 1:
+            pool = create_probe_pool(workers=workers, executor=executor)
+
+        report['scanned'] = 0
+        for i in range(0, len(ordered_paths), batch_size):
+            batch_paths = ordered_paths[i:i + batch_size]
+            records = {}
+            to_probe = []
+            # 需要写回索引的图片: 路径 -> (size, mtime_ns)
+            to_update = {}
+            for path in batch_paths:
+                hit = cached.pop(path, None)
+                if hit is None:
+                    to_probe.append(path)
+                    continue
+                size, mtime_ns, width, height, aspect_ratio, orientation, dhash = hit
+                records[path] = {
+                    'path': path,
+                    'filename': os.path.basename(path),
+                    'width': width,
+                    'height': height,
+                    'aspect_ratio': aspect_ratio,
+                    'orientation': orientation
+                }
+                if compute_hashes:
+                    if dhash is not None:
+                        records[path]['dhash'] = dhash
                     else:
-                        orientation = 'square'     # 正方形
-                    
-                    images.append({
-                        'path': filepath,
-                        'filename': filename,
-                        'width': width,
-                        'height': height,
-                        'aspect_ratio': aspect_ratio,
-                        'orientation': orientation
-                    })
-                except Exception as e:
-                    print(f"无法读取图片 {filepath}: {e}")
-    
+                        to_update[path] = (size, mtime_ns)
+
+            probe_start = time.perf_counter()
+            results = probe_images(to_probe, workers=workers, executor=executor, pool=pool)
+            for result in results:
+                if 'error' in result:
+                    errors.append(result)
+                    continue
+                records[result['path']] = build_image_record(result['path'], result['width'], result['height'])
+                if index is not None:
+                    to_update[result['path']] = changed_stats[result['path']]
+            batch_seconds = time.perf_counter() - probe_start
+            probe_seconds += batch_seconds
+            if to_probe:
+                observe_stage('probe', batch_seconds, len(to_probe))
+
+            if compute_hashes:
+                hash_paths = [path for path in batch_paths if path in records and 'dhash' not in records[path]]
+                hash_start = time.perf_counter()
+                for path, dhash in zip(hash_paths, hash_images(hash_paths, pool)):
+                    records[path]['dhash'] = dhash
+                    if dhash is None:
+                        hash_failed += 1
+                batch_seconds = time.perf_counter() - hash_start
+                hash_seconds += batch_seconds
+                hashed += len(hash_paths)
+                if hash_paths:
+                    observe_stage('dhash', batch_seconds, len(hash_paths))
+
+            if index is not None:
+                for path, (size, mtime_ns) in to_update.items():
+                    updated.append(dict(records[path], size=size, mtime_ns=mtime_ns))
+            report['scanned'] = i + len(batch_paths)
+            report['failed'] = len(errors)
+
+            yield [records[path] for path in batch_paths if path in records]
+
+        if index is not None:
+            # 读取失败的文件也从索引中移除，下次重新探测
+            stale = [index.relpath(err['path']) for err in errors]
+            index.update(updated, removed + stale)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if index is not None:
+            index.close()
+
+    elapsed = time.perf_counter() - start
+    total_files = len(ordered_paths)
+    if errors:
+        record_error('probe', len(errors))
+    if hash_failed:
+        record_error('dhash', hash_failed)
+    if index is not None:
+        record_cache('scan_index', hits=hits, misses=total_files - hits)
+    report.update({
+        'files': total_files,
+        'probed': total_files - hits - len(errors),
+        'failed': len(errors),
+        'index_used': index is not None,
+        'index_hits': hits,
+        'index_pruned': len(removed),
+        'list_seconds': round(listed - start, 4),
+        'probe_seconds': round(probe_seconds, 4),
+        'hashed': hashed,
+        'hash_seconds': round(hash_seconds, 4),
+        'elapsed_seconds': round(elapsed, 4),
+        'images_per_second': round(total_files / elapsed, 1) if elapsed > 0 else 0.0,
+        'executor': executor,
+        'errors': errors
+    })
+
+    if errors:
+        logger.warning("扫描 %s: %d 个文件无法读取", folder_path, len(errors))
+    logger.info(
+        "扫描 %s: %d 个文件 (索引命中 %d), 耗时 %.2fs (%.1f 张/秒)",
+        folder_path, total_files, hits, elapsed, report['images_per_second']
+    )
+
+
+def scan_folder_with_report(
+    folder_path: str,
+    workers: Optional[int] = None,
+    executor: str = 'thread',
+    use_index: bool = True,
+    compute_hashes: bool = False
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    并行扫描文件夹中的所有图片
+
+    Returns:
+        (图片列表, 扫描报告)，参数与报告内容见 iter_scan_batches
+    """
+    report = {}
+    images = []
+    for batch in iter_scan_batches(
+        folder_path,
+        workers=workers,
+        executor=executor,
+        use_index=use_index,
+        batch_size=FULL_SCAN_BATCH_SIZE,
+        report=report,
+        compute_hashes=compute_hashes
+    ):
+        images.extend(batch)
+    return images, report
+
+
+def scan_folder_for_images(
+    folder_path: str,
+    workers: Optional[int] = None,
+    executor: str = 'thread',
+    use_index: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    扫描文件夹中的所有图片
+    返回每张图片的路径和尺寸信息
+    """
+    images, _ = scan_folder_with_report(
+        folder_path, workers=workers, executor=executor, use_index=use_index
+    )
     return images
 
 
-def analyze_buckets(images: List[Dict[str, Any]], n_buckets: int = 3) -> List[Dict[str, Any]]:
+def analyze_buckets(
+    images: Union[List[Dict[str, Any]], ImageTable],
+    n_buckets: int = 3,
+    max_pixels: Optional[int] = None
+) -> List[Dict[str, Any]]:
     """
-    按长宽比分析图片，生成三个桶配置:
-    - A: 横向 (Landscape) - 宽 > 高
-    - B: 正方形 (Square) - 宽 ≈ 高
-    - C: 纵向 (Portrait) - 高 > 宽
+    按长宽比分析图片，生成 n_buckets 个桶配置 (按长宽比从纵向到横向排列，ID 依次为 A、B、C...)
     
-    每个桶的尺寸取该类别的中位数，然后对齐到64倍数
+    桶尺寸使被居中裁剪掉的像素总数最小，像素面积取图片像素数的中位数 (不超过 max_pixels)，
+    宽高对齐到 64 倍数
+    images 可以是图片信息列表或 ImageTable
     """
     if len(images) == 0:
         return []
-    
-    # 按方向分类
-    landscape_images = [img for img in images if img['orientation'] == 'landscape']
-    square_images = [img for img in images if img['orientation'] == 'square']
-    portrait_images = [img for img in images if img['orientation'] == 'portrait']
-    
+
+    table = images if isinstance(images, ImageTable) else ImageTable.from_records(images)
+    with track_stage('analyze', len(table)):
+        shapes = optimize_buckets(table.widths, table.heights, n_buckets=n_buckets, max_pixels=max_pixels)
+
     buckets = []
-    
-    # 横向桶 A
-    if landscape_images:
-        widths = [img['width'] for img in landscape_images]
-        heights = [img['height'] for img in landscape_images]
-        median_width = snap_to_64(np.median(widths))
-        median_height = snap_to_64(np.median(heights))
-    else:
-        median_width = 1024
-        median_height = 768
-    
-    buckets.append({
-        'id': 'A',
-        'name': '横向 (Landscape)',
-        'orientation': 'landscape',
-        'width': max(64, median_width),
-        'height': max(64, median_height),
-        'aspect_ratio': round(median_width / median_height, 4) if median_height > 0 else 1.33,
-        'image_count': len(landscape_images)
-    })
-    
-    # 正方形桶 B
-    if square_images:
-        sizes = [(img['width'] + img['height']) / 2 for img in square_images]
-        median_size = snap_to_64(np.median(sizes))
-    else:
-        median_size = 1024
-    
-    buckets.append({
-        'id': 'B',
-        'name': '正方形 (Square)',
-        'orientation': 'square',
-        'width': max(64, median_size),
-        'height': max(64, median_size),
-        'aspect_ratio': 1.0,
-        'image_count': len(square_images)
-    })
-    
-    # 纵向桶 C
-    if portrait_images:
-        widths = [img['width'] for img in portrait_images]
-        heights = [img['height'] for img in portrait_images]
-        median_width = snap_to_64(np.median(widths))
-        median_height = snap_to_64(np.median(heights))
-    else:
-        median_width = 768
-        median_height = 1024
-    
-    buckets.append({
-        'id': 'C',
-        'name': '纵向 (Portrait)',
-        'orientation': 'portrait',
-        'width': max(64, median_width),
-        'height': max(64, median_height),
-        'aspect_ratio': round(median_width / median_height, 4) if median_height > 0 else 0.75,
-        'image_count': len(portrait_images)
-    })
+    for bucket_id, shape in zip(BUCKET_IDS, shapes):
+        aspect_ratio = shape['width'] / shape['height']
+        orientation = classify_orientation(aspect_ratio)
+        buckets.append({
+            'id': bucket_id,
+            'name': BUCKET_NAMES[orientation],
+            'orientation': orientation,
+            'width': shape['width'],
+            'height': shape['height'],
+            'aspect_ratio': round(aspect_ratio, 4),
+            'image_count': shape['image_count'],
+            'crop_loss': round(shape['cropped_pixels'] / shape['pixels'], 4) if shape['pixels'] else 0.0
+        })
     
     return buckets
 
 
-def assign_images_to_buckets(images: List[Dict[str, Any]], buckets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def assign_table_to_buckets(
+    table: ImageTable,
+    buckets: List[Dict[str, Any]],
+    capacities: Optional[Dict[str, int]] = None,
+    upscale_penalty: float = DEFAULT_UPSCALE_PENALTY
+) -> ImageTable:
+    """
+    按裁剪损失和放大倍数为每张图片选择代价最小的桶，写入 table.bucket_index，
+    并更新每个桶的图片数量和保留像素统计 (bucket['stats'])
+
+    capacities: {桶 ID: 图片数上限}，未列出的桶不限
+    """
+    if not buckets or len(table) == 0:
+        return table
+
+    bucket_widths = np.array([bucket['width'] for bucket in buckets], dtype=np.float64)
+    bucket_heights = np.array([bucket['height'] for bucket in buckets], dtype=np.float64)
+    limits = None
+    if capacities:
+        limits = np.array([capacities.get(bucket['id'], -1) for bucket in buckets], dtype=np.int64)
+
+    with track_stage('assign', len(table)):
+        table.bucket_index = assign_by_cost(
+            table.widths, table.heights, bucket_widths, bucket_heights,
+            capacities=limits, upscale_penalty=upscale_penalty
+        )
+
+    stats = bucket_statistics(table.widths, table.heights, bucket_widths, bucket_heights, table.bucket_index)
+    for bucket, bucket_stats in zip(buckets, stats):
+        bucket['image_count'] = bucket_stats['image_count']
+        bucket['stats'] = bucket_stats
+
+    return table
+
+
+def assign_images_to_buckets(
+    images: List[Dict[str, Any]],
+    buckets: List[Dict[str, Any]],
+    capacities: Optional[Dict[str, int]] = None
+) -> List[Dict[str, Any]]:
     """
-    根据图片方向将图片分配到对应的桶
+    将图片分配到代价最小的桶
     """
     if not buckets:
         return images
+
+    table = assign_table_to_buckets(ImageTable.from_records(images), buckets, capacities)
+    bucket_ids = [bucket['id'] for bucket in buckets]
     
-    # 创建方向到桶ID的映射
-    orientation_to_bucket = {}
-    for bucket in buckets:
-        orientation_to_bucket[bucket['orientation']] = bucket['id']
-    
-    for img in images:
-        orientation = img.get('orientation', 'square')
-        assigned_bucket = orientation_to_bucket.get(orientation, 'B')
-        
-        img['assigned_bucket'] = assigned_bucket
+    for img, bucket_i in zip(images, table.bucket_index.tolist()):
+        img['assigned_bucket'] = bucket_ids[bucket_i]
         img['cropped'] = False
         img['crop_params'] = None
     
-    # 统计每个桶的图片数量
-    for bucket in buckets:
-        bucket['image_count'] = sum(1 for img in images if img.get('assigned_bucket') == bucket['id'])
-    
     return images
 
 
@@ -0,0 +1,183 @@
+"""
+桶分配服务
+按 图片 × 桶 的代价矩阵 (裁剪损失 + 放大惩罚) 为每张图片选择桶，支持每个桶的容量上限，
+并统计每个桶保留的像素比例
+"""
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+# 放大惩罚系数: 代价 = 裁掉的像素比例 + 系数 × log2(放大倍数)
+DEFAULT_UPSCALE_PENALTY = 0.25
+
+# 分块计算代价矩阵，限制内存占用 (每块 图片数 × 桶数)
+COST_CHUNK_SIZE = 65536
+
+
+def crop_geometry(
+    widths: np.ndarray,
+    heights: np.ndarray,
+    bucket_widths: np.ndarray,
+    bucket_heights: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    居中裁剪到桶长宽比后的几何关系 (可广播)
+
+    Returns:
+        (保留像素比例, 缩放到桶尺寸的倍数，大于 1 表示放大)
+    """
+    aspect = widths / np.maximum(heights, 1)
+    ratio = bucket_widths / bucket_heights
+    too_wide = aspect > ratio
+    # 裁剪区域宽度: 图片太宽时为 高 × 桶比例，否则为原宽
+    crop_width = np.where(too_wide, heights * ratio, widths)
+    retained = np.where(too_wide, ratio / aspect, aspect / ratio)
+    scale = bucket_widths / np.maximum(crop_width, 1)
+    return retained, scale
+
+
+def assignment_costs(
+    widths: np.ndarray,
+    heights: np.ndarray,
+    bucket_widths: np.ndarray,
+    bucket_heights: np.ndarray,
+    upscale_penalty: float = DEFAULT_UPSCALE_PENALTY
+) -> np.ndarray:
+    """计算 图片 × 桶 的代价矩阵 (float32)"""
+    retained, scale = crop_geometry(
+        widths[:, None].astype(np.float64),
+        heights[:, None].astype(np.float64),
+        bucket_widths[None, :],
+        bucket_heights[None, :]
+    )
+    cost = 1.0 - retained
+    if upscale_penalty:
+        cost += upscale_penalty * np.log2(np.maximum(scale, 1.0))
+    return cost.astype(np.float32)
+
+
+def _best_two(
+    widths: np.ndarray,
+    heights: np.ndarray,
+    bucket_widths: np.ndarray,
+    bucket_heights: np.ndarray,
+    open_buckets: np.ndarray,
+    upscale_penalty: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    分块求每张图片在可用桶中的最优桶，以及改用次优桶的代价增量 (遗憾值)
+    """
+    count = len(widths)
+    best = np.empty(count, dtype=np.int32)
+    regret = np.zeros(count, dtype=np.float32)
+
+    for start in range(0, count, COST_CHUNK_SIZE):
+        stop = start + COST_CHUNK_SIZE
+        cost = assignment_costs(widths[start:stop], heights[start:stop], bucket_widths, bucket_heights, upscale_penalty)
+        cost[:, ~open_buckets] = np.inf
+        best[start:stop] = np.argmin(cost, axis=1)
+        if open_buckets.sum() > 1:
+            two = np.partition(cost, 1, axis=1)[:, :2]
+            regret[start:stop] = two[:, 1] - two[:, 0]
+
+    return best, regret
+
+
+def assign_by_cost(
+    widths: np.ndarray,
+    heights: np.ndarray,
+    bucket_widths: np.ndarray,
+    bucket_heights: np.ndarray,
+    capacities: Optional[np.ndarray] = None,
+    upscale_penalty: float = DEFAULT_UPSCALE_PENALTY
+) -> np.ndarray:
+    """
+    为每张图片选择代价最小的桶
+
+    capacities 为每个桶的图片数上限 (-1 表示不限)。桶超出容量时，保留换桶代价最大的图片，
+    其余图片在下一轮改选仍有余量的桶，最多 桶数 + 1 轮
+
+    Returns:
+        每张图片的桶序号 (int32)
+    """
+    widths = np.asarray(widths, dtype=np.int64)
+    heights = np.asarray(heights, dtype=np.int64)
+    bucket_widths = np.asarray(bucket_widths, dtype=np.float64)
+    bucket_heights = np.asarray(bucket_heights, dtype=np.float64)
+    n_buckets = len(bucket_widths)
+
+    if capacities is None:
+        capacities = np.full(n_buckets, -1, dtype=np.int64)
+    capacities = np.asarray(capacities, dtype=np.int64)
+    if (capacities >= 0).all() and capacities.sum() < len(widths):
+        raise ValueError(f"桶容量总和 ({int(capacities.sum())}) 小于图片数量 ({len(widths)})")
+
+    assigned = np.full(len(widths), -1, dtype=np.int32)
+    remaining = np.arange(len(widths))
+    left = capacities.copy()
+    open_buckets = left != 0
+
+    while len(remaining):
+        best, regret = _best_two(
+            widths[remaining], heights[remaining],
+            bucket_widths, bucket_heights, open_buckets, upscale_penalty
+        )
+        accepted = np.ones(len(remaining), dtype=bool)
+
+        for b in np.flatnonzero(open_buckets & (left >= 0)):
+            chosen = np.flatnonzero(best == b)
+            if len(chosen) <= left[b]:
+                left[b] -= len(chosen)
+                continue
+            # 超出容量: 按遗憾值从大到小保留，其余图片下一轮重新选择
+            keep = chosen[np.argsort(-regret[chosen], kind='stable')[:left[b]]]
+            accepted[chosen] = False
+            accepted[keep] = True
+            left[b] = 0
+
+        assigned[remaining[accepted]] = best[accepted]
+        remaining = remaining[~accepted]
+        open_buckets = left != 0
+
+    return assigned
+
+
+def bucket_statistics(
+    widths: np.ndarray,
+    heights: np.ndarray,
+    bucket_widths: np.ndarray,
+    bucket_heights: np.ndarray,
+    bucket_index: np.ndarray
+) -> List[Dict[str, Any]]:
+    """
+    统计每个桶的保留像素: 图片数、源像素总数、保留像素总数与比例、需要放大的图片数和最大放大倍数
+    """
+    widths = np.asarray(widths, dtype=np.float64)
+    heights = np.asarray(heights, dtype=np.float64)
+    bucket_widths = np.asarray(bucket_widths, dtype=np.float64)
+    bucket_heights = np.asarray(bucket_heights, dtype=np.float64)
+    n_buckets = len(bucket_widths)
+
+    retained, scale = crop_geometry(
+        widths, heights, bucket_widths[bucket_index], bucket_heights[bucket_index]
+    )
+    source_pixels = widths * heights
+
+    counts = np.bincount(bucket_index, minlength=n_buckets)
+    source = np.bincount(bucket_index, weights=source_pixels, minlength=n_buckets)
+    kept = np.bincount(bucket_index, weights=source_pixels * retained, minlength=n_buckets)
+    upscaled = np.bincount(bucket_index, weights=scale > 1.0, minlength=n_buckets)
+    max_scale = np.zeros(n_buckets)
+    np.maximum.at(max_scale, bucket_index, scale)
+
+    stats = []
+    for b in range(n_buckets):
+        stats.append({
+            'image_count': int(counts[b]),
+            'source_pixels': int(source[b]),
+            'retained_pixels': int(kept[b]),
+            'retained_ratio': round(float(kept[b] / source[b]), 4) if source[b] else 1.0,
+            'upscaled_count': int(upscaled[b]),
+            'max_upscale': round(float(max_scale[b]), 3)
+        })
+    return stats
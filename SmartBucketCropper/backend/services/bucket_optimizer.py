@@ -0,0 +1,191 @@
+"""
+分桶优化服务
+在对数长宽比的直方图上做一维最优量化 (动态规划)，求 N 个桶使被裁掉的像素总数最小。
+只处理分箱统计量，耗时与图片数量基本无关 (百万张图片只多一次直方图统计)
+"""
+import math
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+# 对数长宽比直方图的分箱数与范围 (长宽比超出 1:8 ~ 8:1 的图片按边界统计)
+ASPECT_HISTOGRAM_BINS = 512
+MAX_ASPECT_RATIO = 8.0
+
+# 桶数量上限 (桶 ID 使用 A-Z)
+MAX_BUCKETS = 26
+
+# 桶的最小边长
+MIN_BUCKET_SIDE = 64
+
+
+def snap_to_64(value: float) -> int:
+    """四舍五入到最近的 64 倍数"""
+    return int(round(value / 64) * 64)
+
+
+def aspect_histogram(
+    widths: np.ndarray,
+    heights: np.ndarray,
+    bins: int = ASPECT_HISTOGRAM_BINS
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    按对数长宽比统计直方图
+
+    Returns:
+        (各分箱中心的对数长宽比, 各分箱图片数, 各分箱像素总数)，只保留非空分箱
+    """
+    widths = np.asarray(widths, dtype=np.float64)
+    heights = np.asarray(heights, dtype=np.float64)
+    limit = math.log(MAX_ASPECT_RATIO)
+
+    log_aspect = np.log(np.maximum(widths, 1) / np.maximum(heights, 1))
+    scaled = (np.clip(log_aspect, -limit, limit) + limit) / (2 * limit) * bins
+    index = np.minimum(scaled.astype(np.int64), bins - 1)
+
+    counts = np.bincount(index, minlength=bins)
+    pixels = np.bincount(index, weights=widths * heights, minlength=bins)
+    centers = (np.arange(bins) + 0.5) / bins * (2 * limit) - limit
+
+    nonempty = counts > 0
+    return centers[nonempty], counts[nonempty], pixels[nonempty]
+
+
+def candidate_shapes(area: float, max_pixels: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    列出像素面积约为 area 且边长对齐到 64 倍数的桶尺寸 (每种长宽比只保留一个)
+    指定 max_pixels 时桶的像素数不超过该预算
+
+    Returns:
+        (宽度数组, 高度数组)，按长宽比升序
+    """
+    shapes = {}
+    max_width = int(math.sqrt(area * MAX_ASPECT_RATIO)) + MIN_BUCKET_SIDE
+    for width in range(MIN_BUCKET_SIDE, max_width + 1, 64):
+        height = max(MIN_BUCKET_SIDE, snap_to_64(area / width))
+        if max_pixels:
+            while height > MIN_BUCKET_SIDE and width * height > max_pixels:
+                height -= 64
+            if width * height > max_pixels:
+                continue
+        ratio = width / height
+        if ratio > MAX_ASPECT_RATIO or ratio < 1 / MAX_ASPECT_RATIO:
+            continue
+        # 同一长宽比保留像素数更接近目标面积的尺寸
+        key = round(ratio, 6)
+        if key not in shapes or abs(width * height - area) < abs(shapes[key][0] * shapes[key][1] - area):
+            shapes[key] = (width, height)
+
+    ordered = [shapes[key] for key in sorted(shapes)]
+    return (
+        np.array([w for w, _ in ordered], dtype=np.int64),
+        np.array([h for _, h in ordered], dtype=np.int64)
+    )
+
+
+def _interval_costs(centers: np.ndarray, pixels: np.ndarray, candidate_log_ratios: np.ndarray):
+    """
+    计算每个连续分箱区间 [i, j) 使用最优候选尺寸时被裁掉的像素数
+
+    图片长宽比为 a、桶长宽比为 r 时保留比例为 min(a, r) / max(a, r)，
+    即 exp(-|log a - log r|)
+
+    Returns:
+        (cost[i, j], best[i, j])，best 为区间对应的候选尺寸序号
+    """
+    size = len(centers) + 1
+    cost = np.full((size, size), np.inf)
+    best = np.zeros((size, size), dtype=np.int64)
+    upper = np.triu(np.ones((size, size), dtype=bool), k=1)
+
+    for c, log_ratio in enumerate(candidate_log_ratios):
+        loss = pixels * (1.0 - np.exp(-np.abs(centers - log_ratio)))
+        prefix = np.concatenate(([0.0], np.cumsum(loss)))
+        interval = np.where(upper, prefix[None, :] - prefix[:, None], np.inf)
+        better = interval < cost
+        cost[better] = interval[better]
+        best[better] = c
+
+    return cost, best
+
+
+def optimize_buckets(
+    widths: np.ndarray,
+    heights: np.ndarray,
+    n_buckets: int = 3,
+    max_pixels: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    求 n_buckets 个桶尺寸，使所有图片居中裁剪到所属桶的长宽比时被裁掉的像素总数最小
+
+    桶的像素面积取图片像素数的中位数 (不超过 max_pixels)，边长对齐到 64 倍数。
+    最优分组在按长宽比排序后一定是连续区间，因此在直方图上做动态规划即可求得
+
+    Returns:
+        桶尺寸列表 [{'width', 'height', 'image_count', 'pixels', 'cropped_pixels'}]，按长宽比升序
+    """
+    if n_buckets < 1 or n_buckets > MAX_BUCKETS:
+        raise ValueError(f"桶数量必须在 1 到 {MAX_BUCKETS} 之间")
+    if max_pixels is not None and max_pixels < MIN_BUCKET_SIDE * MIN_BUCKET_SIDE:
+        raise ValueError(f"像素预算不能小于 {MIN_BUCKET_SIDE}x{MIN_BUCKET_SIDE}")
+
+    widths = np.asarray(widths, dtype=np.int64)
+    heights = np.asarray(heights, dtype=np.int64)
+    if len(widths) == 0:
+        return []
+
+    area = float(np.median(widths * heights))
+    if max_pixels:
+        area = min(area, float(max_pixels))
+    area = max(area, float(MIN_BUCKET_SIDE * MIN_BUCKET_SIDE))
+
+    shape_widths, shape_heights = candidate_shapes(area, max_pixels)
+    candidate_log_ratios = np.log(shape_widths / shape_heights)
+
+    centers, counts, pixels = aspect_histogram(widths, heights)
+    n_bins = len(centers)
+    k = min(n_buckets, n_bins, len(shape_widths))
+
+    cost, best = _interval_costs(centers, pixels, candidate_log_ratios)
+
+    # total[m, j]: 前 j 个分箱分成 m 组的最小损失
+    total = np.full((k + 1, n_bins + 1), np.inf)
+    split = np.zeros((k + 1, n_bins + 1), dtype=np.int64)
+    total[0, 0] = 0.0
+    for m in range(1, k + 1):
+        candidates = total[m - 1][:, None] + cost
+        split[m] = np.argmin(candidates, axis=0)
+        total[m] = candidates[split[m], np.arange(n_bins + 1)]
+
+    # 回溯区间
+    intervals = []
+    j = n_bins
+    for m in range(k, 0, -1):
+        i = int(split[m, j])
+        intervals.append((i, j))
+        j = i
+    intervals.reverse()
+
+    # 相邻区间选中同一尺寸时合并
+    results: List[Dict[str, Any]] = []
+    for i, j in intervals:
+        c = int(best[i, j])
+        loss = float(cost[i, j])
+        if results and results[-1]['candidate'] == c:
+            merged = results[-1]
+            merged['image_count'] += int(counts[i:j].sum())
+            merged['pixels'] += float(pixels[i:j].sum())
+            merged['cropped_pixels'] += loss
+            continue
+        results.append({
+            'candidate': c,
+            'width': int(shape_widths[c]),
+            'height': int(shape_heights[c]),
+            'image_count': int(counts[i:j].sum()),
+            'pixels': float(pixels[i:j].sum()),
+            'cropped_pixels': loss
+        })
+
+    for result in results:
+        del result['candidate']
+    return results
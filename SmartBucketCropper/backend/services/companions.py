@@ -0,0 +1,139 @@
+"""
+伴随文件服务
+标签 / 描述等与图片同名的伴随文件 (.txt, .json, .caption, .tags 等) 的查找与复制。
+每个源目录只读取一次目录列表 (os.scandir)，建立 文件名主干 → 伴随文件 的索引并在整个导出中复用，
+代替每张图片逐个扩展名调用 os.path.exists (网络文件系统上每次都是一次往返)
+"""
+import os
+import shutil
+import logging
+import threading
+from typing import Dict, List, Optional, Iterable, Set
+
+logger = logging.getLogger(__name__)
+
+# 默认的伴随文件扩展名，可通过环境变量 SBC_COMPANION_EXTENSIONS (逗号分隔) 覆盖
+DEFAULT_COMPANION_EXTENSIONS = ('.txt', '.json', '.caption', '.tags')
+
+# 伴随文件的写入方式
+# copy: 复制; hardlink: 硬链接 (与源文件共用数据，修改输出会同时修改源文件); reflink: 写时复制的克隆;
+# auto: 先尝试 reflink，不支持时复制
+COMPANION_LINK_MODES = ('auto', 'copy', 'hardlink', 'reflink')
+
+# Linux FICLONE ioctl (btrfs / XFS / bcachefs 等支持写时复制的文件系统)
+FICLONE = 0x40049409
+
+# auto 模式下已知不支持 reflink 的输出目录 (不再逐个文件尝试)
+_no_reflink_dirs: Set[str] = set()
+
+
+def normalize_extensions(extensions: Optional[Iterable[str]]) -> tuple:
+    """统一为小写并带点的扩展名，None 时使用默认值"""
+    if extensions is None:
+        return companion_extensions_from_env()
+    normalized = []
+    for ext in extensions:
+        ext = ext.strip().lower()
+        if not ext:
+            continue
+        normalized.append(ext if ext.startswith('.') else '.' + ext)
+    return tuple(dict.fromkeys(normalized))
+
+
+def companion_extensions_from_env() -> tuple:
+    value = os.environ.get('SBC_COMPANION_EXTENSIONS')
+    if not value:
+        return DEFAULT_COMPANION_EXTENSIONS
+    return normalize_extensions(value.split(','))
+
+
+class CompanionIndex:
+    """
+    按源目录缓存的伴随文件索引 (可在多个线程中使用)
+    伴随文件按 扩展名列表的顺序 返回，与图片文件名主干完全一致、扩展名不区分大小写
+    """
+
+    def __init__(self, extensions: Optional[Iterable[str]] = None):
+        self.extensions = normalize_extensions(extensions)
+        self._order = {ext: i for i, ext in enumerate(self.extensions)}
+        self._dirs: Dict[str, Dict[str, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def _scan_dir(self, directory: str) -> Dict[str, List[str]]:
+        stems: Dict[str, List[tuple]] = {}
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    stem, ext = os.path.splitext(entry.name)
+                    order = self._order.get(ext.lower())
+                    if order is None or not entry.is_file():
+                        continue
+                    stems.setdefault(stem, []).append((order, entry.path))
+        except OSError as e:
+            logger.warning("无法读取目录 %s: %s", directory, e)
+        return {stem: [path for _, path in sorted(found)] for stem, found in stems.items()}
+
+    def find(self, image_path: str) -> List[str]:
+        """图片的伴随文件路径 (首次访问某个目录时读取目录列表)"""
+        if not self.extensions:
+            return []
+        directory, name = os.path.split(image_path)
+        stems = self._dirs.get(directory)
+        if stems is None:
+            stems = self._scan_dir(directory or '.')
+            with self._lock:
+                stems = self._dirs.setdefault(directory, stems)
+        return stems.get(os.path.splitext(name)[0], [])
+
+
+def _reflink(src: str, dst: str):
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def link_or_copy(src: str, dst: str, mode: str = 'auto') -> str:
+    """
+    写入伴随文件，同一文件系统上按 mode 使用硬链接或 reflink，不支持时退回复制
+
+    Returns:
+        实际使用的方式 (hardlink / reflink / copy)
+    """
+    tmp_path = dst + '.tmp'
+    output_dir = os.path.dirname(dst)
+    if mode == 'auto' and output_dir in _no_reflink_dirs:
+        mode = 'copy'
+    if mode in ('hardlink', 'reflink', 'auto'):
+        try:
+            if mode == 'hardlink':
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                os.link(src, tmp_path)
+            else:
+                _reflink(src, tmp_path)
+            os.replace(tmp_path, dst)
+            return 'reflink' if mode != 'hardlink' else 'hardlink'
+        except (OSError, ImportError):
+            # 跨文件系统 (EXDEV)、文件系统不支持或非 Linux 平台
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if mode == 'auto':
+                _no_reflink_dirs.add(output_dir)
+
+    shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+    return 'copy'
+
+
+def write_companions(companions: List[str], output_dir: str, mode: str = 'auto') -> List[str]:
+    """写入伴随文件到输出目录，返回成功写入的输出路径"""
+    copied = []
+    for companion in companions:
+        output_path = os.path.join(output_dir, os.path.basename(companion))
+        try:
+            link_or_copy(companion, output_path, mode)
+            copied.append(output_path)
+        except OSError as e:
+            logger.warning("复制伴随文件失败 %s: %s", companion, e)
+    return copied
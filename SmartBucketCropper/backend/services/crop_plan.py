@@ -0,0 +1,255 @@
+"""
+裁剪计划
+每张图片的桶分配与裁剪区域以紧凑的 NumPy 数组保存为 .npz 文件，
+可以在扫描机器上生成，再在其他机器上批量导出，也可以上传到服务端按计划 ID 导出
+"""
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import zipfile
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Sequence, Iterator, Union, Tuple
+
+import numpy as np
+
+from services.image_table import ImageTable
+
+logger = logging.getLogger(__name__)
+
+# 计划文件格式版本
+PLAN_VERSION = 1
+
+# 路径拼接分隔符 (文件路径中不会出现)
+PATH_SEPARATOR = b'\0'
+
+# 服务端保存上传计划的目录，可通过环境变量覆盖
+PLAN_STORE_DIR = os.environ.get(
+    'SBC_PLAN_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'smartbucketcropper', 'plans')
+)
+
+# 上传计划的大小上限 (MB) 与保存天数 (保存新计划时删除更早的计划)，可通过环境变量覆盖
+PLAN_UPLOAD_MAX_MB = float(os.environ.get('SBC_PLAN_MAX_MB', '512'))
+PLAN_TTL_DAYS = float(os.environ.get('SBC_PLAN_TTL_DAYS', '7'))
+
+PLAN_ID_PATTERN = re.compile(r'^[0-9a-f]{12}$')
+
+
+class PackedPaths(Sequence):
+    """
+    以单个字节串保存的路径列表，按需解码单个路径
+    (几十万条路径只占一块连续内存，不为每条路径常驻一个 str 对象)
+    """
+
+    def __init__(self, data: bytes, count: int):
+        self.data = data
+        if count == 0:
+            self._starts = self._ends = np.zeros(0, dtype=np.int64)
+            return
+        separators = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == PATH_SEPARATOR[0])
+        self._starts = np.concatenate(([0], separators + 1))
+        self._ends = np.concatenate((separators, [len(data)]))
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        raw = self.data[self._starts[index]:self._ends[index]]
+        return raw.decode('utf-8', 'surrogateescape')
+
+    def __iter__(self) -> Iterator[str]:
+        for start, end in zip(self._starts.tolist(), self._ends.tolist()):
+            yield self.data[start:end].decode('utf-8', 'surrogateescape')
+
+
+def _encode_paths(paths: Sequence[str]) -> np.ndarray:
+    """路径列表编码为单个 uint8 数组 (surrogateescape 保证非 UTF-8 文件名可以还原)"""
+    if isinstance(paths, PackedPaths):
+        return np.frombuffer(paths.data, dtype=np.uint8)
+    joined = PATH_SEPARATOR.join(path.encode('utf-8', 'surrogateescape') for path in paths)
+    return np.frombuffer(joined, dtype=np.uint8)
+
+
+@dataclass
+class CropPlan:
+    """
+    裁剪计划
+    bucket_index: 每张图片的桶序号 (对应 buckets)
+    crops: 形状 (n, 4) 的裁剪区域 (x, y, width, height)，基于原图尺寸
+    duplicates: 可选的布尔掩码，True 表示该图片是其他图片的近重复 (导出时可跳过)
+    """
+    paths: Sequence[str]
+    bucket_index: np.ndarray
+    crops: np.ndarray
+    buckets: List[Dict[str, Any]]
+    meta: Dict[str, Any] = field(default_factory=dict)
+    duplicates: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    @classmethod
+    def from_table(
+        cls,
+        table: ImageTable,
+        buckets: List[Dict[str, Any]],
+        meta: Optional[Dict[str, Any]] = None,
+        duplicates: Optional[np.ndarray] = None
+    ) -> 'CropPlan':
+        """由已分配桶的 ImageTable 生成计划，裁剪区域取默认的居中裁剪"""
+        return cls(
+            paths=list(table.paths),
+            bucket_index=table.bucket_index.astype(np.int16),
+            crops=table.default_crops(buckets).astype(np.int32),
+            buckets=[
+                {'id': bucket['id'], 'width': int(bucket['width']), 'height': int(bucket['height'])}
+                for bucket in buckets
+            ],
+            meta=dict(meta or {}),
+            duplicates=None if duplicates is None else np.asarray(duplicates, dtype=bool)
+        )
+
+    def save(self, path: str):
+        """原子写入计划文件"""
+        tmp_path = path + '.tmp'
+        # 近重复掩码是可选字段，旧版本计划文件没有该字段
+        extra = {}
+        if self.duplicates is not None:
+            extra['duplicates'] = np.asarray(self.duplicates, dtype=bool)
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                version=np.array(PLAN_VERSION),
+                count=np.array(len(self.paths)),
+                paths=_encode_paths(self.paths),
+                bucket_index=np.asarray(self.bucket_index, dtype=np.int16),
+                crops=np.asarray(self.crops, dtype=np.int32),
+                bucket_ids=np.array([bucket['id'] for bucket in self.buckets]),
+                bucket_sizes=np.array(
+                    [[bucket['width'], bucket['height']] for bucket in self.buckets], dtype=np.int32
+                ).reshape(-1, 2),
+                meta=np.frombuffer(json.dumps(self.meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8),
+                **extra
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CropPlan':
+        """读取计划文件，格式不符时抛出 ValueError"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['version']) != PLAN_VERSION:
+                    raise ValueError(f"不支持的计划文件版本: {int(data['version'])}")
+                count = int(data['count'])
+                paths = PackedPaths(data['paths'].tobytes(), count)
+                bucket_index = data['bucket_index']
+                crops = data['crops']
+                buckets = [
+                    {'id': str(bucket_id), 'width': int(size[0]), 'height': int(size[1])}
+                    for bucket_id, size in zip(data['bucket_ids'], data['bucket_sizes'])
+                ]
+                meta = json.loads(data['meta'].tobytes().decode('utf-8') or '{}')
+                duplicates = data['duplicates'].astype(bool) if 'duplicates' in data.files else None
+        except (KeyError, ValueError, OSError, EOFError, zipfile.BadZipFile) as e:
+            raise ValueError(f"无法读取计划文件 {path}: {e}")
+
+        if len(paths) != count or len(bucket_index) != count or crops.shape != (count, 4):
+            raise ValueError(f"计划文件已损坏: {path}")
+        if duplicates is not None and duplicates.shape != (count,):
+            raise ValueError(f"计划文件已损坏: {path}")
+        return cls(
+            paths=paths, bucket_index=bucket_index, crops=crops, buckets=buckets, meta=meta,
+            duplicates=duplicates
+        )
+
+    def duplicate_count(self) -> int:
+        return 0 if self.duplicates is None else int(np.count_nonzero(self.duplicates))
+
+    def bucket_counts(self) -> Dict[str, int]:
+        counts = np.bincount(self.bucket_index, minlength=len(self.buckets))
+        return {bucket['id']: int(count) for bucket, count in zip(self.buckets, counts)}
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'total': len(self),
+            'buckets': self.buckets,
+            'bucket_counts': self.bucket_counts(),
+            'duplicates': self.duplicate_count(),
+            'meta': self.meta
+        }
+
+
+def _stored_plan_path(plan_id: str) -> Optional[str]:
+    if not PLAN_ID_PATTERN.match(plan_id):
+        return None
+    return os.path.join(PLAN_STORE_DIR, plan_id + '.npz')
+
+
+def new_plan_upload() -> Tuple[str, str]:
+    """
+    分配计划 ID 和上传用的临时文件路径
+    写完后调用 commit_plan_upload 校验并保存
+    """
+    os.makedirs(PLAN_STORE_DIR, exist_ok=True)
+    plan_id = uuid.uuid4().hex[:12]
+    return plan_id, os.path.join(PLAN_STORE_DIR, plan_id + '.upload')
+
+
+def commit_plan_upload(plan_id: str, upload_path: str) -> CropPlan:
+    """校验上传的计划文件并保存，格式不符时删除并抛出 ValueError"""
+    try:
+        plan = CropPlan.load(upload_path)
+        if len(plan) and (int(plan.bucket_index.min()) < 0 or int(plan.bucket_index.max()) >= len(plan.buckets)):
+            raise ValueError("计划文件中的桶序号超出范围")
+    except ValueError:
+        os.remove(upload_path)
+        raise
+    os.replace(upload_path, _stored_plan_path(plan_id))
+    expire_stored_plans(PLAN_TTL_DAYS * 86400)
+    return plan
+
+
+def expire_stored_plans(max_age: float, now: Optional[float] = None) -> int:
+    """删除超过 max_age 秒的计划和中断遗留的上传文件，返回删除的文件数"""
+    cutoff = (time.time() if now is None else now) - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(PLAN_STORE_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if not entry.name.endswith(('.npz', '.upload')):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    if removed:
+        logger.info("已删除 %d 个过期的裁剪计划", removed)
+    return removed
+
+
+def load_stored_plan(plan_id: str) -> Optional[CropPlan]:
+    """按 ID 读取已上传的计划，不存在时返回 None"""
+    path = _stored_plan_path(plan_id)
+    if path is None or not os.path.exists(path):
+        return None
+    return CropPlan.load(path)
+
+
+def delete_stored_plan(plan_id: str) -> bool:
+    path = _stored_plan_path(plan_id)
+    if path is None:
+        return False
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,230 @@
+"""
+近重复图片检测
+扫描时为每张图片计算 64 位差异哈希 (dHash): 以缩减解码 (JPEG 按 DCT 缩放) 读取灰度小图，
+缩放到 9x8 后逐行比较相邻像素。哈希保存在扫描索引中，未变化的图片再次扫描时不重新计算。
+哈希之间的汉明距离不超过阈值的图片视为近重复，用 BK 树查找近邻 (不逐对比较)，按连通关系分组
+"""
+import time
+import logging
+from concurrent.futures import Executor
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 哈希的行数 (每行比较 HASH_SIZE + 1 个像素，共 HASH_SIZE * HASH_SIZE 位)
+HASH_SIZE = 8
+
+# 解码时的目标尺寸 (缩减解码不小于此尺寸，避免过度失真)
+HASH_DECODE_SIZE = 64
+
+# 默认的近重复汉明距离阈值 (64 位中不同的位数)
+DEFAULT_DUPLICATE_DISTANCE = 6
+
+# 阈值上限 (超过时几乎所有图片都会被视为重复)
+MAX_DUPLICATE_DISTANCE = 16
+
+
+def compute_dhash(image_path: str) -> int:
+    """计算图片的 64 位差异哈希"""
+    with Image.open(image_path) as img:
+        # JPEG 按 DCT 缩放解码为灰度小图；缩放时不使用 reducing_gap，
+        # 先按整数倍缩小会引入混叠，同一图片不同尺寸的哈希差异明显变大
+        img.draft('L', (HASH_DECODE_SIZE, HASH_DECODE_SIZE))
+        small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def format_hash(value: int) -> str:
+    """哈希的十六进制表示 (16 位，API 与图片信息中使用，避免 JSON 数值精度问题)"""
+    return f"{value:016x}"
+
+
+def parse_hash(value: str) -> int:
+    return int(value, 16)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def _hash_one(image_path: str) -> Optional[str]:
+    """计算单个文件的哈希，失败返回 None (可在子进程中执行)"""
+    try:
+        return format_hash(compute_dhash(image_path))
+    except Exception as e:
+        logger.debug("计算哈希失败 %s: %s", image_path, e)
+        return None
+
+
+def hash_images(image_paths: Sequence[str], pool: Optional[Executor] = None) -> List[Optional[str]]:
+    """
+    计算一批图片的哈希 (十六进制)，结果顺序与输入一致，无法读取的图片为 None
+    pool 为空时在当前线程顺序计算
+    """
+    if pool is None or len(image_paths) <= 1:
+        return [_hash_one(path) for path in image_paths]
+    return list(pool.map(_hash_one, image_paths))
+
+
+class BKTree:
+    """
+    汉明距离上的 BK 树
+    每个节点的子节点按与该节点的距离索引，查询半径 r 时只需访问距离在 [d - r, d + r] 内的子树
+    """
+
+    def __init__(self):
+        # 节点: [哈希, 条目, {距离: 子节点}]
+        self._root: Optional[list] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: int, item: Any):
+        """插入一个哈希 (调用方保证哈希互不相同)"""
+        self._size += 1
+        if self._root is None:
+            self._root = [value, item, {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, item, {}]
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> List[Tuple[Any, int]]:
+        """距离不超过 radius 的 [(条目, 距离)]"""
+        found = []
+        if self._root is None:
+            return found
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= radius:
+                found.append((node[1], distance))
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+def find_duplicate_groups(
+    hashes: Sequence[Optional[str]],
+    areas: Optional[Sequence[int]] = None,
+    max_distance: int = DEFAULT_DUPLICATE_DISTANCE
+) -> List[Dict[str, Any]]:
+    """
+    按哈希查找近重复图片组
+
+    Args:
+        hashes: 每张图片的哈希 (十六进制)，None 表示没有哈希 (不参与检测)
+        areas: 每张图片的像素数，每组保留像素数最大的图片 (相同时保留序号最小的)；为空时保留序号最小的
+        max_distance: 汉明距离阈值，距离不超过阈值的图片 (及其传递关系) 归为一组
+
+    Returns:
+        [{'keep': 保留的序号, 'duplicates': [其余序号], 'max_distance': 组内近邻的最大距离}]，按保留的序号排列
+    """
+    if not 0 <= max_distance <= MAX_DUPLICATE_DISTANCE:
+        raise ValueError(f"近重复距离阈值应在 0 到 {MAX_DUPLICATE_DISTANCE} 之间: {max_distance}")
+
+    start = time.perf_counter()
+    # 哈希完全相同的图片先合并，BK 树中只保存不同的哈希
+    by_hash: Dict[int, List[int]] = {}
+    for index, value in enumerate(hashes):
+        if value is not None:
+            by_hash.setdefault(parse_hash(value), []).append(index)
+    values = list(by_hash)
+
+    # 并查集 (按不同哈希的序号)
+    parent = list(range(len(values)))
+    link_distance = [0] * len(values)
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if max_distance > 0:
+        tree = BKTree()
+        for i, value in enumerate(values):
+            # 先查询再插入: 每对近邻只在后插入的一方被找到一次
+            for j, distance in tree.search(value, max_distance):
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parent[root_i] = root_j
+                link_distance[i] = max(link_distance[i], distance)
+                link_distance[j] = max(link_distance[j], distance)
+            tree.add(value, i)
+
+    members: Dict[int, List[int]] = {}
+    distances: Dict[int, int] = {}
+    for i, value in enumerate(values):
+        root = find(i)
+        members.setdefault(root, []).extend(by_hash[value])
+        distances[root] = max(distances.get(root, 0), link_distance[i])
+
+    groups = []
+    for root, indices in members.items():
+        if len(indices) < 2:
+            continue
+        indices.sort()
+        if areas is not None:
+            keep = max(indices, key=lambda index: (areas[index], -index))
+        else:
+            keep = indices[0]
+        groups.append({
+            'keep': keep,
+            'duplicates': [index for index in indices if index != keep],
+            'max_distance': distances[root]
+        })
+    groups.sort(key=lambda group: group['keep'])
+
+    logger.info(
+        "近重复检测: %d 张图片 (%d 个不同哈希)，%d 组，%d 张重复，耗时 %.3fs",
+        sum(len(indices) for indices in by_hash.values()), len(values), len(groups),
+        sum(len(group['duplicates']) for group in groups), time.perf_counter() - start
+    )
+    return groups
+
+
+def duplicate_indices(groups: List[Dict[str, Any]]) -> List[int]:
+    """所有组中不保留的图片序号 (升序)"""
+    return sorted(index for group in groups for index in group['duplicates'])
+
+
+def unique_indices(count: int, groups: List[Dict[str, Any]]) -> List[int]:
+    """排除近重复图片后剩余的图片序号 (升序)"""
+    duplicates = set(duplicate_indices(groups))
+    return [index for index in range(count) if index not in duplicates]
+
+
+def describe_groups(groups: List[Dict[str, Any]], paths: Sequence[str]) -> List[Dict[str, Any]]:
+    """以路径表示的重复组 (API 与命令行输出使用)"""
+    return [
+        {
+            'keep': paths[group['keep']],
+            'duplicates': [paths[index] for index in group['duplicates']],
+            'max_distance': group['max_distance']
+        }
+        for group in groups
+    ]
+
+
+def duplicate_targets(groups: List[Dict[str, Any]], paths: Sequence[str]) -> List[Optional[str]]:
+    """与 paths 逐项对应: 近重复图片为所在组保留图片的路径，其余为 None"""
+    targets: List[Optional[str]] = [None] * len(paths)
+    for group in groups:
+        keep = paths[group['keep']]
+        for index in group['duplicates']:
+            targets[index] = keep
+    return targets
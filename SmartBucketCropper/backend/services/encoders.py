@@ -0,0 +1,105 @@
+"""
+导出编码参数
+每次导出可以选择编码预设 (profile) 并覆盖单项参数: 输出格式、质量、PNG 压缩级别、JPEG 色度抽样等，
+在导出速度和数据集体积之间取舍。编码参数是普通字典，可以传给工作进程并记录在导出清单中
+"""
+import os
+from typing import Dict, Any, Optional
+
+# 可覆盖的输出格式 -> 文件扩展名 (None 表示沿用源文件扩展名对应的格式)
+OUTPUT_FORMATS = {
+    'jpeg': '.jpg',
+    'png': '.png',
+    'webp': '.webp',
+}
+
+# JPEG 色度抽样
+SUBSAMPLING_MODES = ('4:4:4', '4:2:2', '4:2:0')
+
+# 编码预设，未列出的参数使用 Pillow 默认值
+# default: 与之前的导出结果一致 (按扩展名决定格式，质量 95)
+# fast: 优先导出速度 (PNG 低压缩级别、WebP 最快的编码方法)
+# small: 优先数据集体积 (JPEG 优化霍夫曼表 + 渐进式，PNG 最高压缩级别)
+# lossless: 无损 WebP
+ENCODER_PROFILES: Dict[str, Dict[str, Any]] = {
+    'default': {'quality': 95},
+    'fast': {'quality': 90, 'compress_level': 1, 'method': 0},
+    'small': {'quality': 85, 'compress_level': 9, 'optimize': True, 'progressive': True, 'method': 6},
+    'lossless': {'format': 'webp', 'lossless': True, 'method': 4},
+}
+
+# 可以覆盖的参数
+ENCODER_OPTIONS = ('format', 'quality', 'compress_level', 'subsampling', 'optimize', 'progressive', 'lossless', 'method')
+
+
+def resolve_encoder(profile: str = 'default', **overrides) -> Dict[str, Any]:
+    """
+    合并编码预设和覆盖的参数 (值为 None 的参数不覆盖)，参数无效时抛出 ValueError
+    """
+    if profile not in ENCODER_PROFILES:
+        raise ValueError(f"未知的编码预设: {profile}，可选 {', '.join(ENCODER_PROFILES)}")
+    unknown = set(overrides) - set(ENCODER_OPTIONS)
+    if unknown:
+        raise ValueError(f"未知的编码参数: {', '.join(sorted(unknown))}")
+
+    encoder = dict(ENCODER_PROFILES[profile], profile=profile)
+    encoder.update({key: value for key, value in overrides.items() if value is not None})
+
+    fmt = encoder.get('format')
+    if fmt is not None:
+        fmt = fmt.lower()
+        if fmt == 'jpg':
+            fmt = 'jpeg'
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的输出格式: {fmt}，可选 {', '.join(OUTPUT_FORMATS)}")
+        encoder['format'] = fmt
+    if not 1 <= encoder.get('quality', 95) <= 100:
+        raise ValueError("quality 应在 1-100 之间")
+    if not 0 <= encoder.get('compress_level', 6) <= 9:
+        raise ValueError("compress_level 应在 0-9 之间")
+    if not 0 <= encoder.get('method', 4) <= 6:
+        raise ValueError("method 应在 0-6 之间")
+    if encoder.get('subsampling') is not None and encoder['subsampling'] not in SUBSAMPLING_MODES:
+        raise ValueError(f"subsampling 可选 {', '.join(SUBSAMPLING_MODES)}")
+    return encoder
+
+
+def output_filename(filename: str, encoder: Optional[Dict[str, Any]]) -> str:
+    """覆盖输出格式时替换扩展名"""
+    fmt = (encoder or {}).get('format')
+    if fmt is None:
+        return filename
+    stem, ext = os.path.splitext(filename)
+    if ext.lower() in ('.jpg', '.jpeg') and fmt == 'jpeg':
+        return filename
+    return stem + OUTPUT_FORMATS[fmt]
+
+
+def output_format(filename: str) -> str:
+    """由扩展名决定的输出格式 (小写，与 Pillow 的格式名对应)"""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in ('.jpg', '.jpeg'):
+        return 'jpeg'
+    if ext in ('.tif', '.tiff'):
+        return 'tiff'
+    return ext.lstrip('.')
+
+
+def save_kwargs(fmt: str, encoder: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """编码参数转换为 Image.save 的参数 (只传入该格式使用的参数)"""
+    encoder = encoder or ENCODER_PROFILES['default']
+    if fmt == 'jpeg':
+        keys = ('quality', 'optimize', 'progressive', 'subsampling')
+    elif fmt == 'png':
+        keys = ('compress_level', 'optimize')
+    elif fmt == 'webp':
+        keys = ('quality', 'lossless', 'method')
+    else:
+        keys = ('quality',)
+    return {key: encoder[key] for key in keys if key in encoder}
+
+
+def encoder_fingerprint(filename: str, encoder: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """记录在导出清单中的编码参数 (只包含影响该格式输出的参数)"""
+    fmt = output_format(filename)
+    return dict(save_kwargs(fmt, encoder), format=fmt)
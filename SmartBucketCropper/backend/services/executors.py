@@ -0,0 +1,157 @@
+"""
+执行器服务
+阻塞的图片处理 (探测、缩略图、预览、导出) 分别在独立的有界线程池中执行，不占用事件循环。
+每个池限制排队任务数，池已满时抛出 PoolSaturatedError (API 返回 503)，避免一类请求拖垮其他请求
+"""
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, Any, List
+
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# 池名称 -> (默认线程数, 默认最大排队数)，可通过环境变量 SBC_POOL_<名称>_WORKERS / _QUEUE 覆盖
+POOL_DEFAULTS = {
+    'probe': (2, 4),        # 扫描文件夹 / 分桶分配 / 读取裁剪计划 (扫描内部另有探测线程池)
+    'session': (2, 32),     # 会话读写 (与扫描分开，扫描期间编辑裁剪区域不需要排队)
+    'thumbnail': (min(8, os.cpu_count() or 1), 256),
+    'preview': (min(4, os.cpu_count() or 1), 32),
+    'export': (2, 8),       # 导出 (导出内部另有进程池)
+}
+
+
+class PoolSaturatedError(Exception):
+    """执行器已满 (运行中 + 排队的任务数达到上限)"""
+
+    def __init__(self, pool_name: str):
+        super().__init__(f"{pool_name} 任务繁忙，请稍后重试")
+        self.pool_name = pool_name
+
+
+class BoundedPool:
+    """限制排队长度的线程池"""
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"pool-{name}")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected = 0
+        self.completed = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue
+
+    def acquire(self):
+        """占用一个任务名额，池已满时抛出 PoolSaturatedError"""
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self.rejected += 1
+                raise PoolSaturatedError(self.name)
+            self._in_flight += 1
+
+    def release(self):
+        """释放 acquire 占用的名额"""
+        with self._lock:
+            self._in_flight -= 1
+            self.completed += 1
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """提交任务，池已满时抛出 PoolSaturatedError"""
+        self.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self.release()
+            raise
+        future.add_done_callback(lambda _: self.release())
+        return future
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """在池中执行阻塞函数并等待结果"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'active': min(in_flight, self.workers),
+            'queued': max(0, in_flight - self.workers),
+            'rejected': self.rejected,
+            'completed': self.completed
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except ValueError:
+        logger.warning("环境变量 %s 不是整数，使用默认值 %s", name, default)
+        return default
+
+
+_pools: Dict[str, BoundedPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name: str) -> BoundedPool:
+    """获取指定名称的执行器 (首次使用时创建)"""
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            workers, max_queue = POOL_DEFAULTS[name]
+            pool = BoundedPool(
+                name,
+                workers=_env_int(f"SBC_POOL_{name.upper()}_WORKERS", workers),
+                max_queue=_env_int(f"SBC_POOL_{name.upper()}_QUEUE", max_queue)
+            )
+            _pools[name] = pool
+        return pool
+
+
+async def run_in_pool(name: str, fn: Callable, *args, **kwargs) -> Any:
+    """在指定执行器中执行阻塞函数 (路由中代替 run_in_threadpool)"""
+    return await get_pool(name).run(fn, *args, **kwargs)
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """所有执行器的状态"""
+    return {name: get_pool(name).stats() for name in POOL_DEFAULTS}
+
+
+def _collect_pool_metrics() -> List:
+    stats = pool_stats()
+
+    def samples(key: str):
+        return [({'pool': name}, pool[key]) for name, pool in stats.items()]
+
+    return [
+        ('executor_workers', 'gauge', "执行器线程数", samples('workers')),
+        ('executor_active', 'gauge', "执行器运行中的任务数", samples('active')),
+        ('executor_queued', 'gauge', "执行器排队的任务数", samples('queued')),
+        ('executor_rejected_total', 'counter', "执行器已满被拒绝的任务数", samples('rejected')),
+        ('executor_completed_total', 'counter', "执行器完成的任务数", samples('completed')),
+    ]
+
+
+registry.register_collector(_collect_pool_metrics)
+
+
+def shutdown_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
@@ -0,0 +1,340 @@
+"""
+后台导出任务服务
+导出在 export 执行器中后台执行，可查询进度、取消，并通过输出目录中的导出清单续传
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional
+
+from services.export_manifest import ExportManifest
+from services.image_processor import process_batch_export, process_plan_export
+from services.shard_export import process_shard_export
+from services.crop_plan import CropPlan
+from services.executors import get_pool
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+FINISHED_STATES = {JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED}
+
+# 结束的任务保留多久 (秒) 与最多保留几个，提交新任务时清理，之后查询返回 404
+FINISHED_JOB_RETENTION_SECONDS = 3600
+MAX_FINISHED_JOBS = 100
+
+
+class ExportJob:
+    """一个后台导出任务"""
+
+    def __init__(
+        self,
+        images: Optional[List[Dict[str, Any]]],
+        buckets: Optional[Dict[str, Dict[str, int]]],
+        output_dir: str,
+        copy_companions: bool = True,
+        workers: Optional[int] = None,
+        resume: bool = True,
+        plan: Optional[CropPlan] = None,
+        prune: bool = True,
+        companion_extensions: Optional[List[str]] = None,
+        companion_link: str = 'auto',
+        encoder: Optional[Dict[str, Any]] = None,
+        scales: Optional[List[float]] = None,
+        shards: Optional[Dict[str, int]] = None,
+        skip_duplicates: bool = False
+    ):
+        """
+        images / buckets 与 plan 二选一，提供 plan 时按裁剪计划导出
+        prune 为 True 时，导出完成后删除输出目录中不再属于本次导出的旧输出
+        scales 提供时按多个缩放比例输出 (见 process_batch_export)
+        shards 提供时 ({'max_samples', 'max_bytes'}) 导出为 WebDataset tar 分片 (见 process_shard_export)
+        skip_duplicates 为 True 时跳过 plan 中标记为近重复的图片 (images 由调用方标记为未裁剪)
+        """
+        self.job_id = uuid.uuid4().hex[:12]
+        self.images = images or []
+        self.buckets = buckets or {}
+        self.plan = plan
+        self.output_dir = output_dir
+        self.copy_companions = copy_companions
+        self.workers = workers
+        self.resume = resume
+        self.prune = prune
+        self.companion_extensions = companion_extensions
+        self.companion_link = companion_link
+        self.encoder = encoder
+        self.scales = scales
+        self.shards = shards
+        self.skip_duplicates = skip_duplicates
+
+        self.state = JOB_PENDING
+        self.error: Optional[str] = None
+        self.results: Dict[str, Any] = {
+            'total': len(plan) if plan is not None else len(self.images),
+            'success': 0,
+            'failed': 0,
+            'skipped': 0,
+            'up_to_date': 0,
+            'removed': 0,
+            'encode_seconds': 0.0,
+            'bytes_written': 0,
+            'shards': 0,
+            'errors': []
+        }
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.future: Optional[Future] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def start(self):
+        """提交到 export 执行器，执行器已满时抛出 PoolSaturatedError"""
+        self.future = get_pool('export').submit(self._run)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _on_progress(self, results: Dict[str, Any]):
+        self.results = results
+
+    def _run(self):
+        self.state = JOB_RUNNING
+        self.started_at = time.time()
+        manifest = None
+
+        try:
+            if self.shards is not None:
+                # 分片导出使用自己的续传状态，不使用导出清单
+                results = process_shard_export(
+                    self.output_dir,
+                    images=self.images,
+                    buckets=self.buckets,
+                    plan=self.plan,
+                    copy_companions=self.copy_companions,
+                    workers=self.workers,
+                    resume=self.resume,
+                    prune=self.prune,
+                    progress_callback=self._on_progress,
+                    cancel_event=self.cancel_event,
+                    companion_extensions=self.companion_extensions,
+                    encoder=self.encoder,
+                    skip_duplicates=self.skip_duplicates,
+                    **self.shards
+                )
+            else:
+                os.makedirs(self.output_dir, exist_ok=True)
+                manifest = ExportManifest(self.output_dir)
+                if not self.resume:
+                    manifest.invalidate()
+                manifest.set_job(self._manifest_job())
+                manifest.save()
+
+                if self.plan is not None:
+                    results = process_plan_export(
+                        self.plan,
+                        output_dir=self.output_dir,
+                        copy_companions=self.copy_companions,
+                        workers=self.workers,
+                        manifest=manifest,
+                        progress_callback=self._on_progress,
+                        cancel_event=self.cancel_event,
+                        prune=self.prune,
+                        companion_extensions=self.companion_extensions,
+                        companion_link=self.companion_link,
+                        encoder=self.encoder,
+                        scales=self.scales,
+                        skip_duplicates=self.skip_duplicates
+                    )
+                else:
+                    results = process_batch_export(
+                        images=self.images,
+                        buckets=self.buckets,
+                        output_dir=self.output_dir,
+                        copy_companions=self.copy_companions,
+                        workers=self.workers,
+                        manifest=manifest,
+                        progress_callback=self._on_progress,
+                        cancel_event=self.cancel_event,
+                        prune=self.prune,
+                        companion_extensions=self.companion_extensions,
+                        companion_link=self.companion_link,
+                        encoder=self.encoder,
+                        scales=self.scales
+                    )
+            self.results = results
+            self.state = JOB_CANCELLED if results.get('cancelled') else JOB_COMPLETED
+        except Exception as e:
+            logger.exception("导出任务 %s 失败", self.job_id)
+            self.error = str(e)
+            self.state = JOB_FAILED
+        finally:
+            self.finished_at = time.time()
+            # 图片列表和计划只在执行期间需要
+            self.images = []
+            self.plan = None
+            if manifest is not None:
+                manifest.set_job(self._manifest_job())
+                manifest.save()
+
+    def _manifest_job(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'state': self.state,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'total': self.results['total'],
+            'success': self.results['success'],
+            'failed': self.results['failed'],
+            'up_to_date': self.results.get('up_to_date', 0),
+            'removed': self.results.get('removed', 0)
+        }
+
+    def status(self) -> Dict[str, Any]:
+        """当前进度 (已处理数、速率、预计剩余时间)"""
+        results = self.results
+        total = results['total']
+        processed = (
+            results['success'] + results['failed'] +
+            results['skipped'] + results.get('up_to_date', 0)
+        )
+
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+
+        # 速率只统计真正执行了导出的图片
+        exported = results['success'] + results['failed']
+        rate = exported / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, total - processed)
+        eta = None
+        if not self.finished and rate > 0:
+            eta = round(remaining / rate, 1)
+        elif self.finished:
+            eta = 0.0
+
+        return {
+            'job_id': self.job_id,
+            'state': self.state,
+            'output_dir': self.output_dir,
+            'total': total,
+            'processed': processed,
+            'success': results['success'],
+            'failed': results['failed'],
+            'skipped': results['skipped'],
+            'up_to_date': results.get('up_to_date', 0),
+            'removed': results.get('removed', 0),
+            'encode_seconds': round(results.get('encode_seconds', 0.0), 3),
+            'bytes_written': results.get('bytes_written', 0),
+            'shards': results.get('shards', 0),
+            'rate': round(rate, 2),
+            'eta_seconds': eta,
+            'elapsed_seconds': round(elapsed, 2),
+            'errors': list(results.get('errors', [])),
+            'error': self.error
+        }
+
+
+_jobs: Dict[str, ExportJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def _evict_finished_jobs(now: float):
+    """删除超过保留时间的已结束任务，并只保留最近结束的 MAX_FINISHED_JOBS 个 (调用方持有 _jobs_lock)"""
+    finished = sorted(
+        (job for job in _jobs.values() if job.finished and job.finished_at is not None),
+        key=lambda job: job.finished_at
+    )
+    excess = len(finished) - MAX_FINISHED_JOBS
+    for i, job in enumerate(finished):
+        if i < excess or job.finished_at < now - FINISHED_JOB_RETENTION_SECONDS:
+            del _jobs[job.job_id]
+
+
+def _busy_job(target: str) -> Optional[ExportJob]:
+    """写入同一输出目录 (绝对路径) 的进行中任务，调用方需持有 _jobs_lock"""
+    for job in _jobs.values():
+        if not job.finished and os.path.abspath(job.output_dir) == target:
+            return job
+    return None
+
+
+def is_output_dir_busy(output_dir: str) -> bool:
+    """输出目录是否有进行中的后台导出任务 (同步导出写入前检查，避免与任务同时写入导出清单)"""
+    with _jobs_lock:
+        return _busy_job(os.path.abspath(output_dir)) is not None
+
+
+def submit_export_job(
+    images: Optional[List[Dict[str, Any]]],
+    buckets: Optional[Dict[str, Dict[str, int]]],
+    output_dir: str,
+    copy_companions: bool = True,
+    workers: Optional[int] = None,
+    resume: bool = True,
+    plan: Optional[CropPlan] = None,
+    prune: bool = True,
+    companion_extensions: Optional[List[str]] = None,
+    companion_link: str = 'auto',
+    encoder: Optional[Dict[str, Any]] = None,
+    scales: Optional[List[float]] = None,
+    shards: Optional[Dict[str, int]] = None,
+    skip_duplicates: bool = False
+) -> ExportJob:
+    """
+    提交后台导出任务
+    同一输出目录同时只允许一个进行中的任务 (共用导出清单)
+    export 执行器已满时抛出 PoolSaturatedError
+    """
+    target = os.path.abspath(output_dir)
+    with _jobs_lock:
+        _evict_finished_jobs(time.time())
+        busy = _busy_job(target)
+        if busy is not None:
+            raise ValueError(f"输出目录已有进行中的导出任务: {busy.job_id}")
+
+        job = ExportJob(
+            images=images,
+            buckets=buckets,
+            output_dir=output_dir,
+            copy_companions=copy_companions,
+            workers=workers,
+            resume=resume,
+            plan=plan,
+            prune=prune,
+            companion_extensions=companion_extensions,
+            companion_link=companion_link,
+            encoder=encoder,
+            scales=scales,
+            shards=shards,
+            skip_duplicates=skip_duplicates
+        )
+        _jobs[job.job_id] = job
+
+    try:
+        job.start()
+    except Exception:
+        with _jobs_lock:
+            _jobs.pop(job.job_id, None)
+        raise
+    return job
+
+
+def get_export_job(job_id: str) -> Optional[ExportJob]:
+    return _jobs.get(job_id)
+
+
+def list_export_jobs() -> List[ExportJob]:
+    with _jobs_lock:
+        return sorted(_jobs.values(), key=lambda job: job.created_at)
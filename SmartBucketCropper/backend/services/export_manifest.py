@@ -0,0 +1,195 @@
+"""
+导出清单服务
+在输出目录记录每个输出文件对应的源文件指纹、裁剪区域、目标尺寸、编码参数和伴随文件，
+重新导出时跳过已经写入且仍然有效的输出，并删除不再属于本次导出的旧输出
+"""
+import os
+import json
+import time
+import logging
+from typing import Dict, Any, Optional, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 清单文件名 (位于输出目录)
+MANIFEST_FILENAME = '.smartbucket_manifest.json'
+
+# 清单格式版本
+MANIFEST_VERSION = 2
+
+# 导出过程中定期落盘的间隔 (秒)
+MANIFEST_SAVE_INTERVAL = 5.0
+
+
+class ExportManifest:
+    """
+    输出目录的导出清单
+    entries: {输出文件名: 指纹}，指纹包含源文件路径、大小、修改时间、裁剪区域、目标尺寸、
+    编码参数，以及复制的伴随文件 (文件名、大小、修改时间)
+    多分辨率导出的输出文件名为相对于输出目录的路径 (如 x0.5/img.jpg)，伴随文件与输出在同一目录
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.job: Dict[str, Any] = {}
+        self._dirty = False
+        self._last_save = time.monotonic()
+        # 本次导出仍然需要的输出 (其余记录在 prune 时删除)
+        self._kept: Set[str] = set()
+        self._invalidated = False
+        # 输出目录 (及子目录) 中已有的文件名 (首次检查时读取一次目录，代替逐个 os.path.exists)
+        self._existing: Dict[str, Set[str]] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("导出清单无法读取，将重新生成 %s: %s", self.path, e)
+            return
+
+        if data.get('version') != MANIFEST_VERSION:
+            return
+        self.entries = data.get('entries', {})
+        self.job = data.get('job', {})
+
+    @staticmethod
+    def fingerprint(
+        image_path: str,
+        crop_params: Dict[str, Any],
+        target_width: int,
+        target_height: int,
+        encoder: Dict[str, Any],
+        companions: Optional[List[str]] = None,
+        reference_size: Optional[Tuple[int, int]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        计算导出指纹，源文件不存在时返回 None
+        reference_size 为裁剪区域对应的桶尺寸，与输出尺寸不同时 (多分辨率导出的缩放尺寸) 记录在指纹中
+        """
+        try:
+            st = os.stat(image_path)
+        except OSError:
+            return None
+        companion_stats = []
+        for companion in companions or []:
+            try:
+                companion_st = os.stat(companion)
+            except OSError:
+                continue
+            companion_stats.append([os.path.basename(companion), companion_st.st_size, companion_st.st_mtime_ns])
+        fingerprint = {
+            'source': image_path,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'crop': [crop_params['x'], crop_params['y'], crop_params['width'], crop_params['height']],
+            'target': [target_width, target_height],
+            'encoder': encoder,
+            'companions': companion_stats
+        }
+        if reference_size is not None and tuple(reference_size) != (target_width, target_height):
+            fingerprint['reference'] = list(reference_size)
+        return fingerprint
+
+    def keep(self, filename: str):
+        """标记输出仍属于本次导出 (无论是否需要重新写入)"""
+        self._kept.add(filename)
+
+    def invalidate(self):
+        """不再沿用已有记录 (全部重新导出)，但保留记录以便删除旧输出"""
+        self._invalidated = True
+
+    def is_up_to_date(self, filename: str, fingerprint: Optional[Dict[str, Any]]) -> bool:
+        """输出文件存在且指纹与上次导出一致"""
+        if self._invalidated or fingerprint is None or self.entries.get(filename) != fingerprint:
+            return False
+        directory, name = os.path.split(filename)
+        existing = self._existing.get(directory)
+        if existing is None:
+            try:
+                existing = set(os.listdir(os.path.join(self.output_dir, directory)))
+            except OSError:
+                existing = set()
+            self._existing[directory] = existing
+        return name in existing
+
+    def record(self, filename: str, fingerprint: Optional[Dict[str, Any]]):
+        """记录一个成功写入的输出"""
+        if fingerprint is None:
+            return
+        self.entries[filename] = fingerprint
+        self._dirty = True
+
+    def discard(self, filename: str):
+        """移除一个输出记录 (导出失败时调用，避免沿用旧指纹)"""
+        if self.entries.pop(filename, None) is not None:
+            self._dirty = True
+
+    def prune(self) -> int:
+        """
+        删除不再属于本次导出的输出 (只删除清单中记录过的文件及其伴随文件)，返回删除的输出数
+        必须在所有任务都经过 keep 之后调用 (导出被取消时不要调用)
+        """
+        stale = [filename for filename in self.entries if filename not in self._kept]
+        if not stale:
+            return 0
+        # 伴随文件可能被同一目录中仍然保留的输出共用 (同名不同扩展名的图片)
+        kept_companions = {
+            os.path.join(os.path.dirname(filename), companion[0])
+            for filename in self._kept
+            for companion in self.entries.get(filename, {}).get('companions', [])
+        }
+
+        for filename in stale:
+            entry = self.entries.pop(filename)
+            directory = os.path.dirname(filename)
+            names = [filename] + [
+                os.path.join(directory, companion[0]) for companion in entry.get('companions', [])
+                if os.path.join(directory, companion[0]) not in kept_companions
+            ]
+            for name in names:
+                try:
+                    os.remove(os.path.join(self.output_dir, name))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning("删除旧输出失败 %s: %s", name, e)
+        # 不再导出的缩放比例留下的空子目录 (非空时 rmdir 失败，保留)
+        for directory in {os.path.dirname(filename) for filename in stale} - {''}:
+            try:
+                os.rmdir(os.path.join(self.output_dir, directory))
+            except OSError:
+                pass
+        self._dirty = True
+        logger.info("已删除 %d 个不再属于导出的旧输出: %s", len(stale), self.output_dir)
+        return len(stale)
+
+    def set_job(self, job: Dict[str, Any]):
+        """记录当前导出任务的状态"""
+        self.job = job
+        self._dirty = True
+
+    def save(self):
+        """原子写入清单文件"""
+        tmp_path = self.path + '.tmp'
+        data = {'version': MANIFEST_VERSION, 'job': self.job, 'entries': self.entries}
+        try:
+            # json.dumps 使用 C 编码器，比流式的 json.dump 快一个数量级 (十万条记录约 0.3 秒)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("导出清单写入失败 %s: %s", self.path, e)
+            return
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    def save_if_due(self):
+        """距离上次落盘超过间隔时写入，保证中断后可以续传"""
+        if self._dirty and time.monotonic() - self._last_save >= MANIFEST_SAVE_INTERVAL:
+            self.save()
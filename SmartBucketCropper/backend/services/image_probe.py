@@ -0,0 +1,185 @@
+"""
+图片尺寸探测服务
+只读取文件头字节获取宽高，并支持线程池 / 进程池并行探测
+"""
+import os
+import struct
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Dict, Any, Tuple, Iterable, Optional
+
+from PIL import Image
+
+# 常见格式只需要读取文件头的前几十个字节
+HEADER_READ_SIZE = 64
+
+# JPEG 的 SOF 标记 (不包含 DHT / JPG / DAC)
+JPEG_SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF
+}
+
+# 可选的执行器类型
+PROBE_EXECUTORS = ('thread', 'process')
+
+# 线程池默认并发数 (探测以 IO 为主，网络文件系统上需要较高并发掩盖延迟)
+DEFAULT_THREAD_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# 进程池默认并发数
+DEFAULT_PROCESS_WORKERS = os.cpu_count() or 1
+
+# 进程池每次分发的任务数，减少进程间通信开销
+PROCESS_CHUNK_SIZE = 256
+
+
+def _read_jpeg_size(f) -> Optional[Tuple[int, int]]:
+    """沿 JPEG 标记段跳转直到 SOF，只读取段头"""
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        # 跳过填充字节
+        marker = f.read(1)
+        while marker == b'\xff':
+            marker = f.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        # 无长度的独立标记
+        if code == 0x01 or 0xD0 <= code <= 0xD9:
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if code in JPEG_SOF_MARKERS:
+            sof = f.read(5)
+            if len(sof) < 5:
+                return None
+            height, width = struct.unpack('>HH', sof[1:5])
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _parse_header(f, head: bytes) -> Optional[Tuple[int, int]]:
+    """根据文件头识别格式并解析宽高，无法识别时返回 None"""
+    # PNG: 签名 + IHDR
+    if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+        return struct.unpack('>II', head[16:24])
+
+    # GIF
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack('<HH', head[6:10])
+
+    # BMP
+    if head[:2] == b'BM' and len(head) >= 26:
+        dib_size = struct.unpack('<I', head[14:18])[0]
+        if dib_size == 12:
+            return struct.unpack('<HH', head[18:22])
+        width, height = struct.unpack('<ii', head[18:26])
+        return width, abs(height)
+
+    # WebP
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        chunk = head[12:16]
+        if chunk == b'VP8 ' and len(head) >= 30:
+            width, height = struct.unpack('<HH', head[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L' and len(head) >= 25:
+            bits = struct.unpack('<I', head[21:25])[0]
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X' and len(head) >= 30:
+            width = int.from_bytes(head[24:27], 'little') + 1
+            height = int.from_bytes(head[27:30], 'little') + 1
+            return width, height
+        return None
+
+    # JPEG
+    if head[:2] == b'\xff\xd8':
+        return _read_jpeg_size(f)
+
+    return None
+
+
+def probe_image_size(image_path: str) -> Tuple[int, int]:
+    """
+    只读取文件头获取图片宽高
+    无法直接解析的格式 (如 TIFF) 回退到 Pillow 的惰性打开，同样不解码像素
+    """
+    with open(image_path, 'rb') as f:
+        head = f.read(HEADER_READ_SIZE)
+        size = _parse_header(f, head)
+
+    if size and size[0] > 0 and size[1] > 0:
+        return int(size[0]), int(size[1])
+
+    with Image.open(image_path) as img:
+        return img.size
+
+
+def _probe_one(image_path: str) -> Dict[str, Any]:
+    """探测单个文件，异常转换为结构化错误 (可在子进程中执行)"""
+    try:
+        width, height = probe_image_size(image_path)
+        return {'path': image_path, 'width': width, 'height': height}
+    except Exception as e:
+        return {'path': image_path, 'error': f"{type(e).__name__}: {e}"}
+
+
+def _pool_settings(executor: str, workers: Optional[int]):
+    """根据执行器类型确定 (池类型, 并发数)"""
+    if executor not in PROBE_EXECUTORS:
+        raise ValueError(f"不支持的执行器类型: {executor}")
+    if executor == 'process':
+        return ProcessPoolExecutor, workers or DEFAULT_PROCESS_WORKERS
+    return ThreadPoolExecutor, workers or DEFAULT_THREAD_WORKERS
+
+
+def create_probe_pool(workers: Optional[int] = None, executor: str = 'thread') -> Executor:
+    """
+    创建探测用的池，供多次调用 probe_images 复用
+    (分批扫描时避免每批重复创建进程池)
+    """
+    pool_class, workers = _pool_settings(executor, workers)
+    return pool_class(max_workers=max(1, workers))
+
+
+def probe_images(
+    image_paths: Iterable[str],
+    workers: Optional[int] = None,
+    executor: str = 'thread',
+    pool: Optional[Executor] = None
+) -> List[Dict[str, Any]]:
+    """
+    并行探测一批图片的尺寸
+
+    Args:
+        image_paths: 图片路径列表
+        workers: 并发数，为空时按执行器类型取默认值
+        executor: 'thread' (线程池) 或 'process' (进程池)
+        pool: 已创建的池 (见 create_probe_pool)，为空时临时创建
+
+    Returns:
+        与输入顺序一致的结果列表，
+        成功为 {'path', 'width', 'height'}，失败为 {'path', 'error'}
+    """
+    paths = list(image_paths)
+    pool_class, workers = _pool_settings(executor, workers)
+    if not paths:
+        return []
+
+    chunksize = 1
+    if executor == 'process':
+        chunksize = max(1, min(PROCESS_CHUNK_SIZE, len(paths) // (workers * 4) or 1))
+
+    # executor.map 保证结果顺序与输入一致
+    if pool is not None:
+        return list(pool.map(_probe_one, paths, chunksize=chunksize))
+
+    if workers <= 1 or len(paths) == 1:
+        return [_probe_one(path) for path in paths]
+
+    with pool_class(max_workers=min(workers, len(paths))) as pool:
+        return list(pool.map(_probe_one, paths, chunksize=chunksize))
@@ -2,10 +2,47 @@
 图像处理服务
 使用 Pillow 进行裁剪、缩放和导出
 """
+import io
 import os
-import shutil
-from typing import Dict, Any, List, Optional, Tuple
-from PIL import Image
+import math
+import time
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from typing import Dict, Any, List, Optional, Tuple, Callable, Iterator
+from PIL import Image, ImageFile
+
+from services.export_manifest import ExportManifest
+from services.companions import CompanionIndex, write_companions
+from services.encoders import output_filename, output_format, save_kwargs, encoder_fingerprint
+from services.metrics import observe_stage, track_stage, record_bytes, record_error, record_cache
+
+logger = logging.getLogger(__name__)
+
+# 批量导出默认并行进程数
+DEFAULT_EXPORT_WORKERS = os.cpu_count() or 1
+
+# 每个工作进程允许的在途任务数
+EXPORT_IN_FLIGHT_PER_WORKER = 4
+
+# 缩减解码时保留的分辨率余量 (与 Image.thumbnail 的默认 reducing_gap 一致，保证 LANCZOS 质量)
+DRAFT_REDUCING_GAP = 2.0
+
+# 裁剪预览图的最大边长
+PREVIEW_MAX_SIZE = 400
+
+# 导出的缩放算法 (与编码参数一起记录在导出清单中，修改后重新导出会重新写入所有图片)
+EXPORT_RESAMPLE = 'lanczos'
+
+# 多分辨率导出允许的最大缩放比例
+MAX_EXPORT_SCALE = 4.0
+
+# raw 解码器常见原始模式的每像素位数 (用于只读取裁剪区域覆盖的行)
+RAW_MODE_BITS = {
+    '1': 1, 'L': 8, 'P': 8, 'LA': 16, 'I;16': 16, 'I;16B': 16,
+    'RGB': 24, 'BGR': 24, 'RGBA': 32, 'RGBX': 32, 'BGRA': 32, 'BGRX': 32,
+    'CMYK': 32, 'I': 32, 'F': 32,
+}
 
 
 def snap_to_64(value: int) -> int:
@@ -13,12 +50,257 @@ def snap_to_64(value: int) -> int:
     return int(round(value / 64) * 64)
 
 
+def normalize_scales(scales: Optional[List[float]]) -> Optional[List[float]]:
+    """校验多分辨率导出的缩放比例 (去重并保持顺序)，为空时返回 None (单一分辨率导出)"""
+    if not scales:
+        return None
+    normalized = []
+    for scale in scales:
+        scale = float(scale)
+        if not 0 < scale <= MAX_EXPORT_SCALE:
+            raise ValueError(f"缩放比例应在 0 到 {MAX_EXPORT_SCALE:g} 之间: {scale:g}")
+        if scale not in normalized:
+            normalized.append(scale)
+    return normalized
+
+
+def scale_dirname(scale: float) -> str:
+    """多分辨率导出中某个缩放比例的输出子目录名 (如 x0.5、x1)"""
+    return f"x{scale:g}"
+
+
+def scaled_bucket_size(width: int, height: int, scale: float) -> Tuple[int, int]:
+    """
+    按比例缩放桶尺寸并对齐到 64 倍数 (至少 64)
+    宽高分别对齐，长宽比与原桶略有不同，缩放时先用 aspect_fit_box 居中裁剪到该尺寸的长宽比
+    """
+    return max(64, snap_to_64(width * scale)), max(64, snap_to_64(height * scale))
+
+
+def aspect_fit_box(
+    box: Tuple[float, float, float, float],
+    width: int,
+    height: int
+) -> Tuple[float, float, float, float]:
+    """box 内居中、长宽比为 width:height 的最大区域 (浮点数，用于 resize 的 box 参数)"""
+    left, top, right, bottom = box
+    box_width = right - left
+    box_height = bottom - top
+    if box_width * height > box_height * width:
+        fit_width = box_height * width / height
+        left += (box_width - fit_width) / 2
+        return left, top, left + fit_width, bottom
+    fit_height = box_width * height / width
+    top += (box_height - fit_height) / 2
+    return left, top, right, top + fit_height
+
+
+def draft_for_region(
+    img: Image.Image,
+    box: Tuple[float, float, float, float],
+    output_size: Tuple[int, int],
+    reducing_gap: float = DRAFT_REDUCING_GAP
+) -> Tuple[float, float, float, float]:
+    """
+    为裁剪区域选择最低的解码分辨率 (JPEG DCT 缩放，1/2、1/4、1/8)
+    保证区域在缩减解码后仍不小于 output_size * reducing_gap，必须在 load() 之前调用
+
+    Args:
+        img: 尚未解码的图片
+        box: 原图坐标系下的区域 (left, top, right, bottom)
+        output_size: 区域最终输出的尺寸
+
+    Returns:
+        缩减解码后坐标系下的区域 (浮点数，可直接用于 resize 的 box 参数)
+    """
+    left, top, right, bottom = box
+    region_scale = min(
+        (right - left) / max(1, output_size[0]),
+        (bottom - top) / max(1, output_size[1])
+    ) / reducing_gap
+    if img.format != 'JPEG' or region_scale < 2:
+        return box
+
+    width, height = img.size
+    img.draft(None, (math.ceil(width / region_scale), math.ceil(height / region_scale)))
+    scale_x = img.size[0] / width
+    scale_y = img.size[1] / height
+    return (left * scale_x, top * scale_y, right * scale_x, bottom * scale_y)
+
+
+def _replace_tile(tile, extents, offset):
+    return ImageFile._Tile(tile[0], extents, offset, tile[3])
+
+
+def _raw_stride(tile, width: int) -> Optional[int]:
+    """raw 解码器的行字节数，无法确定时返回 None"""
+    rawmode, stride = tile[3][0], tile[3][1]
+    if stride:
+        return abs(stride)
+    bits = RAW_MODE_BITS.get(rawmode)
+    if bits is None:
+        return None
+    return (width * bits + 7) // 8
+
+
+def restrict_decode_region(
+    img: Image.Image,
+    region: Tuple[float, float, float, float]
+) -> Tuple[float, float, float, float]:
+    """
+    只解码与区域重叠的数据块，必须在 load() 之前调用 (在 draft_for_region 之后)
+    - 分块 / 分条 TIFF 等多数据块格式: 只保留与区域重叠的块
+    - 未压缩的单块格式 (TIFF、BMP 等 raw): 只读取区域覆盖的行
+    - 非隔行 PNG: 解码到区域底边即停止
+
+    Returns:
+        解码范围缩小后坐标系下的区域
+    """
+    width, height = img.size
+    tiles = list(img.tile)
+    if not tiles or img.format == 'JPEG' or getattr(img, 'is_animated', False):
+        return region
+
+    left = max(0, math.floor(region[0]))
+    top = max(0, math.floor(region[1]))
+    right = min(width, math.ceil(region[2]))
+    bottom = min(height, math.ceil(region[3]))
+    if left >= right or top >= bottom:
+        return region
+
+    if len(tiles) > 1:
+        if any(tile[0] == 'libtiff' for tile in tiles):
+            return region
+        keep = [
+            tile for tile in tiles
+            if tile[1][0] < right and tile[1][2] > left and tile[1][1] < bottom and tile[1][3] > top
+        ]
+        if not keep or len(keep) == len(tiles):
+            return region
+        x0 = min(tile[1][0] for tile in keep)
+        y0 = min(tile[1][1] for tile in keep)
+        x1 = max(tile[1][2] for tile in keep)
+        y1 = max(tile[1][3] for tile in keep)
+        img.tile = [
+            _replace_tile(
+                tile,
+                (tile[1][0] - x0, tile[1][1] - y0, tile[1][2] - x0, tile[1][3] - y0),
+                tile[2]
+            )
+            for tile in keep
+        ]
+        img._size = (x1 - x0, y1 - y0)
+        return (region[0] - x0, region[1] - y0, region[2] - x0, region[3] - y0)
+
+    tile = tiles[0]
+    if tuple(tile[1]) != (0, 0, width, height):
+        return region
+
+    if tile[0] == 'raw' and isinstance(tile[3], tuple) and len(tile[3]) >= 3:
+        stride = _raw_stride(tile, width)
+        orientation = tile[3][2]
+        if stride is None or orientation not in (1, -1):
+            return region
+        # 自下而上存储 (BMP) 时，文件中的第一行是图片的最后一行
+        first_row = top if orientation == 1 else height - bottom
+        img.tile = [_replace_tile(tile, (0, 0, width, bottom - top), tile[2] + first_row * stride)]
+        img._size = (width, bottom - top)
+        return (region[0], region[1] - top, region[2], region[3] - top)
+
+    if tile[0] == 'zip' and img.format == 'PNG' and not img.info.get('interlace'):
+        img.tile = [_replace_tile(tile, (0, 0, width, bottom), tile[2])]
+        img._size = (width, bottom)
+        return region
+
+    return region
+
+
+def load_crop_region(
+    img: Image.Image,
+    box: Tuple[float, float, float, float],
+    output_size: Tuple[int, int],
+    stats: Optional[Dict[str, Any]] = None
+) -> Tuple[Image.Image, Tuple[float, float, float, float]]:
+    """
+    按裁剪区域解码: 先选择缩减解码比例，再只解码与区域重叠的数据，
+    最后裁出区域的整数外接框 (超出原图的部分以黑色填充，与 Image.crop 一致)
+    stats: 提供时写入解码耗时 decode_seconds 和裁剪耗时 crop_seconds
+
+    Returns:
+        (区域图片, 区域图片坐标系下的精确区域，可用于 resize 的 box 参数)
+    """
+    start = time.perf_counter()
+    region = draft_for_region(img, box, output_size)
+    region = restrict_decode_region(img, region)
+    img.load()
+    decoded = time.perf_counter()
+
+    left, top = math.floor(region[0]), math.floor(region[1])
+    right, bottom = math.ceil(region[2]), math.ceil(region[3])
+    cropped = img.crop((left, top, right, bottom))
+    if stats is not None:
+        stats['decode_seconds'] = decoded - start
+        stats['crop_seconds'] = time.perf_counter() - decoded
+    return cropped, (region[0] - left, region[1] - top, region[2] - left, region[3] - top)
+
+
+def _source_size(img: Image.Image) -> int:
+    """源文件字节数 (在已打开的文件上 fstat，不额外访问路径)"""
+    try:
+        return os.fstat(img.fp.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def render_crop_preview(
+    image_path: str,
+    crop_params: Dict[str, Any],
+    bucket_width: int,
+    bucket_height: int,
+    max_size: int = PREVIEW_MAX_SIZE
+) -> bytes:
+    """
+    生成裁剪预览图 (JPEG)
+    按预览尺寸缩减解码，并尽量只解码裁剪区域
+    """
+    x = crop_params['x']
+    y = crop_params['y']
+    box = (x, y, x + crop_params['width'], y + crop_params['height'])
+
+    # 缩放到目标尺寸的缩略图 (保持裁剪区域比例)
+    bound_width, bound_height = min(bucket_width, max_size), min(bucket_height, max_size)
+    ratio = min(bound_width / crop_params['width'], bound_height / crop_params['height'], 1.0)
+    preview_size = (
+        max(1, round(crop_params['width'] * ratio)),
+        max(1, round(crop_params['height'] * ratio))
+    )
+
+    with track_stage('preview'):
+        with Image.open(image_path) as img:
+            record_bytes('preview', read=_source_size(img))
+            cropped, region = load_crop_region(img, box, preview_size)
+
+        preview = cropped.resize(
+            preview_size, Image.Resampling.LANCZOS, box=region, reducing_gap=DRAFT_REDUCING_GAP
+        )
+
+        # 转换为 RGB
+        if preview.mode not in ('RGB', 'L'):
+            preview = preview.convert('RGB')
+
+        buffer = io.BytesIO()
+        preview.save(buffer, format='JPEG', quality=85)
+        return buffer.getvalue()
+
+
 def crop_and_resize_image(
     image_path: str,
     crop_params: Dict[str, Any],
     target_width: int,
     target_height: int,
-    output_path: str
+    output_path: str,
+    encoder: Optional[Dict[str, Any]] = None,
+    stats: Optional[Dict[str, Any]] = None
 ) -> bool:
     """
     裁剪并缩放图片
@@ -28,89 +310,344 @@ def crop_and_resize_image(
         crop_params: 裁剪参数 {'x': int, 'y': int, 'width': int, 'height': int}
         target_width: 目标宽度 (必须是64的倍数)
         target_height: 目标高度 (必须是64的倍数)
-        output_path: 输出路径
+        output_path: 输出路径 (扩展名决定输出格式)
+        encoder: 编码参数 (services.encoders.resolve_encoder)，为空时使用默认预设
+        stats: 提供时写入各步骤耗时 (decode_seconds / crop_seconds / resize_seconds / encode_seconds)、
+               读取的源文件字节数 bytes_read 和输出字节数 bytes
     
     Returns:
         bool: 是否成功
     """
+    return crop_and_resize_multi(
+        image_path, crop_params, [(target_width, target_height, output_path)], encoder, stats
+    )
+
+
+def crop_and_resize_multi(
+    image_path: str,
+    crop_params: Dict[str, Any],
+    outputs: List[Tuple[int, int, str]],
+    encoder: Optional[Dict[str, Any]] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    reference_size: Optional[Tuple[int, int]] = None
+) -> bool:
+    """
+    裁剪一次并输出多个尺寸 (多分辨率导出)
+    按最大的输出尺寸解码裁剪区域，最大的输出由裁剪区域缩放，其余尺寸依次由上一个输出继续缩小，
+    不重复解码和裁剪
+
+    Args:
+        outputs: [(目标宽度, 目标高度, 输出路径)]，宽高必须是 64 的倍数
+        reference_size: 裁剪区域对应的桶尺寸 (见 iter_resized_crops)
+        其余参数同 crop_and_resize_image，stats 中的缩放 / 编码耗时和输出字节数为所有输出之和
+
+    Returns:
+        bool: 是否全部成功
+    """
+    if stats is None:
+        stats = {}
+    outputs = sorted(outputs, key=lambda output: output[0] * output[1], reverse=True)
     try:
-        with Image.open(image_path) as img:
-            # 转换为 RGB (处理 RGBA 或其他模式)
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            
-            # 裁剪区域
-            x = crop_params['x']
-            y = crop_params['y']
-            width = crop_params['width']
-            height = crop_params['height']
-            
-            # 执行裁剪
-            cropped = img.crop((x, y, x + width, y + height))
-            
-            # 使用 LANCZOS 缩放到目标尺寸
-            resized = cropped.resize((target_width, target_height), Image.Resampling.LANCZOS)
-            
-            # 最终检查：确保输出尺寸是 64 的倍数
-            final_width, final_height = resized.size
-            assert final_width % 64 == 0, f"输出宽度 {final_width} 不是 64 的倍数"
-            assert final_height % 64 == 0, f"输出高度 {final_height} 不是 64 的倍数"
-            
+        resized_images = iter_resized_crops(
+            image_path, crop_params, [output[:2] for output in outputs], stats, reference_size
+        )
+        for resized, (_, _, output_path) in zip(resized_images, outputs):
             # 确保输出目录存在
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
             
             # 保存图片
-            resized.save(output_path, quality=95)
-            
-            return True
+            start = time.perf_counter()
+            resized.save(output_path, **save_kwargs(output_format(output_path), encoder))
+            stats['encode_seconds'] += time.perf_counter() - start
+            stats['bytes'] += os.path.getsize(output_path)
+        
+        return True
             
     except Exception as e:
-        print(f"处理图片失败 {image_path}: {e}")
+        logger.warning("处理图片失败 %s: %s", image_path, e, extra={'image_path': image_path})
         return False
 
 
-def find_companion_files(image_path: str) -> List[str]:
+def encode_crop(
+    image_path: str,
+    crop_params: Dict[str, Any],
+    target_width: int,
+    target_height: int,
+    filename: str,
+    encoder: Optional[Dict[str, Any]] = None,
+    stats: Optional[Dict[str, Any]] = None
+) -> bytes:
     """
-    查找与图片同名的伴随文件 (.txt, .json, .caption 等)
+    裁剪缩放后编码到内存 (分片输出使用)，格式由 filename 的扩展名决定，失败时抛出异常
+    stats 同 crop_and_resize_image
     """
-    companion_extensions = ['.txt', '.json', '.caption', '.tags']
-    companions = []
-    
-    base_path = os.path.splitext(image_path)[0]
-    
-    for ext in companion_extensions:
-        companion_path = base_path + ext
-        if os.path.exists(companion_path):
-            companions.append(companion_path)
-    
-    return companions
+    if stats is None:
+        stats = {}
+    resized = next(iter_resized_crops(image_path, crop_params, [(target_width, target_height)], stats))
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    fmt = output_format(filename)
+    resized.save(buffer, format=fmt, **save_kwargs(fmt, encoder))
+    data = buffer.getvalue()
+    stats['encode_seconds'] += time.perf_counter() - start
+    stats['bytes'] += len(data)
+    return data
 
 
-def copy_companion_files(image_path: str, output_dir: str) -> List[str]:
+def iter_resized_crops(
+    image_path: str,
+    crop_params: Dict[str, Any],
+    sizes: List[Tuple[int, int]],
+    stats: Dict[str, Any],
+    reference_size: Optional[Tuple[int, int]] = None
+) -> Iterator[Image.Image]:
     """
-    复制伴随文件到输出目录
+    解码裁剪区域并依次生成各尺寸的图片 (sizes 需按面积从大到小排列)
+    第一个尺寸由裁剪区域缩放，其余尺寸由上一个继续缩小；初始化 stats 中的缩放 / 编码耗时和输出字节数
+    reference_size 为裁剪区域对应的桶尺寸，其他尺寸 (多分辨率导出的缩放尺寸) 先居中裁剪到各自的长宽比再缩放，
+    避免宽高分别对齐 64 造成拉伸
     """
-    companions = find_companion_files(image_path)
-    copied = []
-    
-    for companion in companions:
-        filename = os.path.basename(companion)
-        output_path = os.path.join(output_dir, filename)
+    with Image.open(image_path) as img:
+        stats['bytes_read'] = _source_size(img)
+        # 裁剪区域
+        x = crop_params['x']
+        y = crop_params['y']
+        width = crop_params['width']
+        height = crop_params['height']
         
-        try:
-            shutil.copy2(companion, output_path)
-            copied.append(output_path)
-        except Exception as e:
-            print(f"复制伴随文件失败 {companion}: {e}")
+        # 只解码裁剪区域 (缩减解码 / 只读取重叠的数据块)
+        cropped, region = load_crop_region(img, (x, y, x + width, y + height), sizes[0], stats)
     
-    return copied
+    # 裁剪后再转换为 RGB (处理 RGBA 或其他模式)，避免复制整幅图片
+    if cropped.mode not in ('RGB', 'L'):
+        cropped = cropped.convert('RGB')
+
+    stats['resize_seconds'] = 0.0
+    stats['encode_seconds'] = 0.0
+    stats['bytes'] = 0
+    resized = None
+    for target_width, target_height in sizes:
+        # 使用 LANCZOS 缩放到目标尺寸 (后续尺寸由上一个输出继续缩小)
+        start = time.perf_counter()
+        if resized is None:
+            box = region
+            if reference_size is not None and (target_width, target_height) != tuple(reference_size):
+                box = aspect_fit_box(region, target_width, target_height)
+            resized = cropped.resize((target_width, target_height), Image.Resampling.LANCZOS, box=box)
+        else:
+            box = aspect_fit_box((0, 0) + resized.size, target_width, target_height)
+            resized = resized.resize((target_width, target_height), Image.Resampling.LANCZOS, box=box)
+        stats['resize_seconds'] += time.perf_counter() - start
+        
+        # 最终检查：确保输出尺寸是 64 的倍数
+        final_width, final_height = resized.size
+        assert final_width % 64 == 0, f"输出宽度 {final_width} 不是 64 的倍数"
+        assert final_height % 64 == 0, f"输出高度 {final_height} 不是 64 的倍数"
+        yield resized
+
+
+def find_companion_files(image_path: str, extensions: Optional[List[str]] = None) -> List[str]:
+    """
+    查找与图片同名的伴随文件 (.txt, .json, .caption 等)
+    单张图片使用；批量导出时使用 CompanionIndex，每个目录只读取一次列表
+    """
+    return CompanionIndex(extensions).find(image_path)
+
+
+def copy_companion_files(image_path: str, output_dir: str, link: str = 'auto') -> List[str]:
+    """
+    复制伴随文件到输出目录
+    """
+    return write_companions(find_companion_files(image_path), output_dir, link)
+
+
+def _export_one(
+    image_path: str,
+    crop_params: Dict[str, Any],
+    outputs: List[Tuple[int, int, str]],
+    companions: List[str],
+    companion_link: str,
+    encoder: Optional[Dict[str, Any]],
+    reference_size: Optional[Tuple[int, int]] = None
+) -> Dict[str, Any]:
+    """
+    导出单张图片的一个或多个尺寸及其伴随文件 (在工作进程中执行)
+    companions 由主进程的 CompanionIndex 解析，伴随文件的复制随导出任务在各工作进程中并行执行，
+    多分辨率导出时复制到每个输出目录
+
+    Returns:
+        {'success': bool, 'encode_seconds': float, 'bytes': int, ...}，
+        以及各步骤耗时和读取字节数 (由主进程记录到指标中)
+    """
+    stats = {'encode_seconds': 0.0, 'bytes': 0}
+    success = crop_and_resize_multi(image_path, crop_params, outputs, encoder, stats, reference_size)
+    if success and companions:
+        start = time.perf_counter()
+        for output_dir in dict.fromkeys(os.path.dirname(output[2]) for output in outputs):
+            write_companions(companions, output_dir, companion_link)
+        stats['companion_seconds'] = time.perf_counter() - start
+        stats['companions'] = len(companions) * len(outputs)
+    return dict(stats, success=success)
+
+
+def export_encoder_settings(filename: str, encoder: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """输出文件的编码参数 (格式由扩展名决定，只包含影响该格式输出的参数)"""
+    return dict(encoder_fingerprint(filename, encoder), resample=EXPORT_RESAMPLE)
+
+
+def _task_outputs(
+    manifest: Optional[ExportManifest],
+    image_path: str,
+    filename: str,
+    crop_params: Dict[str, Any],
+    target_width: int,
+    target_height: int,
+    companions: List[str],
+    encoder: Optional[Dict[str, Any]],
+    output_dir: str,
+    scales: Optional[List[float]]
+) -> Tuple[List[Tuple[int, int, str]], List[Tuple[str, Optional[Dict[str, Any]]]]]:
+    """
+    计算任务需要写入的输出，并标记所有输出仍属于本次导出
+    多分辨率导出时每个缩放比例输出到 output_dir/x<比例>/，清单中以相对路径记录
+
+    Returns:
+        ([(目标宽度, 目标高度, 输出路径)], [(清单中的相对路径, 指纹)])，清单中已是最新的输出不包括在内
+    """
+    if scales is None:
+        targets = [(filename, target_width, target_height)]
+    else:
+        targets = [
+            (os.path.join(scale_dirname(scale), filename),) + scaled_bucket_size(target_width, target_height, scale)
+            for scale in scales
+        ]
+
+    outputs = []
+    records = []
+    for relpath, width, height in targets:
+        fingerprint = None
+        if manifest is not None:
+            manifest.keep(relpath)
+            fingerprint = manifest.fingerprint(
+                image_path, crop_params, width, height,
+                export_encoder_settings(filename, encoder),
+                companions,
+                (target_width, target_height)
+            )
+            if manifest.is_up_to_date(relpath, fingerprint):
+                continue
+        outputs.append((width, height, os.path.join(output_dir, relpath)))
+        records.append((relpath, fingerprint))
+    return outputs, records
+
+
+def _iter_export_tasks(
+    images: List[Dict[str, Any]],
+    buckets: Dict[str, Dict[str, int]],
+    output_dir: str,
+    companion_index: Optional[CompanionIndex],
+    companion_link: str,
+    encoder: Optional[Dict[str, Any]],
+    results: Dict[str, Any],
+    manifest: Optional[ExportManifest] = None,
+    scales: Optional[List[float]] = None
+):
+    """
+    生成导出任务 ((序号, 文件名, [(清单相对路径, 指纹)]), 参数)
+    未裁剪的图片计入 skipped，所有输出在清单中都已是最新的图片计入 up_to_date
+    """
+    for index, img in enumerate(images):
+        # 跳过未裁剪的图片
+        if not img.get('cropped') or not img.get('crop_params'):
+            results['skipped'] += 1
+            continue
+
+        bucket_id = img.get('assigned_bucket', 'A')
+        bucket = buckets.get(bucket_id, {'width': 1024, 'height': 1024})
+
+        # 生成输出文件名 - 保持原文件名，以便与txt对应 (覆盖输出格式时只替换扩展名)
+        filename = output_filename(img['filename'], encoder)
+
+        companions = companion_index.find(img['path']) if companion_index is not None else []
+        outputs, records = _task_outputs(
+            manifest, img['path'], filename, img['crop_params'],
+            bucket['width'], bucket['height'], companions, encoder, output_dir, scales
+        )
+        if not outputs:
+            results['up_to_date'] += 1
+            continue
+
+        yield (index, filename, records), (
+            img['path'],
+            img['crop_params'],
+            outputs,
+            companions,
+            companion_link,
+            encoder,
+            (bucket['width'], bucket['height'])
+        )
+
+
+def _iter_plan_tasks(
+    plan,
+    output_dir: str,
+    companion_index: Optional[CompanionIndex],
+    companion_link: str,
+    encoder: Optional[Dict[str, Any]],
+    results: Dict[str, Any],
+    manifest: Optional[ExportManifest] = None,
+    scales: Optional[List[float]] = None,
+    skip_duplicates: bool = False
+):
+    """
+    按裁剪计划 (CropPlan) 的数组逐张生成导出任务，不预先构造每张图片的字典
+    skip_duplicates 时计划中标记为近重复的图片计入 skipped
+    """
+    sizes = [(bucket['width'], bucket['height']) for bucket in plan.buckets]
+    duplicates = plan.duplicates if skip_duplicates else None
+    for index, path in enumerate(plan.paths):
+        if duplicates is not None and duplicates[index]:
+            results['skipped'] += 1
+            continue
+        target_width, target_height = sizes[plan.bucket_index[index]]
+        x, y, width, height = plan.crops[index].tolist()
+        crop_params = {'x': x, 'y': y, 'width': width, 'height': height}
+
+        filename = output_filename(os.path.basename(path), encoder)
+        companions = companion_index.find(path) if companion_index is not None else []
+        outputs, records = _task_outputs(
+            manifest, path, filename, crop_params, target_width, target_height,
+            companions, encoder, output_dir, scales
+        )
+        if not outputs:
+            results['up_to_date'] += 1
+            continue
+
+        yield (index, filename, records), (
+            path,
+            crop_params,
+            outputs,
+            companions,
+            companion_link,
+            encoder,
+            (target_width, target_height)
+        )
 
 
 def process_batch_export(
     images: List[Dict[str, Any]],
     buckets: Dict[str, Dict[str, int]],
     output_dir: str,
-    copy_companions: bool = True
+    copy_companions: bool = True,
+    workers: Optional[int] = None,
+    manifest: Optional[ExportManifest] = None,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    prune: bool = True,
+    companion_extensions: Optional[List[str]] = None,
+    companion_link: str = 'auto',
+    encoder: Optional[Dict[str, Any]] = None,
+    scales: Optional[List[float]] = None
 ) -> Dict[str, Any]:
     """
     批量处理导出
@@ -120,77 +657,202 @@ def process_batch_export(
         buckets: 桶配置 {'A': {'width': 1024, 'height': 1024}, ...}
         output_dir: 输出目录
         copy_companions: 是否复制伴随文件
+        workers: 并行进程数，为空时使用 CPU 核数，为 1 时在当前进程内顺序执行
+        manifest: 导出清单，提供时跳过已是最新的输出并记录新写入的输出
+        progress_callback: 每完成一张图片调用一次，参数为当前的结果统计
+        cancel_event: 置位后停止提交新任务，等待在途任务结束后返回
+        prune: 提供清单时，导出完成后删除清单中不再属于本次导出的旧输出 (计入 removed)
+        companion_extensions: 伴随文件扩展名，为空时使用默认值 (SBC_COMPANION_EXTENSIONS)
+        companion_link: 伴随文件的写入方式 (auto / copy / hardlink / reflink)
+        encoder: 编码参数 (services.encoders.resolve_encoder)，为空时使用默认预设
+        scales: 多分辨率导出的缩放比例 (如 [0.5, 0.75, 1.0])，每张图片只解码裁剪一次，
+                按比例缩放的桶尺寸分别输出到 output_dir/x<比例>/；为空时按桶尺寸输出到 output_dir
     
     Returns:
-        处理结果统计
+        处理结果统计 (包括编码总耗时 encode_seconds 和写入的字节数 bytes_written)
     """
+    scales = normalize_scales(scales)
+    return _run_export(
+        lambda results: _iter_export_tasks(
+            images, buckets, output_dir,
+            CompanionIndex(companion_extensions) if copy_companions else None, companion_link,
+            encoder, results, manifest, scales
+        ),
+        len(images), output_dir, workers, manifest, progress_callback, cancel_event, prune
+    )
+
+
+def process_plan_export(
+    plan,
+    output_dir: str,
+    copy_companions: bool = True,
+    workers: Optional[int] = None,
+    manifest: Optional[ExportManifest] = None,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    prune: bool = True,
+    companion_extensions: Optional[List[str]] = None,
+    companion_link: str = 'auto',
+    encoder: Optional[Dict[str, Any]] = None,
+    scales: Optional[List[float]] = None,
+    skip_duplicates: bool = False
+) -> Dict[str, Any]:
+    """
+    按裁剪计划 (CropPlan) 批量导出，参数与返回值同 process_batch_export
+    计划中的图片都视为已裁剪；skip_duplicates 时跳过计划中标记为近重复的图片 (计入 skipped)
+    """
+    scales = normalize_scales(scales)
+    return _run_export(
+        lambda results: _iter_plan_tasks(
+            plan, output_dir,
+            CompanionIndex(companion_extensions) if copy_companions else None, companion_link,
+            encoder, results, manifest, scales, skip_duplicates
+        ),
+        len(plan), output_dir, workers, manifest, progress_callback, cancel_event, prune
+    )
+
+
+def _run_export(
+    make_tasks: Callable[[Dict[str, Any]], Iterator],
+    total: int,
+    output_dir: str,
+    workers: Optional[int],
+    manifest: Optional[ExportManifest],
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]],
+    cancel_event: Optional[threading.Event],
+    prune: bool
+) -> Dict[str, Any]:
+    """执行导出任务 (顺序或多进程)，汇总结果统计"""
     results = {
-        'total': len(images),
+        'total': total,
         'success': 0,
         'failed': 0,
         'skipped': 0,
+        'up_to_date': 0,
+        'removed': 0,
+        'encode_seconds': 0.0,
+        'bytes_written': 0,
+        'cancelled': False,
         'errors': []
     }
     
     # 确保输出目录存在
     os.makedirs(output_dir, exist_ok=True)
-    
-    for img in images:
-        # 跳过未裁剪的图片
-        if not img.get('cropped') or not img.get('crop_params'):
-            results['skipped'] += 1
-            continue
-        
-        bucket_id = img.get('assigned_bucket', 'A')
-        bucket = buckets.get(bucket_id, {'width': 1024, 'height': 1024})
-        
-        # 生成输出文件名 - 保持原文件名，以便与txt对应
-        filename = img['filename']
-        output_path = os.path.join(output_dir, filename)
-        
-        # 执行裁剪和缩放
-        success = crop_and_resize_image(
-            image_path=img['path'],
-            crop_params=img['crop_params'],
-            target_width=bucket['width'],
-            target_height=bucket['height'],
-            output_path=output_path
-        )
-        
-        if success:
+
+    workers = workers or DEFAULT_EXPORT_WORKERS
+    tasks = make_tasks(results)
+    failures = []
+
+    def record(meta: Tuple[int, str, List[Tuple[str, Optional[Dict[str, Any]]]]], outcome: Dict[str, Any]):
+        index, filename, records = meta
+        _record_export_metrics(outcome)
+        if outcome['success']:
             results['success'] += 1
-            
-            # 复制伴随文件
-            if copy_companions:
-                copy_companion_files(img['path'], output_dir)
+            results['encode_seconds'] += outcome['encode_seconds']
+            results['bytes_written'] += outcome['bytes']
+            if manifest is not None:
+                for relpath, fingerprint in records:
+                    manifest.record(relpath, fingerprint)
         else:
             results['failed'] += 1
-            results['errors'].append(f"处理失败: {filename}")
+            failures.append((index, f"处理失败: {filename}"))
+            if manifest is not None:
+                for relpath, _ in records:
+                    manifest.discard(relpath)
+        if manifest is not None:
+            manifest.save_if_due()
+        if progress_callback is not None:
+            progress_callback(results)
+
+    def cancelled() -> bool:
+        if cancel_event is not None and cancel_event.is_set():
+            results['cancelled'] = True
+            return True
+        return False
+
+    if workers <= 1:
+        for meta, args in tasks:
+            if cancelled():
+                break
+            record(meta, _export_one(*args))
+    else:
+        # 限制同时在途的任务数，避免一次性提交全部任务占用大量内存
+        max_in_flight = workers * EXPORT_IN_FLIGHT_PER_WORKER
+        in_flight = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for meta, args in tasks:
+                if cancelled():
+                    break
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record(in_flight.pop(future), _future_outcome(future))
+                in_flight[pool.submit(_export_one, *args)] = meta
+
+            for future in as_completed(in_flight):
+                record(in_flight[future], _future_outcome(future))
+
+    if manifest is not None:
+        record_cache('export_manifest', hits=results['up_to_date'], misses=results['success'] + results['failed'])
+        # 任务全部生成后才能确定哪些旧输出不再需要
+        if prune and not results['cancelled']:
+            results['removed'] = manifest.prune()
+        manifest.save()
+
+    results['encode_seconds'] = round(results['encode_seconds'], 3)
+    # 错误信息按原始顺序排列
+    results['errors'] = [message for _, message in sorted(failures)]
     
     return results
 
 
-def get_image_thumbnail(image_path: str, max_size: int = 200) -> Optional[bytes]:
+def _record_export_metrics(outcome: Dict[str, Any]):
+    """记录工作进程返回的各步骤耗时和读写字节数"""
+    if not outcome['success']:
+        record_error('export')
+        return
+    for stage in ('decode', 'crop', 'resize', 'encode'):
+        seconds = outcome.get(f'{stage}_seconds')
+        if seconds is not None:
+            observe_stage(stage, seconds)
+    record_bytes('export', read=outcome.get('bytes_read', 0), written=outcome['bytes'])
+    if outcome.get('companions'):
+        observe_stage('companion_copy', outcome['companion_seconds'], outcome['companions'])
+
+
+def _future_outcome(future) -> Dict[str, Any]:
+    """获取工作进程的结果，进程异常退出等情况视为失败"""
+    try:
+        return future.result()
+    except Exception as e:
+        logger.error("导出任务异常: %s", e)
+        return {'success': False, 'encode_seconds': 0.0, 'bytes': 0}
+
+
+def get_image_thumbnail(image_path: str, max_size: int = 200, format: str = 'JPEG') -> Optional[bytes]:
     """
-    生成图片缩略图的 base64 数据
+    生成图片缩略图的编码数据 (JPEG 或 WEBP)
     """
+    start = time.perf_counter()
     try:
         with Image.open(image_path) as img:
-            # 保持比例缩放
+            record_bytes('thumbnail', read=_source_size(img))
+            # 保持比例缩放 (thumbnail 内部会对 JPEG 做 DCT 缩减解码，其他格式先用 reduce 整数缩小)
             img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
             
             # 转换为 RGB
-            if img.mode in ('RGBA', 'P'):
+            if img.mode not in ('RGB', 'L'):
                 img = img.convert('RGB')
             
             # 转为 bytes
-            import io
             buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=85)
+            img.save(buffer, format=format, quality=85)
+            observe_stage('thumbnail', time.perf_counter() - start)
             return buffer.getvalue()
             
     except Exception as e:
-        print(f"生成缩略图失败 {image_path}: {e}")
+        record_error('thumbnail')
+        logger.warning("生成缩略图失败 %s: %s", image_path, e, extra={'image_path': image_path})
         return None
 
 
@@ -0,0 +1,155 @@
+"""
+列式图片表
+扫描结果以 NumPy 数组保存 (宽、高、长宽比、方向、桶序号)，
+分桶、分配和默认裁剪都在数组上批量计算，只在 API 边界转换为字典
+"""
+import os
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Sequence
+
+import numpy as np
+
+# 长宽比阈值
+LANDSCAPE_THRESHOLD = 1.1   # 宽/高 > 1.1 为横向
+PORTRAIT_THRESHOLD = 0.9    # 宽/高 < 0.9 为纵向
+
+# 方向编码
+ORIENTATION_LANDSCAPE = 0
+ORIENTATION_SQUARE = 1
+ORIENTATION_PORTRAIT = 2
+ORIENTATION_NAMES = ('landscape', 'square', 'portrait')
+ORIENTATION_CODES = {name: code for code, name in enumerate(ORIENTATION_NAMES)}
+
+
+def classify_orientations(aspect: np.ndarray) -> np.ndarray:
+    """批量按长宽比分类，返回方向编码数组 (int8)"""
+    codes = np.full(len(aspect), ORIENTATION_SQUARE, dtype=np.int8)
+    codes[aspect > LANDSCAPE_THRESHOLD] = ORIENTATION_LANDSCAPE
+    codes[aspect < PORTRAIT_THRESHOLD] = ORIENTATION_PORTRAIT
+    return codes
+
+
+def compute_default_crops(
+    widths: np.ndarray,
+    heights: np.ndarray,
+    target_ratios: np.ndarray
+) -> np.ndarray:
+    """
+    批量计算默认裁剪区域 (居中裁剪，保持目标比例)，与 calculate_default_crop 逐元素一致
+
+    Returns:
+        形状为 (n, 4) 的 int64 数组，每行为 (x, y, width, height)
+    """
+    widths = np.asarray(widths, dtype=np.int64)
+    heights = np.asarray(heights, dtype=np.int64)
+    target_ratios = np.asarray(target_ratios, dtype=np.float64)
+
+    too_wide = widths / heights > target_ratios
+
+    # 图片太宽，需要左右裁剪；图片太高，需要上下裁剪
+    crop_width = np.where(too_wide, (heights * target_ratios).astype(np.int64), widths)
+    crop_height = np.where(too_wide, heights, (widths / target_ratios).astype(np.int64))
+    x = np.where(too_wide, (widths - crop_width) // 2, 0)
+    y = np.where(too_wide, 0, (heights - crop_height) // 2)
+
+    return np.stack([x, y, crop_width, crop_height], axis=1)
+
+
+@dataclass
+class ImageTable:
+    """
+    扫描结果的列式表示
+    bucket_index 为 -1 表示尚未分配
+    """
+    paths: List[str]
+    widths: np.ndarray
+    heights: np.ndarray
+    aspect: np.ndarray = field(default=None)
+    orientation: np.ndarray = field(default=None)
+    bucket_index: np.ndarray = field(default=None)
+
+    def __post_init__(self):
+        self.widths = np.asarray(self.widths, dtype=np.int64)
+        self.heights = np.asarray(self.heights, dtype=np.int64)
+        if self.aspect is None:
+            safe_heights = np.where(self.heights > 0, self.heights, 1)
+            self.aspect = np.where(self.heights > 0, self.widths / safe_heights, 1.0)
+        if self.orientation is None:
+            self.orientation = classify_orientations(self.aspect)
+        if self.bucket_index is None:
+            self.bucket_index = np.full(len(self.widths), -1, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.widths)
+
+    @classmethod
+    def from_records(cls, images: Sequence[Dict[str, Any]]) -> 'ImageTable':
+        """从图片信息字典列表构建"""
+        count = len(images)
+        return cls(
+            paths=[img['path'] for img in images],
+            widths=np.fromiter((img['width'] for img in images), dtype=np.int64, count=count),
+            heights=np.fromiter((img['height'] for img in images), dtype=np.int64, count=count)
+        )
+
+    def take(self, indices: Sequence[int]) -> 'ImageTable':
+        """按序号选取部分图片 (如排除近重复图片后再分桶)"""
+        indices = np.asarray(indices, dtype=np.int64)
+        return ImageTable(
+            paths=[self.paths[i] for i in indices.tolist()],
+            widths=self.widths[indices],
+            heights=self.heights[indices],
+            aspect=self.aspect[indices],
+            orientation=self.orientation[indices],
+            bucket_index=self.bucket_index[indices]
+        )
+
+    def orientation_names(self) -> np.ndarray:
+        return np.asarray(ORIENTATION_NAMES)[self.orientation]
+
+    def default_crops(self, buckets: List[Dict[str, Any]]) -> np.ndarray:
+        """按已分配的桶批量计算默认裁剪区域，形状 (n, 4)"""
+        ratios = np.array([bucket['width'] / bucket['height'] for bucket in buckets], dtype=np.float64)
+        index = np.where(self.bucket_index >= 0, self.bucket_index, 0)
+        return compute_default_crops(self.widths, self.heights, ratios[index])
+
+    def to_records(
+        self,
+        buckets: Optional[List[Dict[str, Any]]] = None,
+        start: int = 0,
+        stop: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        转换为 API 使用的图片信息字典 (可只转换一段)
+        提供 buckets 时附带桶分配结果和默认裁剪区域
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        names = self.orientation_names()[start:stop].tolist()
+        widths = self.widths[start:stop].tolist()
+        heights = self.heights[start:stop].tolist()
+        aspects = self.aspect[start:stop].tolist()
+
+        records = []
+        for i, path in enumerate(self.paths[start:stop]):
+            records.append({
+                'path': path,
+                'filename': os.path.basename(path),
+                'width': widths[i],
+                'height': heights[i],
+                'aspect_ratio': aspects[i],
+                'orientation': names[i]
+            })
+
+        if buckets:
+            bucket_ids = [bucket['id'] for bucket in buckets]
+            index = self.bucket_index[start:stop].tolist()
+            crops = self.default_crops(buckets)[start:stop].tolist()
+            for record, bucket_i, crop in zip(records, index, crops):
+                record['assigned_bucket'] = bucket_ids[bucket_i] if bucket_i >= 0 else bucket_ids[0]
+                record['cropped'] = False
+                record['crop_params'] = None
+                record['default_crop'] = {
+                    'x': crop[0], 'y': crop[1], 'width': crop[2], 'height': crop[3]
+                }
+
+        return records
@@ -0,0 +1,65 @@
+"""
+日志配置
+服务端日志统一通过 logging 输出，附加字段 (logger.info(..., extra={...})) 作为结构化字段:
+- SBC_LOG_FORMAT: text (默认，附加字段以 key=value 追加在消息后) 或 json (每行一个 JSON 对象)
+- SBC_LOG_LEVEL: 日志级别 (默认 INFO)
+"""
+import os
+import sys
+import json
+import time
+import logging
+from typing import Optional
+
+# LogRecord 的内置属性，其余属性视为 extra 传入的结构化字段
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+def record_fields(record: logging.LogRecord) -> dict:
+    """extra 传入的附加字段"""
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class TextFormatter(logging.Formatter):
+    """时间 级别 模块: 消息 key=value ..."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            text += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """每行一个 JSON 对象 (便于日志系统按字段检索)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+                    + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(fmt: Optional[str] = None, level: Optional[str] = None):
+    """配置根日志 (参数为空时读取环境变量)"""
+    fmt = (fmt or os.environ.get('SBC_LOG_FORMAT', 'text')).lower()
+    level = (level or os.environ.get('SBC_LOG_LEVEL', 'INFO')).upper()
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level, logging.INFO))
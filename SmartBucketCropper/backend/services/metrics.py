@@ -0,0 +1,234 @@
+"""
+指标服务
+进程内的计数器 / 直方图注册表，GET /api/metrics 以 Prometheus 文本格式输出:
+- 各阶段 (probe / analyze / assign / thumbnail / preview / decode / crop / resize / encode / companion_copy)
+  的耗时直方图、处理图片数和失败数
+- 读取 / 写入的字节数
+- 缓存 (缩略图缓存、扫描索引、导出清单) 的命中与未命中次数及命中率
+- 执行器的运行 / 排队任务数等由其他模块注册的采集函数提供
+
+导出在工作进程中执行，各阶段耗时随任务结果返回主进程后再记录
+"""
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Callable, Iterable
+
+# 指标名前缀
+METRIC_PREFIX = 'sbc_'
+
+# 耗时直方图的分桶上限 (秒)
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 采集函数返回的样本: (指标名, 类型, 说明, [(标签, 值)])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """单调递增的计数器 (按标签分组)"""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def label_values(self) -> List[tuple]:
+        with self._lock:
+            return list(self._values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            labels = dict(zip(self.labelnames, key))
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """累积分桶直方图 (按标签分组)"""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各分桶计数 (非累积), 总和, 总数]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                bucket_labels = dict(labels, le=_format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，render 时另外调用已注册的采集函数 (用于执行器状态等即时读取的指标)"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], List[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        metric = Counter(METRIC_PREFIX + name, help, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), buckets=DURATION_BUCKETS) -> Histogram:
+        metric = Histogram(METRIC_PREFIX + name, help, labelnames, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], List[Sample]]):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus 文本格式 (0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            for name, kind, help, samples in collector():
+                name = METRIC_PREFIX + name
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    'stage_duration_seconds', "各阶段每次调用的耗时 (probe 为每批)", ['stage']
+)
+stage_items = registry.counter('stage_images_total', "各阶段处理的图片数", ['stage'])
+stage_errors = registry.counter('stage_errors_total', "各阶段失败的图片数", ['stage'])
+bytes_read = registry.counter('bytes_read_total', "读取的源文件字节数", ['stage'])
+bytes_written = registry.counter('bytes_written_total', "写入的字节数", ['stage'])
+cache_requests = registry.counter('cache_requests_total', "缓存查询次数", ['cache', 'result'])
+http_seconds = registry.histogram(
+    'http_request_duration_seconds', "HTTP 请求耗时 (到响应头返回为止)", ['method', 'route', 'status']
+)
+
+
+def observe_stage(stage: str, seconds: float, items: int = 1):
+    """记录一次阶段耗时和处理的图片数"""
+    stage_seconds.observe(seconds, stage=stage)
+    if items:
+        stage_items.inc(items, stage=stage)
+
+
+@contextmanager
+def track_stage(stage: str, items: int = 1):
+    """记录代码块的耗时，抛出异常时计为失败"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(items or 1, stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start, items)
+
+
+def record_error(stage: str, count: int = 1):
+    stage_errors.inc(count, stage=stage)
+
+
+def record_bytes(stage: str, read: int = 0, written: int = 0):
+    if read:
+        bytes_read.inc(read, stage=stage)
+    if written:
+        bytes_written.inc(written, stage=stage)
+
+
+def record_cache(cache: str, hits: int = 0, misses: int = 0):
+    if hits:
+        cache_requests.inc(hits, cache=cache, result='hit')
+    if misses:
+        cache_requests.inc(misses, cache=cache, result='miss')
+
+
+def _collect_cache_ratios() -> List[Sample]:
+    caches = sorted({key[0] for key in cache_requests.label_values()})
+    samples = []
+    for cache in caches:
+        hits = cache_requests.value(cache=cache, result='hit')
+        total = hits + cache_requests.value(cache=cache, result='miss')
+        if total:
+            samples.append(({'cache': cache}, round(hits / total, 6)))
+    return [('cache_hit_ratio', 'gauge', "缓存命中率 (进程启动以来)", samples)]
+
+
+registry.register_collector(_collect_cache_ratios)
+
+
+def render_metrics() -> str:
+    return registry.render()
+
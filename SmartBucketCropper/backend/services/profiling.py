@@ -0,0 +1,153 @@
+"""
+慢请求采样分析
+设置 SBC_PROFILE_SLOW_MS 后，请求进行期间由一个后台线程定时采样所有线程的调用栈
+(包括执行器线程，图片处理实际在其中执行)，耗时超过阈值的请求将采样结果写成
+折叠栈格式 (每行 "线程;帧;帧;... 次数"，可直接用 flamegraph.pl / speedscope 查看)
+
+- SBC_PROFILE_SLOW_MS: 慢请求阈值 (毫秒)，未设置时不采样
+- SBC_PROFILE_DIR: 输出目录 (默认 ~/.cache/smartbucketcropper/profiles)
+- SBC_PROFILE_INTERVAL_MS: 采样间隔 (默认 5 毫秒)
+
+采样覆盖整个进程: 并发的请求会共享同一时段的样本
+"""
+import os
+import re
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+from typing import Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get(
+    'SBC_PROFILE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'smartbucketcropper', 'profiles')
+)
+
+# 空闲等待的栈顶帧 (线程池等待任务、事件循环等待 IO)，不计入样本
+IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('thread.py', '_worker'),
+    ('selectors.py', 'select'),
+    ('queue.py', 'get'),
+}
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning("环境变量 %s 不是数字，已忽略", name)
+        return None
+
+
+class StackSampler:
+    """
+    进程级的调用栈采样器
+    有请求在采样时运行后台线程，每个样本累加到所有进行中的请求
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active: Dict[int, Counter] = {}
+        self._next_token = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def begin(self) -> int:
+        """开始为一个请求采样，返回用于 end 的标识"""
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._active[token] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        return token
+
+    def end(self, token: int) -> Counter:
+        """结束采样，返回 折叠栈 -> 样本数"""
+        with self._lock:
+            return self._active.pop(token, Counter())
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            stacks = self._sample(own_ident)
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                for counts in self._active.values():
+                    counts.update(stacks)
+
+    @staticmethod
+    def _sample(own_ident: int) -> list:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            frames.append(names.get(ident, str(ident)))
+            stacks.append(';'.join(reversed(frames)))
+        return stacks
+
+
+def _profile_filename(method: str, path: str, elapsed_ms: float) -> str:
+    slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', path.strip('/'))[:80] or 'root'
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{method}-{slug}-{int(elapsed_ms)}ms.folded"
+
+
+class SlowRequestProfiler:
+    """按请求采样，耗时超过阈值时写出采样结果"""
+
+    def __init__(self, slow_ms: float, output_dir: str = PROFILE_DIR, interval_ms: float = 5.0):
+        self.slow_ms = slow_ms
+        self.output_dir = output_dir
+        self.sampler = StackSampler(max(interval_ms, 0.5) / 1000)
+
+    def begin(self) -> int:
+        return self.sampler.begin()
+
+    def finish(self, token: int, method: str, path: str, elapsed_ms: float) -> Optional[str]:
+        """结束采样，慢请求写出采样文件并返回路径"""
+        counts = self.sampler.end(token)
+        if elapsed_ms < self.slow_ms or not counts:
+            return None
+        output_path = os.path.join(self.output_dir, _profile_filename(method, path, elapsed_ms))
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(output_path, 'w', encoding='utf-8') as f:
+                for stack, count in counts.most_common():
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            logger.warning("写入采样结果失败 %s: %s", output_path, e)
+            return None
+        logger.warning(
+            "慢请求 %s %s 耗时 %.0fms，采样结果: %s", method, path, elapsed_ms, output_path,
+            extra={'method': method, 'path': path, 'elapsed_ms': round(elapsed_ms, 1), 'profile': output_path}
+        )
+        return output_path
+
+
+def profiler_from_env() -> Optional[SlowRequestProfiler]:
+    """按环境变量创建采样器，未设置 SBC_PROFILE_SLOW_MS 时返回 None"""
+    slow_ms = _env_float('SBC_PROFILE_SLOW_MS')
+    if slow_ms is None:
+        return None
+    interval_ms = _env_float('SBC_PROFILE_INTERVAL_MS') or 5.0
+    return SlowRequestProfiler(slow_ms, PROFILE_DIR, interval_ms)
@@ -0,0 +1,175 @@
+"""
+扫描索引服务
+在数据集根目录保存 SQLite 元数据索引，按 (路径, 大小, 修改时间) 判断文件是否变化，
+重新扫描时只探测新增或修改过的图片。开启近重复检测时同时保存每张图片的感知哈希
+"""
+import os
+import sqlite3
+import logging
+from typing import Dict, Any, List, Tuple, Optional, Iterable
+
+logger = logging.getLogger(__name__)
+
+# 索引文件名 (位于数据集根目录)
+INDEX_FILENAME = '.smartbucket_index.db'
+
+# 索引结构版本，结构变化时整体重建
+INDEX_SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    aspect_ratio REAL NOT NULL,
+    orientation TEXT NOT NULL,
+    dhash INTEGER
+)
+"""
+
+
+def _hash_to_db(value: Optional[str]) -> Optional[int]:
+    """十六进制哈希转换为 SQLite 的有符号 64 位整数"""
+    if value is None:
+        return None
+    number = int(value, 16)
+    return number - (1 << 64) if number >= (1 << 63) else number
+
+
+def _hash_from_db(value: Optional[int]) -> Optional[str]:
+    if value is None:
+        return None
+    return f"{value & 0xFFFFFFFFFFFFFFFF:016x}"
+
+
+class ScanIndex:
+    """
+    数据集元数据索引
+    路径以相对数据集根目录的形式保存，数据集整体移动后索引仍然有效
+    """
+
+    def __init__(self, folder_path: str, filename: str = INDEX_FILENAME):
+        self.folder_path = folder_path
+        self._prefix = os.path.join(folder_path, '')
+        self.index_path = os.path.join(self.folder_path, filename)
+        self.conn = sqlite3.connect(self.index_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != INDEX_SCHEMA_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS images")
+            self.conn.execute(f"PRAGMA user_version={INDEX_SCHEMA_VERSION}")
+        self.conn.execute(_SCHEMA)
+        self.conn.commit()
+
+    def relpath(self, path: str) -> str:
+        """转换为相对数据集根目录、以 / 分隔的路径"""
+        if path.startswith(self._prefix):
+            rel = path[len(self._prefix):]
+        else:
+            rel = os.path.relpath(path, self.folder_path)
+        return rel.replace(os.sep, '/')
+
+    def load(self) -> Dict[str, Tuple[int, int, int, int, float, str, Optional[str]]]:
+        """
+        读取全部索引记录
+        返回 {相对路径: (size, mtime_ns, width, height, aspect_ratio, orientation, dhash)}，
+        dhash 为十六进制哈希，未计算过时为 None
+        """
+        rows = self.conn.execute(
+            "SELECT path, size, mtime_ns, width, height, aspect_ratio, orientation, dhash FROM images"
+        )
+        return {row[0]: tuple(row[1:7]) + (_hash_from_db(row[7]),) for row in rows}
+
+    def update(self, records: Iterable[Dict[str, Any]], removed: Iterable[str]) -> bool:
+        """
+        在一个事务中写入新增/修改的记录并删除已不存在的文件
+
+        Args:
+            records: 图片信息，需包含 path/size/mtime_ns/width/height/aspect_ratio/orientation，
+                     可包含 dhash (十六进制哈希)
+            removed: 需要删除的相对路径
+
+        Returns:
+            bool: 是否写入成功 (失败不影响本次扫描结果)
+        """
+        try:
+            self._write(records, removed)
+            return True
+        except sqlite3.Error as e:
+            logger.warning("写入扫描索引失败 %s: %s", self.index_path, e)
+            return False
+
+    def _write(self, records: Iterable[Dict[str, Any]], removed: Iterable[str]):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO images "
+                "(path, size, mtime_ns, width, height, aspect_ratio, orientation, dhash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        self.relpath(rec['path']), rec['size'], rec['mtime_ns'],
+                        rec['width'], rec['height'], rec['aspect_ratio'], rec['orientation'],
+                        _hash_to_db(rec.get('dhash'))
+                    )
+                    for rec in records
+                )
+            )
+            self.conn.executemany(
+                "DELETE FROM images WHERE path = ?",
+                ((path,) for path in removed)
+            )
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_scan_index(folder_path: str) -> Optional[ScanIndex]:
+    """打开数据集索引，目录只读等原因失败时返回 None (退化为全量扫描)"""
+    try:
+        return ScanIndex(folder_path)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("无法打开扫描索引 %s: %s", folder_path, e)
+        return None
+
+
+def diff_against_index(
+    entries: List[Tuple[str, int, int]],
+    index: ScanIndex
+) -> Tuple[List[Tuple[str, Tuple]], List[Tuple[str, int, int]], List[str]]:
+    """
+    将当前文件列表与索引对比
+
+    Args:
+        entries: [(路径, size, mtime_ns), ...]
+        index: 扫描索引
+
+    Returns:
+        (未变化的 [(路径, 索引记录)], 需要重新探测的 entries, 已删除的相对路径)
+    """
+    indexed = index.load()
+    unchanged = []
+    changed = []
+
+    for entry in entries:
+        path, size, mtime_ns = entry
+        cached = indexed.pop(index.relpath(path), None)
+        if cached is not None and cached[0] == size and cached[1] == mtime_ns:
+            unchanged.append((path, cached))
+        else:
+            changed.append(entry)
+
+    # 剩余未匹配的索引记录即为已删除的文件
+    removed = list(indexed)
+    return unchanged, changed, removed
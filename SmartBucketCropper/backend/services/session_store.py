@@ -0,0 +1,453 @@
+"""
+数据集会话服务
+扫描结果和每张图片的桶分配 / 裁剪状态保存在服务端 SQLite 中，
+前端只提交改动的图片，刷新页面后可以恢复，导出时按会话 ID 读取
+"""
+import os
+import json
+import time
+import uuid
+import base64
+import sqlite3
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+import numpy as np
+
+from services.image_table import ImageTable, compute_default_crops
+from services.image_processor import calculate_default_crop
+from services.bucket_analyzer import classify_orientation
+from services.crop_plan import CropPlan
+
+logger = logging.getLogger(__name__)
+
+# 会话数据库，可通过环境变量覆盖
+SESSION_DB_PATH = os.environ.get(
+    'SBC_SESSION_DB',
+    os.path.join(os.path.expanduser('~'), '.cache', 'smartbucketcropper', 'sessions.db')
+)
+
+# 超过这么多天未修改的会话在创建新会话时删除，可通过环境变量覆盖
+SESSION_TTL_DAYS = float(os.environ.get('SBC_SESSION_TTL_DAYS', '7'))
+
+# 会话结构版本，结构变化时整体重建
+SESSION_SCHEMA_VERSION = 3
+
+# 分页的默认 / 最大条数
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+# 列表排序方式
+# index: 扫描顺序; aspect_deviation: 图片与所在桶的长宽比偏差 |log(图片比例 / 桶比例)|;
+# crop_status: 未裁剪的在前
+SORT_KEYS = ('index', 'aspect_deviation', 'crop_status')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    folder_path TEXT NOT NULL,
+    buckets TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS session_images (
+    session_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    aspect_log REAL NOT NULL,
+    bucket TEXT NOT NULL,
+    cropped INTEGER NOT NULL DEFAULT 0,
+    crop_x INTEGER, crop_y INTEGER, crop_w INTEGER, crop_h INTEGER,
+    default_x INTEGER NOT NULL, default_y INTEGER NOT NULL,
+    default_w INTEGER NOT NULL, default_h INTEGER NOT NULL,
+    duplicate_of TEXT,
+    PRIMARY KEY (session_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS session_images_bucket ON session_images (session_id, bucket, idx);
+CREATE INDEX IF NOT EXISTS session_images_status ON session_images (session_id, bucket, cropped, idx);
+"""
+
+_IMAGE_COLUMNS = (
+    "idx, path, width, height, bucket, cropped, crop_x, crop_y, crop_w, crop_h, "
+    "default_x, default_y, default_w, default_h, duplicate_of"
+)
+
+
+def _image_row_to_dict(row) -> Dict[str, Any]:
+    """会话中的一行转换为 API 使用的图片信息"""
+    idx, path, width, height, bucket, cropped, cx, cy, cw, ch, dx, dy, dw, dh, duplicate_of = row
+    aspect_ratio = width / height if height > 0 else 1.0
+    return {
+        'id': idx,
+        'path': path,
+        'filename': os.path.basename(path),
+        'width': width,
+        'height': height,
+        'aspect_ratio': aspect_ratio,
+        'orientation': classify_orientation(aspect_ratio),
+        'assigned_bucket': bucket,
+        'cropped': bool(cropped),
+        'crop_params': {'x': cx, 'y': cy, 'width': cw, 'height': ch} if cropped else None,
+        'default_crop': {'x': dx, 'y': dy, 'width': dw, 'height': dh},
+        'duplicate_of': duplicate_of
+    }
+
+
+def encode_cursor(key: Any, idx: int) -> str:
+    """分页游标: 上一页最后一张图片的 (排序键, 序号)"""
+    return base64.urlsafe_b64encode(json.dumps([key, idx]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    try:
+        key, idx = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return key, int(idx)
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+class SessionStore:
+    """会话数据库 (每次操作使用独立连接，可在多个线程中调用)"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._schema_ready:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    self._ensure_schema(conn)
+                    self._schema_ready = True
+        return conn
+
+    def _ensure_schema(self, conn: sqlite3.Connection):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SESSION_SCHEMA_VERSION:
+            conn.execute("DROP TABLE IF EXISTS session_images")
+            conn.execute("DROP TABLE IF EXISTS sessions")
+            conn.execute(f"PRAGMA user_version={SESSION_SCHEMA_VERSION}")
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def create(
+        self,
+        folder_path: str,
+        table: ImageTable,
+        buckets: List[Dict[str, Any]],
+        duplicate_of: Optional[List[Optional[str]]] = None
+    ) -> str:
+        """
+        由已分配桶的扫描结果创建会话 (同时删除过期的会话)，返回会话 ID
+        duplicate_of: 与 table 逐行对应，近重复图片为保留图片的路径，其余为 None
+        """
+        session_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        self.expire(SESSION_TTL_DAYS * 86400, now)
+
+        bucket_ids = [bucket['id'] for bucket in buckets]
+        index = np.where(table.bucket_index >= 0, table.bucket_index, 0).tolist()
+        crops = table.default_crops(buckets).tolist()
+        aspect_log = np.log(np.maximum(table.aspect, 1e-6)).tolist()
+        if duplicate_of is None:
+            duplicate_of = [None] * len(table)
+        rows = (
+            (session_id, i, path, width, height, log_ratio, bucket_ids[bucket_i], *crop, original)
+            for i, (path, width, height, log_ratio, bucket_i, crop, original) in enumerate(
+                zip(table.paths, table.widths.tolist(), table.heights.tolist(), aspect_log, index, crops,
+                    duplicate_of)
+            )
+        )
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO sessions (session_id, folder_path, buckets, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (session_id, folder_path, json.dumps(buckets, ensure_ascii=False), now, now)
+                )
+                conn.executemany(
+                    "INSERT INTO session_images (session_id, idx, path, width, height, aspect_log, bucket, "
+                    "default_x, default_y, default_w, default_h, duplicate_of) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+        finally:
+            conn.close()
+        return session_id
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """会话概要 (桶配置、每个桶的图片数和已裁剪数)，不存在时返回 None"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT folder_path, buckets, created_at, updated_at FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            counts = conn.execute(
+                "SELECT bucket, COUNT(*), SUM(cropped) FROM session_images "
+                "WHERE session_id = ? GROUP BY bucket",
+                (session_id,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        folder_path, buckets_json, created_at, updated_at = row
+        buckets = json.loads(buckets_json)
+        by_bucket = {bucket: (count, cropped or 0) for bucket, count, cropped in counts}
+        for bucket in buckets:
+            bucket['image_count'], bucket['cropped_count'] = by_bucket.get(bucket['id'], (0, 0))
+
+        return {
+            'session_id': session_id,
+            'folder_path': folder_path,
+            'buckets': buckets,
+            'total_count': sum(count for count, _ in by_bucket.values()),
+            'cropped_count': sum(cropped for _, cropped in by_bucket.values()),
+            'created_at': created_at,
+            'updated_at': updated_at
+        }
+
+    def list_images(
+        self,
+        session_id: str,
+        bucket: Optional[str] = None,
+        cropped: Optional[bool] = None,
+        sort: str = 'index',
+        descending: bool = False,
+        cursor: Optional[str] = None,
+        offset: int = 0,
+        limit: int = DEFAULT_PAGE_SIZE
+    ) -> Tuple[List[Dict[str, Any]], Optional[str], int]:
+        """
+        分页读取图片，可按桶和裁剪状态过滤
+
+        cursor 为上一页返回的游标 (按键值定位，翻页开销与页码无关)；
+        没有游标时从第 offset 张开始 (用于虚拟滚动直接跳到某个位置)
+
+        Returns:
+            (图片列表, 下一页游标 (没有更多时为 None), 符合条件的图片总数)
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"不支持的排序方式: {sort}，可选 {', '.join(SORT_KEYS)}")
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        conn = self._connect()
+        try:
+            buckets = self._buckets(conn, session_id)
+
+            where = ["session_id = ?"]
+            params: List[Any] = [session_id]
+            if bucket is not None:
+                where.append("bucket = ?")
+                params.append(bucket)
+            if cropped is not None:
+                where.append("cropped = ?")
+                params.append(int(cropped))
+
+            key_params: List[Any] = []
+            if sort == 'index':
+                key = "idx"
+            elif sort == 'crop_status':
+                key = "cropped"
+            else:
+                # 图片所在桶的 log(长宽比)
+                cases = []
+                for b in buckets:
+                    cases.append("WHEN ? THEN ?")
+                    key_params.extend([b['id'], float(np.log(b['width'] / b['height']))])
+                key = f"ABS(aspect_log - CASE bucket {' '.join(cases)} ELSE aspect_log END)"
+
+            total = conn.execute(
+                f"SELECT COUNT(*) FROM session_images WHERE {' AND '.join(where)}", params
+            ).fetchone()[0]
+
+            page_where = list(where)
+            page_params = list(params)
+            if cursor is not None:
+                last_key, last_idx = decode_cursor(cursor)
+                op = '<' if descending else '>'
+                page_where.append(f"(({key}) {op} ? OR (({key}) = ? AND idx {op} ?))")
+                page_params.extend(key_params + [last_key] + key_params + [last_key, last_idx])
+                offset = 0
+
+            direction = 'DESC' if descending else 'ASC'
+            rows = conn.execute(
+                f"SELECT {_IMAGE_COLUMNS}, {key} FROM session_images "
+                f"WHERE {' AND '.join(page_where)} "
+                f"ORDER BY {key} {direction}, idx {direction} LIMIT ? OFFSET ?",
+                key_params + page_params + key_params + [limit, max(0, offset)]
+            ).fetchall()
+        finally:
+            conn.close()
+
+        images = [_image_row_to_dict(row[:-1]) for row in rows]
+        next_cursor = encode_cursor(rows[-1][-1], rows[-1][0]) if len(rows) == limit else None
+        return images, next_cursor, total
+
+    def update_images(self, session_id: str, edits: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        在一个事务中应用一批图片改动，返回改动后的图片
+
+        每个改动包含 id (图片序号) 和以下可选字段:
+        - assigned_bucket: 移动到其他桶 (未同时提供裁剪时清除裁剪并重新计算默认裁剪区域)
+        - cropped / crop_params: 保存或清除裁剪
+        """
+        conn = self._connect()
+        try:
+            buckets = self._buckets(conn, session_id)
+            sizes = {bucket['id']: (bucket['width'], bucket['height']) for bucket in buckets}
+            changed = []
+            with conn:
+                for edit in edits:
+                    row = conn.execute(
+                        f"SELECT {_IMAGE_COLUMNS} FROM session_images WHERE session_id = ? AND idx = ?",
+                        (session_id, edit['id'])
+                    ).fetchone()
+                    if row is None:
+                        raise ValueError(f"图片不存在: {edit['id']}")
+                    image = _image_row_to_dict(row)
+                    self._apply_edit(conn, session_id, image, edit, sizes)
+                    changed.append(image)
+                conn.execute(
+                    "UPDATE sessions SET updated_at = ? WHERE session_id = ?", (time.time(), session_id)
+                )
+        finally:
+            conn.close()
+        return changed
+
+    def _apply_edit(self, conn, session_id: str, image: Dict[str, Any], edit: Dict[str, Any], sizes):
+        bucket_id = edit.get('assigned_bucket')
+        if bucket_id is not None and bucket_id != image['assigned_bucket']:
+            if bucket_id not in sizes:
+                raise ValueError(f"桶不存在: {bucket_id}")
+            width, height = sizes[bucket_id]
+            image['assigned_bucket'] = bucket_id
+            image['default_crop'] = calculate_default_crop(image['width'], image['height'], width / height)
+            image['cropped'] = False
+            image['crop_params'] = None
+
+        if 'crop_params' in edit or 'cropped' in edit:
+            crop = edit.get('crop_params')
+            image['cropped'] = bool(edit.get('cropped', crop is not None)) and crop is not None
+            image['crop_params'] = dict(crop) if image['cropped'] else None
+
+        crop = image['crop_params'] or {}
+        default = image['default_crop']
+        conn.execute(
+            "UPDATE session_images SET bucket = ?, cropped = ?, crop_x = ?, crop_y = ?, crop_w = ?, crop_h = ?, "
+            "default_x = ?, default_y = ?, default_w = ?, default_h = ? WHERE session_id = ? AND idx = ?",
+            (
+                image['assigned_bucket'], int(image['cropped']),
+                crop.get('x'), crop.get('y'), crop.get('width'), crop.get('height'),
+                default['x'], default['y'], default['width'], default['height'],
+                session_id, image['id']
+            )
+        )
+
+    def _buckets(self, conn, session_id: str) -> List[Dict[str, Any]]:
+        row = conn.execute("SELECT buckets FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            raise KeyError(session_id)
+        return json.loads(row[0])
+
+    def update_bucket(self, session_id: str, bucket_id: str, width: int, height: int):
+        """修改桶尺寸，并批量重新计算该桶中图片的默认裁剪区域"""
+        conn = self._connect()
+        try:
+            buckets = self._buckets(conn, session_id)
+            bucket = next((b for b in buckets if b['id'] == bucket_id), None)
+            if bucket is None:
+                raise ValueError(f"桶不存在: {bucket_id}")
+            bucket.update(width=width, height=height, aspect_ratio=round(width / height, 4))
+
+            rows = conn.execute(
+                "SELECT idx, width, height FROM session_images WHERE session_id = ? AND bucket = ?",
+                (session_id, bucket_id)
+            ).fetchall()
+            if rows:
+                columns = np.array(rows, dtype=np.int64)
+                crops = compute_default_crops(
+                    columns[:, 1], columns[:, 2], np.full(len(rows), width / height)
+                ).tolist()
+            else:
+                crops = []
+
+            with conn:
+                conn.execute(
+                    "UPDATE sessions SET buckets = ?, updated_at = ? WHERE session_id = ?",
+                    (json.dumps(buckets, ensure_ascii=False), time.time(), session_id)
+                )
+                conn.executemany(
+                    "UPDATE session_images SET default_x = ?, default_y = ?, default_w = ?, default_h = ? "
+                    "WHERE session_id = ? AND idx = ?",
+                    ((*crop, session_id, row[0]) for row, crop in zip(rows, crops))
+                )
+        finally:
+            conn.close()
+
+    def to_plan(self, session_id: str) -> CropPlan:
+        """已裁剪的图片转换为裁剪计划 (用于导出)，近重复标记一并带入计划"""
+        conn = self._connect()
+        try:
+            buckets = self._buckets(conn, session_id)
+            bucket_index = {bucket['id']: i for i, bucket in enumerate(buckets)}
+            rows = conn.execute(
+                "SELECT path, bucket, crop_x, crop_y, crop_w, crop_h, duplicate_of FROM session_images "
+                "WHERE session_id = ? AND cropped = 1 ORDER BY idx",
+                (session_id,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        return CropPlan(
+            paths=[row[0] for row in rows],
+            bucket_index=np.array([bucket_index.get(row[1], 0) for row in rows], dtype=np.int16),
+            crops=np.array([row[2:6] for row in rows], dtype=np.int32).reshape(-1, 4),
+            buckets=[{'id': b['id'], 'width': b['width'], 'height': b['height']} for b in buckets],
+            meta={'session_id': session_id},
+            duplicates=np.array([row[6] is not None for row in rows], dtype=bool)
+        )
+
+    def delete(self, session_id: str) -> bool:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM session_images WHERE session_id = ?", (session_id,))
+                deleted = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+        finally:
+            conn.close()
+        return deleted > 0
+
+    def expire(self, max_age: float, now: Optional[float] = None) -> int:
+        """删除超过 max_age 秒未修改的会话，返回删除的会话数"""
+        cutoff = (time.time() if now is None else now) - max_age
+        conn = self._connect()
+        try:
+            with conn:
+                expired = [
+                    row[0] for row in conn.execute("SELECT session_id FROM sessions WHERE updated_at < ?", (cutoff,))
+                ]
+                for session_id in expired:
+                    conn.execute("DELETE FROM session_images WHERE session_id = ?", (session_id,))
+                    conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        finally:
+            conn.close()
+        if expired:
+            logger.info("已删除 %d 个过期会话", len(expired))
+        return len(expired)
+
+
+session_store = SessionStore(SESSION_DB_PATH)
@@ -0,0 +1,557 @@
+"""
+分片归档导出 (WebDataset)
+按桶把裁剪结果和伴随文件写入大小受限的 tar 分片，代替大量小文件:
+
+    output_dir/
+        shards.json                     分片列表 (wids-shard-index-v1，数据加载器直接读取)
+        .smartbucket_shards.json        续传状态
+        A_384x512/
+            shard-00000-00.tar          样本 img1.png / img1.txt ... (键为文件名主干)
+            shard-00000-00.index.json   分片索引 (每个样本的键、源文件、各成员在 tar 中的偏移和大小)
+
+每个桶的图片按顺序每 max_samples 张为一组，每组由一个工作进程写入 (各组并行)，
+超过 max_bytes 时在组内开始下一个分片 (-01、-02 ...)。分片先写入 .tmp 文件，完成后改名并写出索引。
+再次导出时输入没有变化且分片完整的组计入 up_to_date，不重新写入；不再属于本次导出的分片会被删除
+"""
+import io
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import tarfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from typing import Dict, Any, List, Optional, Tuple, Callable, Iterator
+
+from services.export_manifest import ExportManifest
+from services.companions import CompanionIndex
+from services.encoders import output_filename
+from services.image_processor import encode_crop, export_encoder_settings, DEFAULT_EXPORT_WORKERS
+from services.metrics import observe_stage, record_bytes, record_error, record_cache
+
+logger = logging.getLogger(__name__)
+
+# 续传状态文件名 (位于输出目录)
+SHARD_STATE_FILENAME = '.smartbucket_shards.json'
+
+# 分片列表文件名 (wids-shard-index-v1 格式)
+SHARD_INDEX_FILENAME = 'shards.json'
+
+# 状态格式版本
+SHARD_STATE_VERSION = 1
+
+# 每个分片的默认样本数上限和字节数上限
+DEFAULT_SHARD_MAX_SAMPLES = 1000
+DEFAULT_SHARD_MAX_BYTES = 512 * 1024 * 1024
+
+# 同时在途的分片组数 (每个工作进程)
+SHARD_GROUPS_IN_FLIGHT_PER_WORKER = 2
+
+# tar 成员的头部和块大小
+TAR_BLOCK_SIZE = 512
+
+
+def shard_settings(max_samples: Optional[int] = None, max_mb: Optional[float] = None) -> Dict[str, int]:
+    """校验分片参数，返回 {'max_samples', 'max_bytes'}，参数无效时抛出 ValueError"""
+    max_samples = DEFAULT_SHARD_MAX_SAMPLES if max_samples is None else int(max_samples)
+    max_bytes = DEFAULT_SHARD_MAX_BYTES if max_mb is None else int(max_mb * 1024 * 1024)
+    if max_samples < 1:
+        raise ValueError(f"每个分片的样本数上限应大于 0: {max_samples}")
+    if max_bytes < TAR_BLOCK_SIZE * 4:
+        raise ValueError(f"每个分片的大小上限过小: {max_mb} MB")
+    return {'max_samples': max_samples, 'max_bytes': max_bytes}
+
+
+def bucket_dirname(bucket_id: str, width: int, height: int) -> str:
+    """桶的分片目录名 (如 A_384x512)"""
+    return f"{re.sub(r'[^A-Za-z0-9_-]+', '_', str(bucket_id))}_{width}x{height}"
+
+
+def shard_name(group: int, part: int) -> str:
+    return f"shard-{group:05d}-{part:02d}.tar"
+
+
+def _index_path(tar_path: str) -> str:
+    return tar_path[:-len('.tar')] + '.index.json'
+
+
+def _member_size(size: int) -> int:
+    """tar 成员占用的字节数 (头部 + 按块对齐的数据)"""
+    return TAR_BLOCK_SIZE + (size + TAR_BLOCK_SIZE - 1) // TAR_BLOCK_SIZE * TAR_BLOCK_SIZE
+
+
+def _sample_key(filename: str, used: set, index: int) -> str:
+    """
+    样本键: 文件名主干 (WebDataset 以第一个点分隔键和成员扩展名，主干中的点替换为下划线)，
+    同一组内重名时追加图片序号
+    """
+    key = os.path.splitext(filename)[0].replace('.', '_') or str(index)
+    if key in used:
+        key = f"{key}_{index}"
+    used.add(key)
+    return key
+
+
+class ShardWriter:
+    """组内顺序写入分片，超过上限时关闭当前分片并开始下一个"""
+
+    def __init__(self, directory: str, group: int, max_samples: int, max_bytes: int):
+        self.directory = directory
+        self.group = group
+        self.max_samples = max_samples
+        self.max_bytes = max_bytes
+        self.shards: List[Dict[str, Any]] = []
+        self._tar: Optional[tarfile.TarFile] = None
+        self._part = 0
+        self._samples: List[Dict[str, Any]] = []
+        self._size = 0
+
+    def add(self, key: str, source: str, members: List[Tuple[str, bytes]], mtime: float):
+        """写入一个样本 (成员: [(扩展名, 数据)])"""
+        size = sum(_member_size(len(data)) for _, data in members)
+        if self._tar is not None and (
+            len(self._samples) >= self.max_samples or self._size + size > self.max_bytes
+        ):
+            self._close()
+        if self._tar is None:
+            self._open()
+
+        entry = {'key': key, 'source': source, 'members': {}}
+        for ext, data in members:
+            info = tarfile.TarInfo(f"{key}.{ext}")
+            info.size = len(data)
+            info.mtime = int(mtime)
+            info.mode = 0o644
+            self._tar.addfile(info, io.BytesIO(data))
+            # 数据位于成员末尾 (之前是头部，可能包括 PAX 扩展头)，之后按块补齐
+            padded = (info.size + TAR_BLOCK_SIZE - 1) // TAR_BLOCK_SIZE * TAR_BLOCK_SIZE
+            entry['members'][ext] = [self._tar.offset - padded, info.size]
+        self._samples.append(entry)
+        self._size += size
+
+    def _open(self):
+        name = shard_name(self.group, self._part)
+        self._tmp_path = os.path.join(self.directory, name + '.tmp')
+        self._tar = tarfile.open(self._tmp_path, 'w')
+        self._samples = []
+        self._size = 0
+
+    def _close(self):
+        self._tar.close()
+        self._tar = None
+        name = shard_name(self.group, self._part)
+        path = os.path.join(self.directory, name)
+        os.replace(self._tmp_path, path)
+        filesize = os.path.getsize(path)
+        index = {'shard': name, 'nsamples': len(self._samples), 'filesize': filesize, 'samples': self._samples}
+        with open(_index_path(path) + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(json.dumps(index, ensure_ascii=False, separators=(',', ':')))
+        os.replace(_index_path(path) + '.tmp', _index_path(path))
+        self.shards.append({'name': name, 'nsamples': len(self._samples), 'filesize': filesize})
+        self._part += 1
+
+    def finish(self) -> List[Dict[str, Any]]:
+        if self._tar is not None:
+            self._close()
+        return self.shards
+
+    def abort(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+            try:
+                os.remove(self._tmp_path)
+            except OSError:
+                pass
+
+
+def write_shard_group(
+    directory: str,
+    group: int,
+    width: int,
+    height: int,
+    samples: List[Tuple[int, str, str, Dict[str, Any], List[str]]],
+    encoder: Optional[Dict[str, Any]],
+    max_samples: int,
+    max_bytes: int
+) -> Dict[str, Any]:
+    """
+    写入一组样本的分片 (在工作进程中执行)
+
+    Args:
+        samples: [(图片序号, 源文件路径, 输出文件名, 裁剪参数, 伴随文件)]
+
+    Returns:
+        {'shards': [{'name', 'nsamples', 'filesize'}], 'success', 'failed': [(序号, 文件名)],
+         'encode_seconds', 'bytes', 'bytes_read', 'seconds'}
+    """
+    start = time.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    writer = ShardWriter(directory, group, max_samples, max_bytes)
+    outcome = {'success': 0, 'failed': [], 'encode_seconds': 0.0, 'bytes': 0, 'bytes_read': 0}
+    used_keys: set = set()
+    try:
+        for index, path, filename, crop_params, companions in samples:
+            stats = {}
+            try:
+                data = encode_crop(path, crop_params, width, height, filename, encoder, stats)
+                members = [(os.path.splitext(filename)[1][1:].lower(), data)]
+                for companion in companions:
+                    with open(companion, 'rb') as f:
+                        members.append((os.path.splitext(companion)[1][1:].lower(), f.read()))
+                mtime = os.path.getmtime(path)
+            except Exception as e:
+                logger.warning("处理图片失败 %s: %s", path, e, extra={'image_path': path})
+                outcome['failed'].append((index, filename))
+                continue
+            writer.add(_sample_key(filename, used_keys, index), path, members, mtime)
+            outcome['success'] += 1
+            outcome['encode_seconds'] += stats['encode_seconds']
+            outcome['bytes'] += sum(len(member) for _, member in members)
+            outcome['bytes_read'] += stats.get('bytes_read', 0)
+        outcome['shards'] = writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+    outcome['seconds'] = time.perf_counter() - start
+    return outcome
+
+
+class ShardState:
+    """
+    输出目录的分片续传状态
+    groups: {组路径 (桶目录/组序号): {'fingerprint', 'complete', 'shards': [{'name', 'nsamples', 'filesize'}]}}
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, SHARD_STATE_FILENAME)
+        self.groups: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("分片状态无法读取，将重新生成 %s: %s", self.path, e)
+            return
+        if data.get('version') == SHARD_STATE_VERSION:
+            self.groups = data.get('groups', {})
+
+    def is_up_to_date(self, group_path: str, fingerprint: str) -> bool:
+        """组已完整写入、指纹一致且分片文件大小与记录一致"""
+        entry = self.groups.get(group_path)
+        if entry is None or not entry.get('complete') or entry.get('fingerprint') != fingerprint:
+            return False
+        directory = os.path.join(self.output_dir, os.path.dirname(group_path))
+        for shard in entry['shards']:
+            try:
+                if os.path.getsize(os.path.join(directory, shard['name'])) != shard['filesize']:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def shard_paths(self, group_paths) -> set:
+        """组的分片相对路径"""
+        paths = set()
+        for group_path in group_paths:
+            directory = os.path.dirname(group_path)
+            for shard in self.groups.get(group_path, {}).get('shards', []):
+                paths.add(os.path.join(directory, shard['name']))
+        return paths
+
+    def save(self):
+        """原子写入状态文件"""
+        tmp_path = self.path + '.tmp'
+        data = {'version': SHARD_STATE_VERSION, 'groups': self.groups}
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("分片状态写入失败 %s: %s", self.path, e)
+
+
+def _iter_samples(
+    images: Optional[List[Dict[str, Any]]],
+    buckets: Optional[Dict[str, Dict[str, int]]],
+    plan,
+    encoder: Optional[Dict[str, Any]],
+    results: Dict[str, Any],
+    skip_duplicates: bool = False
+) -> Iterator[Tuple[str, int, int, int, str, str, Dict[str, Any]]]:
+    """
+    生成 (桶 ID, 桶宽, 桶高, 图片序号, 源文件路径, 输出文件名, 裁剪参数)，
+    未裁剪的图片和 skip_duplicates 时计划中标记为近重复的图片计入 skipped
+    """
+    if plan is not None:
+        duplicates = plan.duplicates if skip_duplicates else None
+        for index, path in enumerate(plan.paths):
+            if duplicates is not None and duplicates[index]:
+                results['skipped'] += 1
+                continue
+            bucket = plan.buckets[plan.bucket_index[index]]
+            x, y, width, height = plan.crops[index].tolist()
+            crop_params = {'x': x, 'y': y, 'width': width, 'height': height}
+            filename = output_filename(os.path.basename(path), encoder)
+            yield bucket['id'], bucket['width'], bucket['height'], index, path, filename, crop_params
+        return
+
+    for index, img in enumerate(images):
+        if not img.get('cropped') or not img.get('crop_params'):
+            results['skipped'] += 1
+            continue
+        bucket_id = img.get('assigned_bucket', 'A')
+        bucket = buckets.get(bucket_id, {'width': 1024, 'height': 1024})
+        filename = output_filename(img['filename'], encoder)
+        yield bucket_id, bucket['width'], bucket['height'], index, img['path'], filename, img['crop_params']
+
+
+def _group_fingerprint(
+    samples: List[Tuple[int, str, str, Dict[str, Any], List[str]]],
+    width: int,
+    height: int,
+    encoder: Optional[Dict[str, Any]],
+    max_bytes: int
+) -> str:
+    """组内所有样本的导出指纹 (源文件、裁剪区域、目标尺寸、编码参数、伴随文件) 与分片大小上限的摘要"""
+    digest = hashlib.sha1(f"{max_bytes}".encode())
+    for _, path, filename, crop_params, companions in samples:
+        fingerprint = ExportManifest.fingerprint(
+            path, crop_params, width, height, export_encoder_settings(filename, encoder), companions
+        )
+        digest.update(json.dumps([filename, fingerprint], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def process_shard_export(
+    output_dir: str,
+    images: Optional[List[Dict[str, Any]]] = None,
+    buckets: Optional[Dict[str, Dict[str, int]]] = None,
+    plan=None,
+    copy_companions: bool = True,
+    workers: Optional[int] = None,
+    max_samples: int = DEFAULT_SHARD_MAX_SAMPLES,
+    max_bytes: int = DEFAULT_SHARD_MAX_BYTES,
+    resume: bool = True,
+    prune: bool = True,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    companion_extensions: Optional[List[str]] = None,
+    encoder: Optional[Dict[str, Any]] = None,
+    skip_duplicates: bool = False
+) -> Dict[str, Any]:
+    """
+    按桶导出为 WebDataset tar 分片
+
+    Args:
+        output_dir: 输出目录
+        images / buckets 与 plan (CropPlan) 二选一，含义同 process_batch_export / process_plan_export
+        copy_companions: 是否把伴随文件作为样本成员写入分片
+        workers: 并行进程数 (每个进程写入一组分片)，为空时使用 CPU 核数，为 1 时在当前进程内顺序执行
+        max_samples / max_bytes: 每个分片的样本数上限和字节数上限
+        resume: 为 True 时跳过输入没有变化且分片完整的组
+        prune: 导出完成后删除不再属于本次导出的分片
+        progress_callback: 每完成一组调用一次，参数为当前的结果统计
+        cancel_event: 置位后停止提交新的组，等待在途的组写完后返回
+        companion_extensions: 伴随文件扩展名，为空时使用默认值
+        encoder: 编码参数 (services.encoders.resolve_encoder)，为空时使用默认预设
+        skip_duplicates: 跳过计划中标记为近重复的图片 (仅 plan，images 由调用方标记为未裁剪)
+
+    Returns:
+        处理结果统计 (同 process_batch_export，removed 为删除的分片数，shards 为当前分片总数)
+    """
+    total = len(plan) if plan is not None else len(images)
+    results = {
+        'total': total,
+        'success': 0,
+        'failed': 0,
+        'skipped': 0,
+        'up_to_date': 0,
+        'removed': 0,
+        'encode_seconds': 0.0,
+        'bytes_written': 0,
+        'shards': 0,
+        'cancelled': False,
+        'errors': []
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    state = ShardState(output_dir)
+    previous_shards = state.shard_paths(state.groups)
+    companion_index = CompanionIndex(companion_extensions) if copy_companions else None
+
+    # 按桶分组 (保持输入顺序)
+    by_bucket: Dict[str, Tuple[int, int, List]] = {}
+    for bucket_id, width, height, index, path, filename, crop_params in _iter_samples(
+        images, buckets, plan, encoder, results, skip_duplicates
+    ):
+        directory = bucket_dirname(bucket_id, width, height)
+        companions = companion_index.find(path) if companion_index is not None else []
+        by_bucket.setdefault(directory, (width, height, []))[2].append(
+            (index, path, filename, crop_params, companions)
+        )
+
+    def iter_groups():
+        for directory, (width, height, samples) in by_bucket.items():
+            for group, start in enumerate(range(0, len(samples), max_samples)):
+                yield directory, group, width, height, samples[start:start + max_samples]
+
+    group_paths = []
+    up_to_date_groups = [0]
+    failures = []
+
+    def record(group_path: str, fingerprint: str, size: int, outcome: Optional[Dict[str, Any]]):
+        if outcome is None:
+            results['failed'] += size
+            failures.append((0, f"分片写入失败: {group_path}"))
+            record_error('shard', size)
+            state.groups.pop(group_path, None)
+        else:
+            results['success'] += outcome['success']
+            results['failed'] += len(outcome['failed'])
+            results['encode_seconds'] += outcome['encode_seconds']
+            results['bytes_written'] += sum(shard['filesize'] for shard in outcome['shards'])
+            failures.extend((index, f"处理失败: {filename}") for index, filename in outcome['failed'])
+            observe_stage('shard', outcome['seconds'], outcome['success'])
+            record_bytes('export', read=outcome['bytes_read'], written=outcome['bytes'])
+            if outcome['failed']:
+                record_error('export', len(outcome['failed']))
+            # 有图片失败的组不计为完整，下次导出时重新写入
+            state.groups[group_path] = {
+                'fingerprint': fingerprint,
+                'complete': not outcome['failed'],
+                'shards': outcome['shards']
+            }
+        state.save()
+        if progress_callback is not None:
+            progress_callback(results)
+
+    def cancelled() -> bool:
+        if cancel_event is not None and cancel_event.is_set():
+            results['cancelled'] = True
+            return True
+        return False
+
+    def tasks():
+        for directory, group, width, height, samples in iter_groups():
+            group_path = f"{directory}/{group:05d}"
+            group_paths.append(group_path)
+            fingerprint = _group_fingerprint(samples, width, height, encoder, max_bytes)
+            if resume and state.is_up_to_date(group_path, fingerprint):
+                results['up_to_date'] += len(samples)
+                up_to_date_groups[0] += 1
+                continue
+            yield (group_path, fingerprint, len(samples)), (
+                os.path.join(output_dir, directory), group, width, height, samples,
+                encoder, max_samples, max_bytes
+            )
+
+    workers = workers or DEFAULT_EXPORT_WORKERS
+    if workers <= 1:
+        for meta, args in tasks():
+            if cancelled():
+                break
+            try:
+                outcome = write_shard_group(*args)
+            except Exception as e:
+                logger.error("分片写入失败 %s: %s", meta[0], e)
+                outcome = None
+            record(*meta, outcome)
+    else:
+        max_in_flight = workers * SHARD_GROUPS_IN_FLIGHT_PER_WORKER
+        in_flight = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for meta, args in tasks():
+                if cancelled():
+                    break
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record(*in_flight.pop(future), _group_outcome(future))
+                in_flight[pool.submit(write_shard_group, *args)] = meta
+
+            for future in as_completed(in_flight):
+                record(*in_flight[future], _group_outcome(future))
+
+    record_cache('shard_groups', hits=up_to_date_groups[0], misses=len(group_paths) - up_to_date_groups[0])
+
+    if prune and not results['cancelled']:
+        results['removed'] = _prune_shards(output_dir, state, previous_shards, group_paths)
+    state.save()
+    results['shards'] = _write_shard_index(output_dir, state, group_paths)
+
+    results['encode_seconds'] = round(results['encode_seconds'], 3)
+    results['errors'] = [message for _, message in sorted(failures)]
+    return results
+
+
+def _group_outcome(future) -> Optional[Dict[str, Any]]:
+    """获取工作进程的结果，进程异常退出等情况返回 None (整组视为失败)"""
+    try:
+        return future.result()
+    except Exception as e:
+        logger.error("分片写入任务异常: %s", e)
+        return None
+
+
+def _prune_shards(output_dir: str, state: ShardState, previous_shards: set, group_paths: List[str]) -> int:
+    """删除之前写入、不再属于本次导出的分片及其索引 (只删除状态中记录过的分片)"""
+    current = set(group_paths)
+    stale = previous_shards - state.shard_paths(current)
+    for group_path in [path for path in state.groups if path not in current]:
+        del state.groups[group_path]
+    for relpath in stale:
+        path = os.path.join(output_dir, relpath)
+        for name in (path, _index_path(path)):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("删除旧分片失败 %s: %s", name, e)
+    # 不再使用的桶留下的空目录
+    for directory in {os.path.dirname(relpath) for relpath in stale}:
+        try:
+            os.rmdir(os.path.join(output_dir, directory))
+        except OSError:
+            pass
+    if stale:
+        logger.info("已删除 %d 个不再属于导出的旧分片: %s", len(stale), output_dir)
+    return len(stale)
+
+
+def _write_shard_index(output_dir: str, state: ShardState, group_paths: List[str]) -> int:
+    """写出分片列表 (wids-shard-index-v1，路径相对于输出目录)，返回分片数"""
+    shardlist = []
+    for group_path in group_paths:
+        entry = state.groups.get(group_path)
+        if entry is None:
+            continue
+        directory = os.path.dirname(group_path)
+        for shard in entry['shards']:
+            shardlist.append({
+                'url': f"{directory}/{shard['name']}",
+                'nsamples': shard['nsamples'],
+                'filesize': shard['filesize'],
+                'bucket': directory
+            })
+    index = {
+        '__kind__': 'wids-shard-index-v1',
+        'wids_version': 1,
+        'name': os.path.basename(os.path.abspath(output_dir)),
+        'shardlist': shardlist
+    }
+    path = os.path.join(output_dir, SHARD_INDEX_FILENAME)
+    try:
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=1)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        logger.warning("分片列表写入失败 %s: %s", path, e)
+    return len(shardlist)
@@ -0,0 +1,261 @@
+"""
+缩略图缓存服务
+按 (路径, 修改时间, 文件大小, 尺寸, 格式) 生成内容地址，缩略图以文件形式缓存在磁盘上，
+超过容量预算时按最近最少使用淘汰
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple, Iterable, Iterator, Deque
+
+from services.image_processor import get_image_thumbnail
+from services.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+# 缓存目录，可通过环境变量覆盖
+THUMBNAIL_CACHE_DIR = os.environ.get(
+    'SBC_THUMBNAIL_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'smartbucketcropper', 'thumbnails')
+)
+
+# 缓存容量预算 (MB)
+THUMBNAIL_CACHE_MAX_MB = int(os.environ.get('SBC_THUMBNAIL_CACHE_MB', '1024'))
+
+# 淘汰时清理到预算的比例，避免每次写入都触发淘汰
+EVICT_TARGET_RATIO = 0.9
+
+# 支持的缩略图格式: 请求参数 -> (Pillow 格式, 扩展名, MIME)
+THUMBNAIL_FORMATS = {
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg'),
+    'webp': ('WEBP', '.webp', 'image/webp'),
+}
+
+# 预生成缩略图的并发数 (固定为较小的值，避免与交互请求的缩略图执行器争抢 CPU)
+PREGENERATE_WORKERS = 2
+
+
+class ThumbnailCache:
+    """磁盘缩略图缓存 (线程安全)"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 缓存键 -> 文件大小，按最近使用排序 (最旧的在前)
+        self._entries: Optional[OrderedDict] = None
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _load_entries(self):
+        """首次使用时扫描缓存目录，按修改时间恢复 LRU 顺序"""
+        files = []
+        if os.path.isdir(self.cache_dir):
+            for root, _, names in os.walk(self.cache_dir):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, os.path.relpath(path, self.cache_dir), st.st_size))
+        files.sort()
+        self._entries = OrderedDict((rel, size) for _, rel, size in files)
+        self._total_bytes = sum(size for _, _, size in files)
+
+    def cache_key(self, image_path: str, max_size: int, fmt: str) -> Optional[str]:
+        """计算缓存键，源文件不存在时返回 None"""
+        try:
+            st = os.stat(image_path)
+        except OSError:
+            return None
+        raw = f"{os.path.abspath(image_path)}|{st.st_mtime_ns}|{st.st_size}|{max_size}|{fmt}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _relpath(self, key: str, fmt: str) -> str:
+        return os.path.join(key[:2], key + THUMBNAIL_FORMATS[fmt][1])
+
+    def get(self, image_path: str, max_size: int = 200, fmt: str = 'jpeg') -> Optional[Tuple[bytes, str]]:
+        """
+        获取缩略图，未命中时生成并写入缓存
+
+        Returns:
+            (缩略图字节, 缓存键)，无法生成时返回 None
+        """
+        key = self.cache_key(image_path, max_size, fmt)
+        if key is None:
+            return None
+
+        rel = self._relpath(key, fmt)
+        path = os.path.join(self.cache_dir, rel)
+        with self._lock:
+            if self._entries is None:
+                self._load_entries()
+            cached = rel in self._entries
+
+        if cached:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)
+                with self._lock:
+                    self._entries.move_to_end(rel)
+                    self.hits += 1
+                record_cache('thumbnail', hits=1)
+                return data, key
+            except OSError:
+                # 文件被外部删除，重新生成
+                with self._lock:
+                    self._total_bytes -= self._entries.pop(rel, 0)
+
+        data = get_image_thumbnail(image_path, max_size, format=THUMBNAIL_FORMATS[fmt][0])
+        if data is None:
+            return None
+
+        self._store(rel, path, data)
+        with self._lock:
+            self.misses += 1
+        record_cache('thumbnail', misses=1)
+        return data, key
+
+    def _store(self, rel: str, path: str, data: bytes):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("缩略图缓存写入失败 %s: %s", path, e)
+            return
+
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(rel, 0)
+            self._entries[rel] = len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """淘汰最近最少使用的缩略图 (调用方持有锁)"""
+        target = self.max_bytes * EVICT_TARGET_RATIO
+        while self._entries and self._total_bytes > target:
+            rel, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, rel))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries or ()),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_MB * 1024 * 1024)
+
+
+_pregenerate_pool: Optional[ThreadPoolExecutor] = None
+_pregenerate_job: Optional['PregenerateJob'] = None
+_pregenerate_lock = threading.Lock()
+
+
+def _pregenerate_one(image_path: str, max_size: int, fmt: str):
+    try:
+        thumbnail_cache.get(image_path, max_size, fmt)
+    except Exception as e:
+        logger.debug("预生成缩略图失败 %s: %s", image_path, e)
+
+
+class PregenerateJob:
+    """
+    一次扫描的缩略图预生成
+    由单个后台线程逐张提交，同时执行的任务数不超过 PREGENERATE_WORKERS，
+    不会一次性为全部图片创建任务；新的扫描开始时取消
+    """
+
+    def __init__(self, pool: ThreadPoolExecutor, max_size: int, fmt: str):
+        self._pool = pool
+        self.max_size = max_size
+        self.fmt = fmt
+        self._pending: Deque[Iterator[str]] = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(PREGENERATE_WORKERS)
+        self._running = False
+        self.cancelled = False
+        self.submitted = 0
+
+    def add(self, image_paths: Iterable[str]):
+        """追加待预生成的图片 (后台线程按顺序读取)"""
+        with self._lock:
+            if self.cancelled:
+                return
+            self._pending.append(iter(image_paths))
+            if not self._running:
+                self._running = True
+                threading.Thread(target=self._feed, name="thumbnail-pregenerate", daemon=True).start()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            self._pending.clear()
+
+    def _next_path(self) -> Optional[str]:
+        with self._lock:
+            while self._pending and not self.cancelled:
+                path = next(self._pending[0], None)
+                if path is not None:
+                    return path
+                self._pending.popleft()
+            self._running = False
+            return None
+
+    def _release(self, _future):
+        self._slots.release()
+
+    def _feed(self):
+        while True:
+            path = self._next_path()
+            if path is None:
+                return
+            self._slots.acquire()
+            if self.cancelled:
+                self._slots.release()
+                continue
+            future = self._pool.submit(_pregenerate_one, path, self.max_size, self.fmt)
+            future.add_done_callback(self._release)
+            self.submitted += 1
+
+
+def start_pregeneration(max_size: int = 200, fmt: str = 'jpeg') -> PregenerateJob:
+    """开始新的预生成 (取消上一次扫描尚未完成的预生成)"""
+    global _pregenerate_pool, _pregenerate_job
+    with _pregenerate_lock:
+        if _pregenerate_pool is None:
+            _pregenerate_pool = ThreadPoolExecutor(
+                max_workers=PREGENERATE_WORKERS,
+                thread_name_prefix="thumbnail-pregenerate"
+            )
+        if _pregenerate_job is not None:
+            _pregenerate_job.cancel()
+        _pregenerate_job = PregenerateJob(_pregenerate_pool, max_size, fmt)
+        return _pregenerate_job
+
+
+def pregenerate_thumbnails(image_paths: Iterable[str], max_size: int = 200, fmt: str = 'jpeg') -> PregenerateJob:
+    """
+    在后台为一批图片预生成缩略图 (不阻塞调用方)，取代上一次的预生成
+    分批追加时先调用 start_pregeneration，再对返回的任务调用 add
+    """
+    job = start_pregeneration(max_size, fmt)
+    job.add(image_paths)
+    return job
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试按 backend 目录下的方式导入 (from services.x import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,60 @@
+"""
+多分辨率导出: 缩放尺寸的宽高分别对齐 64，输出前需居中裁剪到各自的长宽比，不能拉伸
+"""
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from services.image_processor import process_batch_export, scale_dirname, scaled_bucket_size
+
+SCALES = [0.5, 0.75, 1.0]
+
+
+def _square_blob_image(path: str, width: int, height: int, side: int):
+    """黑底、中心为 side x side 白色正方形的图片"""
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    top = (height - side) // 2
+    left = (width - side) // 2
+    pixels[top:top + side, left:left + side] = 255
+    Image.fromarray(pixels).save(path)
+
+
+def _blob_aspect(path: str) -> float:
+    """输出图片中白色区域的宽高比"""
+    with Image.open(path) as img:
+        mask = np.asarray(img.convert('L')) > 127
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    return (cols[-1] - cols[0] + 1) / (rows[-1] - rows[0] + 1)
+
+
+@pytest.mark.parametrize('bucket_width,bucket_height', [(832, 1152), (1024, 960)])
+def test_scaled_outputs_keep_aspect_ratio(tmp_path, bucket_width, bucket_height):
+    source = str(tmp_path / 'source.png')
+    _square_blob_image(source, bucket_width, bucket_height, 384)
+    output_dir = str(tmp_path / 'out')
+
+    results = process_batch_export(
+        images=[{
+            'path': source,
+            'filename': 'source.png',
+            'assigned_bucket': 'A',
+            'cropped': True,
+            'crop_params': {'x': 0, 'y': 0, 'width': bucket_width, 'height': bucket_height}
+        }],
+        buckets={'A': {'width': bucket_width, 'height': bucket_height}},
+        output_dir=output_dir,
+        copy_companions=False,
+        workers=1,
+        scales=SCALES
+    )
+    assert results['success'] == 1
+
+    for scale in SCALES:
+        output = os.path.join(output_dir, scale_dirname(scale), 'source.png')
+        with Image.open(output) as img:
+            assert img.size == scaled_bucket_size(bucket_width, bucket_height, scale)
+        # 正方形在每个尺寸中仍是正方形 (误差在 1 像素的量级)
+        assert _blob_aspect(output) == pytest.approx(1.0, abs=0.01)
@@ -0,0 +1,50 @@
+"""
+裁剪计划中的近重复标记: 保存 / 读取后保留，skip_duplicates 时按计划导出和分片导出都跳过
+"""
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from services.crop_plan import CropPlan
+from services.image_processor import process_plan_export
+from services.shard_export import process_shard_export
+
+
+@pytest.fixture
+def plan(tmp_path):
+    paths = []
+    for i in range(3):
+        path = str(tmp_path / f'img{i}.png')
+        Image.new('RGB', (128, 128), (i * 60, 0, 0)).save(path)
+        paths.append(path)
+    return CropPlan(
+        paths=paths,
+        bucket_index=np.zeros(3, dtype=np.int16),
+        crops=np.array([[0, 0, 128, 128]] * 3, dtype=np.int32),
+        buckets=[{'id': 'A', 'width': 64, 'height': 64}],
+        duplicates=np.array([False, True, False])
+    )
+
+
+def test_duplicates_survive_save_and_load(tmp_path, plan):
+    path = str(tmp_path / 'plan.npz')
+    plan.save(path)
+    loaded = CropPlan.load(path)
+    assert loaded.duplicates.tolist() == [False, True, False]
+    assert loaded.summary()['duplicates'] == 1
+
+
+def test_plan_export_skips_duplicates(tmp_path, plan):
+    output_dir = str(tmp_path / 'out')
+    results = process_plan_export(plan, output_dir, copy_companions=False, workers=1, skip_duplicates=True)
+    assert (results['success'], results['skipped']) == (2, 1)
+    assert sorted(os.listdir(output_dir)) == ['img0.png', 'img2.png']
+
+
+def test_shard_export_skips_duplicates(tmp_path, plan):
+    results = process_shard_export(
+        str(tmp_path / 'shards'), plan=plan, copy_companions=False, workers=1, skip_duplicates=True
+    )
+    assert results['skipped'] == 1
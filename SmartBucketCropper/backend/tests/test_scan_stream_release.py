@@ -0,0 +1,35 @@
+"""
+流式扫描占用的 probe 名额: 客户端在响应体开始前断开时也要释放
+"""
+import asyncio
+
+from routes.scan import ScanStreamRequest, scan_folder_stream
+from services.executors import get_pool
+
+
+def _in_flight() -> int:
+    stats = get_pool('probe').stats()
+    return stats['active'] + stats['queued']
+
+
+def test_probe_slot_released_when_client_disconnects_before_body(tmp_path):
+    before = _in_flight()
+
+    async def run():
+        response = await scan_folder_stream(ScanStreamRequest(folder_path=str(tmp_path)))
+        assert _in_flight() == before + 1
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            # 连接已断开，发送响应头即失败
+            raise OSError("client disconnected")
+
+        try:
+            await response({'type': 'http', 'asgi': {'spec_version': '2.4'}}, receive, send)
+        except Exception:
+            pass
+
+    asyncio.run(run())
+    assert _in_flight() == before
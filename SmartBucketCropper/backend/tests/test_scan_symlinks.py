@@ -0,0 +1,34 @@
+"""
+递归列出图片时不进入指向目录的符号链接，链接成环时也能结束，结果与 list_image_files 一致
+"""
+import os
+
+import pytest
+from PIL import Image
+
+from services.bucket_analyzer import list_image_entries, list_image_files
+
+
+@pytest.fixture
+def folder_with_symlink_loop(tmp_path):
+    root = tmp_path / 'images'
+    (root / 'sub').mkdir(parents=True)
+    Image.new('RGB', (8, 8)).save(root / 'a.png')
+    Image.new('RGB', (8, 8)).save(root / 'sub' / 'b.png')
+    try:
+        # sub/loop -> images，目录链接成环
+        os.symlink(root, root / 'sub' / 'loop', target_is_directory=True)
+        # 名称带图片扩展名的目录链接也不能当作图片
+        os.symlink(root / 'sub', root / 'dir.png', target_is_directory=True)
+    except (OSError, NotImplementedError):
+        pytest.skip("不支持创建符号链接")
+    return str(root)
+
+
+def test_symlink_loop_is_not_followed(folder_with_symlink_loop):
+    paths = [path for path, _, _ in list_image_entries(folder_with_symlink_loop)]
+    assert paths == [
+        os.path.join(folder_with_symlink_loop, 'a.png'),
+        os.path.join(folder_with_symlink_loop, 'sub', 'b.png')
+    ]
+    assert paths == list_image_files(folder_with_symlink_loop)
@@ -2,9 +2,9 @@
  * SmartBucketCropper 主应用组件
  * 重新设计：三个桶按方向分类（横向/正方形/纵向），网格直接拖动裁剪
  */
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 import useImageStore from './hooks/useImageStore';
-import { batchExport } from './api/client';
+import { createExportJob, createSessionExportJob, waitForExportJob } from './api/client';
 import FolderSelector from './components/FolderSelector';
 import BucketSettings from './components/BucketSettings';
 import ImageGridWithCrop from './components/ImageGridWithCrop';
@@ -23,14 +23,29 @@ function App() {
     getBucketsConfig,
     getExportImages,
     addToast,
+    sessionId,
+    restoreSession,
+    sessionPages,
+    getBucketImageCount,
   } = useImageStore();
 
   const [exporting, setExporting] = useState(false);
+  const [exportProgress, setExportProgress] = useState(null);
 
-  const hasImages = images.length > 0;
+  // 恢复的会话按需读取图片，第一个桶为空时也显示工作区
+  const hasImages = images.length > 0 || sessionPages !== null;
   const croppedCount = getCroppedCount();
   const currentBucket = buckets.find((b) => b.id === activeBucket);
 
+  // 刷新页面后恢复上次的会话
+  useEffect(() => {
+    restoreSession().then((restored) => {
+      if (restored) {
+        addToast('已恢复上次的会话', 'info');
+      }
+    });
+  }, []);
+
   // 导出处理
   const handleExport = async () => {
     if (croppedCount === 0) {
@@ -40,15 +55,20 @@ function App() {
 
     setExporting(true);
     try {
-      const result = await batchExport(
-        getExportImages(),
-        getBucketsConfig(),
-        outputDir
-      );
+      // 有会话时服务端直接读取裁剪状态，无需上传图片列表
+      const job = sessionId
+        ? await createSessionExportJob(sessionId, outputDir)
+        : await createExportJob(getExportImages(), getBucketsConfig(), outputDir);
+      const result = await waitForExportJob(job.job_id, setExportProgress);
+
+      if (result.state === 'failed') {
+        throw new Error(result.error || '导出失败');
+      }
 
-      if (result.success > 0) {
+      if (result.success > 0 || result.up_to_date > 0) {
         addToast(
-          `导出完成！成功 ${result.success} 张，跳过 ${result.skipped} 张`,
+          `导出完成！成功 ${result.success} 张，未变化 ${result.up_to_date} 张，跳过 ${result.skipped} 张` +
+            (result.removed > 0 ? `，删除旧输出 ${result.removed} 张` : ''),
           'success'
         );
       }
@@ -60,6 +80,7 @@ function App() {
       addToast(error.message || '导出失败', 'error');
     } finally {
       setExporting(false);
+      setExportProgress(null);
     }
   };
 
@@ -126,7 +147,9 @@ function App() {
                           d="M4 12a8 8 0 018-8V0C5.373 0 0 5.373 0 12h4zm2 5.291A7.962 7.962 0 014 12H0c0 3.042 1.135 5.824 3 7.938l3-2.647z"
                         />
                       </svg>
-                      导出中...
+                      {exportProgress
+                        ? `导出中... ${exportProgress.processed} / ${exportProgress.total}`
+                        : '导出中...'}
                     </span>
                   ) : (
                     `📦 导出 (${croppedCount})`
@@ -182,7 +205,9 @@ function App() {
             <div className="flex items-center gap-4 border-b border-gray-700 pb-4">
               {buckets.map((bucket) => {
                 const bucketImages = images.filter(img => img.assigned_bucket === bucket.id);
-                const croppedInBucket = bucketImages.filter(img => img.cropped).length;
+                const croppedInBucket = sessionPages && !sessionPages[bucket.id]
+                  ? bucket.cropped_count || 0
+                  : bucketImages.filter(img => img.cropped).length;
                 const isActive = activeBucket === bucket.id;
                 
                 return (
@@ -199,7 +224,7 @@ function App() {
                     <div className="text-left">
                       <div className="font-bold">{bucket.name}</div>
                       <div className="text-xs opacity-75">
-                        {bucket.width} × {bucket.height} | {bucketImages.length} 张
+                        {bucket.width} × {bucket.height} | {getBucketImageCount(bucket.id)} 张
                         {croppedInBucket > 0 && (
                           <span className="text-green-400 ml-1">({croppedInBucket} ✓)</span>
                         )}
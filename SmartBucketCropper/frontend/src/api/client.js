@@ -31,6 +31,57 @@ export async function scanFolder(folderPath) {
   return client.post('/scan/folder', { folder_path: folderPath });
 }
 
+/**
+ * 流式扫描文件夹 (NDJSON)
+ * 每收到一个事件调用一次 onEvent，返回最终的 done 事件
+ */
+export async function scanFolderStream(folderPath, onEvent, batchSize = 500) {
+  const response = await fetch(`${API_BASE}/scan/folder/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ folder_path: folderPath, batch_size: batchSize, create_session: true }),
+  });
+
+  if (!response.ok) {
+    let message = '请求失败';
+    try {
+      message = (await response.json()).detail || message;
+    } catch (e) {
+      // 忽略非 JSON 错误响应
+    }
+    throw new Error(message);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let doneEvent = null;
+
+  const handleLine = (line) => {
+    if (!line.trim()) return;
+    const event = JSON.parse(line);
+    if (event.type === 'error') {
+      throw new Error(event.detail || '扫描失败');
+    }
+    if (event.type === 'done') {
+      doneEvent = event;
+    }
+    onEvent(event);
+  };
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop();
+    lines.forEach(handleLine);
+  }
+  handleLine(buffer);
+
+  return doneEvent;
+}
+
 /**
  * 验证并修正桶尺寸
  */
@@ -39,10 +90,10 @@ export async function validateBucket(width, height) {
 }
 
 /**
- * 获取图片缩略图
+ * 获取图片缩略图 URL (后端返回图片数据，带 ETag 缓存)
  */
-export async function getThumbnail(imagePath) {
-  return client.get(`/scan/thumbnail/${encodeURIComponent(imagePath)}`);
+export function getThumbnailUrl(imagePath, size = 200, format = 'jpeg') {
+  return `${API_BASE}/scan/thumbnail/${encodeURIComponent(imagePath)}?size=${size}&format=${format}`;
 }
 
 /**
@@ -57,6 +108,96 @@ export async function batchExport(images, buckets, outputDir, copyCompanions = t
   });
 }
 
+/**
+ * 提交后台导出任务
+ */
+export async function createExportJob(images, buckets, outputDir, copyCompanions = true, resume = true) {
+  return client.post('/export/jobs', {
+    images,
+    buckets,
+    output_dir: outputDir,
+    copy_companions: copyCompanions,
+    resume,
+  });
+}
+
+/**
+ * 查询导出任务进度
+ */
+export async function getExportJob(jobId) {
+  return client.get(`/export/jobs/${jobId}`);
+}
+
+/**
+ * 取消导出任务
+ */
+export async function cancelExportJob(jobId) {
+  return client.post(`/export/jobs/${jobId}/cancel`);
+}
+
+/**
+ * 轮询导出任务直到结束，每次查询后调用 onProgress
+ */
+export async function waitForExportJob(jobId, onProgress, interval = 1000) {
+  while (true) {
+    const status = await getExportJob(jobId);
+    onProgress?.(status);
+    if (['completed', 'failed', 'cancelled'].includes(status.state)) {
+      return status;
+    }
+    await new Promise((resolve) => setTimeout(resolve, interval));
+  }
+}
+
+/**
+ * 获取会话概要 (桶配置和每个桶的图片数)
+ */
+export async function getSession(sessionId) {
+  return client.get(`/sessions/${sessionId}`);
+}
+
+/**
+ * 分页读取会话中的图片
+ * options: bucket / cropped 过滤，sort (index | aspect_deviation | crop_status)，order (asc | desc)，
+ * cursor (上一页的 next_cursor) 或 offset (直接跳到某个位置)，limit
+ * 返回 { images, total, next_cursor }
+ */
+export async function getSessionImages(sessionId, options = {}) {
+  return client.get(`/sessions/${sessionId}/images`, { params: { limit: 500, ...options } });
+}
+
+/**
+ * 提交图片改动 (只包含改动的图片和字段)
+ */
+export async function patchSessionImages(sessionId, edits) {
+  return client.patch(`/sessions/${sessionId}/images`, { edits });
+}
+
+/**
+ * 修改会话中的桶尺寸
+ */
+export async function patchSessionBucket(sessionId, bucketId, width, height) {
+  return client.patch(`/sessions/${sessionId}/buckets/${bucketId}`, { width, height });
+}
+
+/**
+ * 删除会话
+ */
+export async function deleteSession(sessionId) {
+  return client.delete(`/sessions/${sessionId}`);
+}
+
+/**
+ * 按会话提交后台导出任务
+ */
+export async function createSessionExportJob(sessionId, outputDir, copyCompanions = true, resume = true) {
+  return client.post(`/sessions/${sessionId}/export`, {
+    output_dir: outputDir,
+    copy_companions: copyCompanions,
+    resume,
+  });
+}
+
 /**
  * 预览裁剪效果
  */
@@ -71,9 +212,16 @@ export async function previewCrop(imagePath, cropParams, bucketWidth, bucketHeig
 
 /**
  * 获取图片 URL (通过后端代理)
+ * max: 缩放图长边 (256 / 512 / 1024 / 2048)，'full' 为原图
+ * 缩放图只用于显示，裁剪坐标需按原图尺寸换算
  */
-export function getImageUrl(imagePath) {
-  return `${API_BASE}/image/${encodeURIComponent(imagePath)}`;
+export function getImageUrl(imagePath, max = 'full') {
+  const url = `${API_BASE}/image/${encodeURIComponent(imagePath)}`;
+  return max === 'full' ? url : `${url}?max=${max}`;
 }
 
+// 各场景使用的图片尺寸
+export const GRID_IMAGE_SIZE = 512;
+export const CROP_PROXY_SIZE = 1024;
+
 export default client;
@@ -1,6 +1,6 @@
 /**
  * 桶选项卡组件
- * 显示三个桶的切换标签
+ * 显示各个桶的切换标签
  */
 import React from 'react';
 import useImageStore from '../hooks/useImageStore';
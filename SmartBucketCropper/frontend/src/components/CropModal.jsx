@@ -5,7 +5,7 @@
 import React, { useState, useCallback } from 'react';
 import Cropper from 'react-easy-crop';
 import useImageStore from '../hooks/useImageStore';
-import { getImageUrl } from '../api/client';
+import { getImageUrl, CROP_PROXY_SIZE } from '../api/client';
 
 const CropModal = () => {
   const {
@@ -20,6 +20,7 @@ const CropModal = () => {
   const [crop, setCrop] = useState({ x: 0, y: 0 });
   const [zoom, setZoom] = useState(1);
   const [croppedAreaPixels, setCroppedAreaPixels] = useState(null);
+  const [useFullImage, setUseFullImage] = useState(false);
 
   // 获取当前桶配置
   const currentBucket = buckets.find((b) => b.id === activeBucket);
@@ -27,9 +28,16 @@ const CropModal = () => {
     ? currentBucket.width / currentBucket.height
     : 1;
 
-  const onCropComplete = useCallback((croppedArea, croppedAreaPixels) => {
-    setCroppedAreaPixels(croppedAreaPixels);
-  }, []);
+  // 编辑时显示的是缩放代理图，裁剪区域按百分比换算回原图像素
+  const onCropComplete = useCallback((croppedArea) => {
+    if (!selectedImage) return;
+    setCroppedAreaPixels({
+      x: (croppedArea.x / 100) * selectedImage.width,
+      y: (croppedArea.y / 100) * selectedImage.height,
+      width: (croppedArea.width / 100) * selectedImage.width,
+      height: (croppedArea.height / 100) * selectedImage.height,
+    });
+  }, [selectedImage]);
 
   const handleSave = () => {
     if (croppedAreaPixels && selectedImage) {
@@ -45,6 +53,7 @@ const CropModal = () => {
   const handleClose = () => {
     setCrop({ x: 0, y: 0 });
     setZoom(1);
+    setUseFullImage(false);
     closeCropModal();
   };
 
@@ -80,7 +89,7 @@ const CropModal = () => {
         {/* 裁剪区域 */}
         <div className="relative flex-1 min-h-[400px] bg-dark-bg">
           <Cropper
-            image={getImageUrl(selectedImage.path)}
+            image={getImageUrl(selectedImage.path, useFullImage ? 'full' : CROP_PROXY_SIZE)}
             crop={crop}
             zoom={zoom}
             aspect={aspectRatio}
@@ -120,6 +129,17 @@ const CropModal = () => {
               />
             </div>
 
+            {/* 原图加载 */}
+            <label className="flex items-center gap-2 text-sm text-gray-400 cursor-pointer">
+              <input
+                type="checkbox"
+                checked={useFullImage}
+                onChange={(e) => setUseFullImage(e.target.checked)}
+                className="accent-neon-blue"
+              />
+              显示原图
+            </label>
+
             {/* 裁剪信息 */}
             {croppedAreaPixels && (
               <div className="text-sm text-gray-400">
@@ -3,7 +3,7 @@
  */
 import React, { useState } from 'react';
 import useImageStore from '../hooks/useImageStore';
-import { scanFolder } from '../api/client';
+import { scanFolderStream } from '../api/client';
 
 const FolderSelector = () => {
   const { 
@@ -11,7 +11,9 @@ const FolderSelector = () => {
     setFolderPath, 
     outputDir, 
     setOutputDir,
-    initializeData, 
+    beginStreamingScan,
+    applyScanEvent,
+    scanProgress,
     setLoading, 
     isLoading,
     addToast 
@@ -35,9 +37,9 @@ const FolderSelector = () => {
     setInputOutputDir(defaultOutput);
 
     try {
-      const data = await scanFolder(inputPath);
-      initializeData(data);
-      addToast(`成功扫描 ${data.total_count} 张图片`, 'success');
+      beginStreamingScan();
+      const data = await scanFolderStream(inputPath, applyScanEvent);
+      addToast(`成功扫描 ${data?.total_count ?? 0} 张图片`, 'success');
     } catch (error) {
       addToast(error.message || '扫描失败', 'error');
     } finally {
@@ -107,7 +109,9 @@ const FolderSelector = () => {
                   d="M4 12a8 8 0 018-8V0C5.373 0 0 5.373 0 12h4zm2 5.291A7.962 7.962 0 014 12H0c0 3.042 1.135 5.824 3 7.938l3-2.647z"
                 />
               </svg>
-              正在扫描...
+              {scanProgress && scanProgress.files
+                ? `正在扫描... ${scanProgress.scanned} / ${scanProgress.files}`
+                : '正在扫描...'}
             </span>
           ) : (
             '🔍 开始扫描'
@@ -4,7 +4,7 @@
  */
 import React from 'react';
 import useImageStore from '../hooks/useImageStore';
-import { getImageUrl } from '../api/client';
+import { getImageUrl, GRID_IMAGE_SIZE } from '../api/client';
 
 const ImageGrid = () => {
   const { 
@@ -84,7 +84,7 @@ const ImageCard = ({ image, bucket, onCrop }) => {
       {/* 图片 */}
       <div className="aspect-square bg-dark-bg">
         <img
-          src={getImageUrl(image.path)}
+          src={getImageUrl(image.path, GRID_IMAGE_SIZE)}
           alt={image.filename}
           className="w-full h-full object-cover"
           loading="lazy"
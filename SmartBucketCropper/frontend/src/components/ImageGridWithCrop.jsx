@@ -4,15 +4,20 @@
  */
 import React, { useState, useRef, useEffect, useCallback } from 'react';
 import { useImageStore } from '../hooks/useImageStore';
+import { getImageUrl, GRID_IMAGE_SIZE } from '../api/client';
 
-// 获取图片URL
-const getImageUrl = (path) => `/api/image/${encodeURIComponent(path)}`;
-
-// 桶名称映射
-const BUCKET_INFO = {
-  'A': { name: '横向', icon: '🖼️' },
-  'B': { name: '正方形', icon: '⬛' }, 
-  'C': { name: '纵向', icon: '📱' }
+// 桶图标按方向区分 (桶 ID 按长宽比排序，与方向没有固定对应关系)
+const getBucketIcon = (orientation) => {
+  switch (orientation) {
+    case 'landscape':
+      return '🖼️'; // 横向
+    case 'square':
+      return '⬛'; // 正方形
+    case 'portrait':
+      return '📱'; // 纵向
+    default:
+      return '📷';
+  }
 };
 
 /**
@@ -194,7 +199,7 @@ const ImageCropCard = ({ image, bucket, onCropChange, onMoveToBucket, buckets, o
                   onClick={() => { onMoveToBucket(image.path, b.id); setShowMoveMenu(false); }}
                   className="block w-full text-left px-3 py-2 text-xs hover:bg-gray-700 whitespace-nowrap"
                 >
-                  {BUCKET_INFO[b.id]?.icon} {b.name}
+                  {getBucketIcon(b.orientation)} {b.name}
                 </button>
               ))}
             </div>
@@ -254,7 +259,7 @@ const ImageCropCard = ({ image, bucket, onCropChange, onMoveToBucket, buckets, o
         
         {/* 可拖动的图片 */}
         <img
-          src={getImageUrl(image.path)}
+          src={getImageUrl(image.path, GRID_IMAGE_SIZE)}
           alt={image.filename}
           className={`absolute z-10 ${isLocked ? 'cursor-not-allowed' : 'cursor-move'}`}
           style={{
@@ -314,6 +319,10 @@ const ImageGridWithCrop = ({ bucketId }) => {
   const updateImageCrop = useImageStore(state => state.updateImageCrop);
   const moveImageToBucket = useImageStore(state => state.moveImageToBucket);
   const saveAllCrops = useImageStore(state => state.saveAllCrops);
+  const sessionPage = useImageStore(state => state.sessionPages?.[bucketId]);
+  // 恢复的会话中尚未读取过的桶 (切换时开始读取第一页)
+  const pagePending = useImageStore(state => state.sessionPages !== null && !state.sessionPages[bucketId]);
+  const loadSessionPage = useImageStore(state => state.loadSessionPage);
   
   const bucket = buckets.find(b => b.id === bucketId) || buckets[0];
   
@@ -331,6 +340,21 @@ const ImageGridWithCrop = ({ bucketId }) => {
   useEffect(() => {
     setSortedImages(bucketImages);
   }, [bucketId, images.length]);
+
+  // 恢复的会话: 滚动到网格底部时读取下一页
+  const hasMore = !!sessionPage?.cursor;
+  const loadMoreRef = useRef(null);
+  useEffect(() => {
+    const sentinel = loadMoreRef.current;
+    if (!sentinel || !hasMore) return;
+    const observer = new IntersectionObserver((entries) => {
+      if (entries[0].isIntersecting) {
+        loadSessionPage(bucketId);
+      }
+    }, { rootMargin: '600px' });
+    observer.observe(sentinel);
+    return () => observer.disconnect();
+  }, [bucketId, hasMore, images.length, loadSessionPage]);
   
   const handleCropChange = useCallback((imagePath, cropParams) => {
     updateImageCrop(imagePath, cropParams);
@@ -375,6 +399,9 @@ const ImageGridWithCrop = ({ bucketId }) => {
   if (!bucket) return <div className="p-4 text-gray-500">请先扫描文件夹</div>;
   
   if (bucketImages.length === 0) {
+    if (pagePending || sessionPage?.loading || hasMore) {
+      return <div className="p-4 text-gray-500">加载中...</div>;
+    }
     return (
       <div className="flex flex-col items-center justify-center h-64 text-gray-500">
         <span className="text-4xl mb-4">📭</span>
@@ -429,6 +456,11 @@ const ImageGridWithCrop = ({ bucketId }) => {
           />
         ))}
       </div>
+      {hasMore && (
+        <div ref={loadMoreRef} className="py-6 text-center text-sm text-gray-500">
+          {sessionPage.loading ? '加载中...' : `已显示 ${bucketImages.length} / ${sessionPage.total} 张`}
+        </div>
+      )}
     </div>
   );
 };
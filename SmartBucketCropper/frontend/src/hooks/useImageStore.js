@@ -3,6 +3,20 @@
  * 管理图片、桶配置和裁剪状态
  */
 import { create } from 'zustand';
+import {
+  getSession,
+  getSessionImages,
+  patchSessionImages,
+  patchSessionBucket,
+  deleteSession,
+} from '../api/client';
+
+// 本地保存的会话 ID 与输出目录 (刷新页面后恢复)
+const SESSION_STORAGE_KEY = 'sbc.sessionId';
+const OUTPUT_DIR_STORAGE_KEY = 'sbc.outputDir';
+
+// 恢复会话时每页读取的图片数 (按桶分页，滚动到底部或切换桶时读取下一页)
+const SESSION_PAGE_SIZE = 500;
 
 /**
  * 四舍五入到最近的 64 倍数
@@ -21,12 +35,120 @@ const useImageStore = create((set, get) => ({
   toasts: [],
   cropModalOpen: false,
   selectedImage: null,
+  scanProgress: null,
+  sessionId: localStorage.getItem(SESSION_STORAGE_KEY),
+  // 恢复的会话按桶分页读取: { 桶 ID: { cursor, total, loading } }；扫描得到的数据已全部在内存中，为 null
+  sessionPages: null,
 
   // 设置文件夹路径
   setFolderPath: (path) => set({ folderPath: path }),
 
   // 设置输出目录
-  setOutputDir: (dir) => set({ outputDir: dir }),
+  setOutputDir: (dir) => {
+    localStorage.setItem(OUTPUT_DIR_STORAGE_KEY, dir);
+    set({ outputDir: dir });
+  },
+
+  // 设置会话 ID
+  setSessionId: (sessionId) => {
+    if (sessionId) {
+      localStorage.setItem(SESSION_STORAGE_KEY, sessionId);
+    } else {
+      localStorage.removeItem(SESSION_STORAGE_KEY);
+    }
+    set({ sessionId });
+  },
+
+  // 丢弃当前会话 (开始新的扫描或重置时删除服务端的旧会话)
+  discardSession: () => {
+    const { sessionId } = get();
+    if (sessionId) {
+      // 删除失败不影响新的扫描 (服务端会按过期时间清理)
+      deleteSession(sessionId).catch(() => {});
+    }
+    get().setSessionId(null);
+  },
+
+  // 同步图片改动到会话 (只提交改动的图片)
+  syncImageEdits: (edits) => {
+    const { sessionId } = get();
+    if (!sessionId || edits.length === 0) return;
+    patchSessionImages(sessionId, edits).catch((error) => {
+      get().addToast(`同步到服务端失败: ${error.message}`, 'error');
+    });
+  },
+
+  // 从服务端恢复会话 (只读取第一个桶的第一页，其余按需读取)
+  restoreSession: async () => {
+    const { sessionId } = get();
+    if (!sessionId) return false;
+    try {
+      const session = await getSession(sessionId);
+      const activeBucket = session.buckets[0]?.id ?? 'A';
+      set({
+        images: [],
+        sessionPages: {},
+        buckets: session.buckets.map((bucket) => ({
+          ...bucket,
+          originalWidth: bucket.width,
+          originalHeight: bucket.height,
+        })),
+        activeBucket,
+        folderPath: session.folder_path,
+        outputDir: localStorage.getItem(OUTPUT_DIR_STORAGE_KEY) || `${session.folder_path}\\output`,
+        error: null,
+      });
+      await get().loadSessionPage(activeBucket);
+      return true;
+    } catch (error) {
+      // 会话已删除或数据库已重建
+      set({ sessionPages: null });
+      get().setSessionId(null);
+      return false;
+    }
+  },
+
+  // 读取恢复的会话中某个桶的下一页 (已读完或正在读取时忽略)
+  loadSessionPage: async (bucketId) => {
+    const { sessionId, sessionPages } = get();
+    if (!sessionId || !sessionPages) return;
+    const page = sessionPages[bucketId];
+    if (page && (page.loading || !page.cursor)) return;
+
+    set((state) => ({
+      sessionPages: { ...state.sessionPages, [bucketId]: { ...page, loading: true } },
+    }));
+    try {
+      const result = await getSessionImages(sessionId, {
+        bucket: bucketId,
+        cursor: page?.cursor,
+        limit: SESSION_PAGE_SIZE,
+      });
+      set((state) => {
+        if (!state.sessionPages) return {};
+        // 已在内存中的图片 (例如从其他桶移入) 以本地状态为准
+        const loaded = new Set(state.images.map((img) => img.id));
+        const added = result.images
+          .filter((img) => !loaded.has(img.id))
+          .map((img) => ({ ...img, savedAt: img.cropped ? 0 : null }));
+        return {
+          images: state.images.concat(added),
+          sessionPages: {
+            ...state.sessionPages,
+            [bucketId]: { cursor: result.next_cursor, total: result.total, loading: false },
+          },
+        };
+      });
+    } catch (error) {
+      set((state) => ({
+        sessionPages: state.sessionPages && {
+          ...state.sessionPages,
+          [bucketId]: { ...page, loading: false },
+        },
+      }));
+      get().addToast(`读取图片失败: ${error.message}`, 'error');
+    }
+  },
 
   // 设置加载状态
   setLoading: (loading) => set({ isLoading: loading }),
@@ -38,6 +160,7 @@ const useImageStore = create((set, get) => ({
   initializeData: (data) => {
     const { images, buckets, total_count } = data;
     set({
+      sessionPages: null,
       images: images.map((img, index) => ({
         ...img,
         id: index,
@@ -53,8 +176,76 @@ const useImageStore = create((set, get) => ({
     });
   },
 
-  // 切换活动桶
-  setActiveBucket: (bucketId) => set({ activeBucket: bucketId }),
+  // 开始流式扫描，清空旧数据
+  beginStreamingScan: () => {
+    set({
+      images: [],
+      buckets: [],
+      sessionPages: null,
+      scanProgress: { files: 0, scanned: 0, images: 0 },
+      error: null,
+    });
+    get().discardSession();
+  },
+
+  // 处理流式扫描事件
+  applyScanEvent: (event) => {
+    switch (event.type) {
+      case 'images':
+        set((state) => ({
+          images: state.images.concat(
+            event.images.map((img, i) => ({
+              ...img,
+              id: event.offset + i,
+              cropped: false,
+              crop_params: null,
+            }))
+          ),
+        }));
+        break;
+      case 'stats':
+        set({ scanProgress: event });
+        break;
+      case 'buckets':
+        set({
+          buckets: event.buckets.map((bucket) => ({
+            ...bucket,
+            originalWidth: bucket.width,
+            originalHeight: bucket.height,
+          })),
+        });
+        break;
+      case 'assign':
+        set((state) => {
+          const images = state.images.slice();
+          event.assigned_bucket.forEach((bucketId, i) => {
+            const index = event.offset + i;
+            images[index] = {
+              ...images[index],
+              assigned_bucket: bucketId,
+              default_crop: event.default_crop[i],
+            };
+          });
+          return { images };
+        });
+        break;
+      case 'done':
+        set({ scanProgress: null });
+        get().setSessionId(event.session_id);
+        break;
+      default:
+        break;
+    }
+  },
+
+  // 切换活动桶 (恢复的会话中首次切换到某个桶时读取第一页)
+  setActiveBucket: (bucketId) => {
+    set({ activeBucket: bucketId });
+    const { sessionPages } = get();
+    if (sessionPages && !sessionPages[bucketId]) {
+      get().loadSessionPage(bucketId);
+    }
+  },
 
   // 更新桶尺寸
   updateBucketSize: (bucketId, width, height) => {
@@ -102,6 +293,13 @@ const useImageStore = create((set, get) => ({
 
     set({ buckets: updatedBuckets, images: updatedImages });
 
+    const { sessionId } = get();
+    if (sessionId) {
+      patchSessionBucket(sessionId, bucketId, newWidth, newHeight).catch((error) => {
+        get().addToast(`同步到服务端失败: ${error.message}`, 'error');
+      });
+    }
+
     // 如果尺寸被修正，显示提示
     if (wasModified) {
       get().addToast('已自动对齐到 64 倍数以优化显存效率', 'info');
@@ -129,6 +327,7 @@ const useImageStore = create((set, get) => ({
         : img
     );
     set({ images: updatedImages, cropModalOpen: false, selectedImage: null });
+    get().syncImageEdits([{ id: imageId, cropped: true, crop_params: cropParams }]);
     get().addToast('��剪已保存', 'success');
   },
 
@@ -141,6 +340,11 @@ const useImageStore = create((set, get) => ({
         : img
     );
     set({ images: updatedImages });
+    get().syncImageEdits(
+      images
+        .filter((img) => img.path === imagePath)
+        .map((img) => ({ id: img.id, cropped: true, crop_params: cropParams }))
+    );
   },
 
   // 移动图片到其他桶
@@ -187,6 +391,11 @@ const useImageStore = create((set, get) => ({
     }));
 
     set({ images: updatedImages, buckets: updatedBuckets });
+    get().syncImageEdits(
+      images
+        .filter((img) => img.path === imagePath)
+        .map((img) => ({ id: img.id, assigned_bucket: newBucketId }))
+    );
     get().addToast(`已移动到 ${bucket.name}`, 'success');
   },
 
@@ -194,8 +403,12 @@ const useImageStore = create((set, get) => ({
   saveAllCrops: (bucketId) => {
     const { images } = get();
     const now = Date.now();
+    const edits = [];
     const updatedImages = images.map((img) => {
       if (img.assigned_bucket === bucketId && img.default_crop) {
+        if (!img.cropped) {
+          edits.push({ id: img.id, cropped: true, crop_params: img.crop_params || img.default_crop });
+        }
         // 如果还没有裁剪参数，使用默认裁剪
         return {
           ...img,
@@ -207,6 +420,7 @@ const useImageStore = create((set, get) => ({
       return img;
     });
     set({ images: updatedImages });
+    get().syncImageEdits(edits);
     get().addToast('已保存当前桶的所有裁剪', 'success');
   },
 
@@ -233,6 +447,7 @@ const useImageStore = create((set, get) => ({
         : img
     );
     set({ images: updatedImages });
+    get().syncImageEdits([{ id: imageId, cropped: false }]);
   },
 
   // 获取当前桶的图片
@@ -241,10 +456,24 @@ const useImageStore = create((set, get) => ({
     return images.filter((img) => img.assigned_bucket === bucketId);
   },
 
-  // 获取已裁剪的图片数量
+  // 获取已裁剪的图片数量 (恢复的会话中尚未读取的桶使用会话概要中的数量)
   getCroppedCount: () => {
-    const { images } = get();
-    return images.filter((img) => img.cropped).length;
+    const { images, buckets, sessionPages } = get();
+    const loaded = images.filter((img) => img.cropped).length;
+    if (!sessionPages) return loaded;
+    return buckets
+      .filter((bucket) => !sessionPages[bucket.id])
+      .reduce((count, bucket) => count + (bucket.cropped_count || 0), loaded);
+  },
+
+  // 桶中的图片数 (恢复的会话中未读完的桶使用服务端的总数)
+  getBucketImageCount: (bucketId) => {
+    const { images, buckets, sessionPages } = get();
+    const loaded = images.filter((img) => img.assigned_bucket === bucketId).length;
+    if (!sessionPages) return loaded;
+    const page = sessionPages[bucketId];
+    if (!page) return buckets.find((b) => b.id === bucketId)?.image_count ?? loaded;
+    return page.cursor ? Math.max(loaded, page.total) : loaded;
   },
 
   // 获取桶配置 (用于导出)
@@ -292,6 +521,7 @@ const useImageStore = create((set, get) => ({
   // 重置所有状态
   reset: () => {
     set({
+      sessionPages: null,
       images: [],
       buckets: [],
       activeBucket: 'A',
@@ -301,7 +531,9 @@ const useImageStore = create((set, get) => ({
       error: null,
       cropModalOpen: false,
       selectedImage: null,
+      scanProgress: null,
     });
+    get().discardSession();
   },
 }));
 